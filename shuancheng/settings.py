@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os
+import platform
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'xicheba.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,9 +85,36 @@ DATABASES = {
         'PASSWORD': 'xicheba@Zhaishuancheng$$',
         'HOST': '10.0.0.240',
         'PORT': '3306',
+        # 持久连接: 连接在请求之间复用的秒数, 默认 0 每个请求新建连接
+        # 只在 WSGI(runserver、gunicorn/uwsgi 同步 worker)下设置 XICHEBA_DB_CONN_MAX_AGE=60 开启: 连接按线程保存,
+        # ASGI 下每个请求可能在不同线程执行, 持久连接不会被复用且不会及时关闭, 会耗尽 MySQL 的 max_connections
+        'CONN_MAX_AGE': int(os.environ.get('XICHEBA_DB_CONN_MAX_AGE', '0')),
+        # 复用连接前检查连接是否可用
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# 只读副本: 设置 XICHEBA_DB_REPLICA_HOST 后, 明细列表与报表的读请求路由到副本
+if os.environ.get('XICHEBA_DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['XICHEBA_DB_REPLICA_HOST'],
+        'PORT': os.environ.get('XICHEBA_DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# 本地收银队列: 设置 XICHEBA_POS_JOURNAL 为终端上的 SQLite 文件路径后, 出纳管理的保存写入本地队列,
+# 由 python manage.py sync_pos 批量同步到 default, 前台保存不等待主库
+if os.environ.get('XICHEBA_POS_JOURNAL'):
+    DATABASES['pos_journal'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['XICHEBA_POS_JOURNAL'],
+    }
+# 终端名称, 记录在队列与同步回执中
+XICHEBA_POS_TERMINAL = os.environ.get('XICHEBA_POS_TERMINAL', platform.node())
+
+DATABASE_ROUTERS = ['xicheba.routers.PosJournalRouter', 'xicheba.routers.PrimaryReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -130,3 +159,70 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# 共享缓存后端: locmem(进程内 LRU) file(本机多个 worker 共享) redis(多台服务器共享, 需要安装 redis)
+XICHEBA_CACHE_BACKEND = os.environ.get('XICHEBA_CACHE_BACKEND', 'locmem')
+SHARED_CACHES: dict = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'xicheba-shared',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('XICHEBA_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('XICHEBA_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': SHARED_CACHES[XICHEBA_CACHE_BACKEND],
+}
+# 参考数据(枚举、用户显示名称)缓存的 CACHES 别名, None 时只使用进程内缓存
+XICHEBA_REFERENCE_CACHE = 'shared'
+# changelist 总数缓存的 CACHES 别名
+XICHEBA_COUNT_CACHE = 'shared'
+
+# 本地收银模式下主库不可用时, 已登录的收银员仍可新增出纳明细: 会话保存在签名 cookie 中,
+# 登录用户(含权限)与材料缓存在终端本机的文件缓存中; 登录、修改明细与其他页面仍需要主库
+# 主库可用时执行 python manage.py warm_cache 刷新终端缓存, 其他服务器上修改的材料价格在刷新或过期后生效
+if os.environ.get('XICHEBA_POS_JOURNAL'):
+    SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+    AUTHENTICATION_BACKENDS = ['xicheba.pos.PosCachedBackend']
+    CACHES['pos'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('XICHEBA_POS_CACHE_LOCATION', os.path.join(
+            os.path.dirname(os.path.abspath(os.environ['XICHEBA_POS_JOURNAL'])), 'xicheba_pos_cache')),
+    }
+# 终端缓存的有效秒数
+XICHEBA_POS_CACHE_TIMEOUT = int(os.environ.get('XICHEBA_POS_CACHE_TIMEOUT', str(24 * 3600)))
+
+# 请求指标采样率 0~1, 0 关闭
+XICHEBA_METRICS_SAMPLE_RATE = float(os.environ.get('XICHEBA_METRICS_SAMPLE_RATE', '0.05'))
+# 每个采样请求记录的最慢 SQL 条数
+XICHEBA_METRICS_SLOW_QUERIES = 3
+# /api/metrics/ 的访问令牌(Authorization: Bearer <token>), 为空时只允许管理员访问
+XICHEBA_METRICS_TOKEN = os.environ.get('XICHEBA_METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'xicheba.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
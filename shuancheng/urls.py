@@ -14,10 +14,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, include
 from django.contrib.staticfiles.views import serve
 
 urlpatterns = [
     path('eGllY2hlYmEK/', admin.site.urls),
+    path('api/', include('xicheba.urls')),
     path('favicon.ico', serve, {'path': 'favicon.ico'})
 ]
@@ -69,25 +69,6 @@ CREATE TABLE `django_session` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 
--- shuancheng.xicheba_cashier definition
-
-CREATE TABLE `xicheba_cashier` (
-  `id` bigint(20) NOT NULL AUTO_INCREMENT,
-  `action` varchar(10) NOT NULL,
-  `number` int(11) NOT NULL,
-  `price_type` varchar(20) NOT NULL,
-  `money` int(11) NOT NULL,
-  `remarks` varchar(100) DEFAULT NULL,
-  `create_time` datetime(6) NOT NULL,
-  `update_time` datetime(6) NOT NULL,
-  `name` varchar(30) NOT NULL,
-  `earnings` int(11) NOT NULL,
-  `is_deleted` tinyint(1) NOT NULL,
-  `create_by_user` int(11) NOT NULL,
-  PRIMARY KEY (`id`)
-) ENGINE=InnoDB AUTO_INCREMENT=15 DEFAULT CHARSET=utf8mb4;
-
-
 -- shuancheng.xicheba_eventtype definition
 
 CREATE TABLE `xicheba_eventtype` (
@@ -110,9 +91,12 @@ CREATE TABLE `xicheba_extraproject` (
   `create_time` datetime(6) NOT NULL,
   `update_time` datetime(6) NOT NULL,
   `action` varchar(30) NOT NULL,
-  `create_by_user` int(11) NOT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
   `is_deleted` tinyint(1) NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `extraproject_owner_live_idx` (`create_by_user`,`is_deleted`,`create_time`),
+  KEY `extraproject_create_time_idx` (`create_time`),
+  CONSTRAINT `xicheba_extraproject_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4;
 
 
@@ -121,28 +105,67 @@ CREATE TABLE `xicheba_extraproject` (
 CREATE TABLE `xicheba_materials` (
   `id` bigint(20) NOT NULL AUTO_INCREMENT,
   `name` varchar(15) NOT NULL,
+  `name_pinyin` varchar(128) NOT NULL,
+  `name_initials` varchar(15) NOT NULL,
   `specifications` varchar(15) DEFAULT NULL,
   `original_price` int(11) NOT NULL,
   `price` int(11) NOT NULL,
   `discount_price` int(11) NOT NULL,
   `number` int(11) NOT NULL,
+  `reorder_threshold` int(11) NOT NULL,
+  `is_low_stock` tinyint(1) NOT NULL,
   `brand` varchar(10) NOT NULL,
   `functions_and_performance` varchar(20) DEFAULT NULL,
   `remarks` varchar(100) DEFAULT NULL,
   `create_time` datetime(6) NOT NULL,
   `update_time` datetime(6) NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `xicheba_materials_name_idx` (`name`),
+  KEY `xicheba_materials_name_pinyin_idx` (`name_pinyin`),
+  KEY `xicheba_materials_name_initials_idx` (`name_initials`),
+  KEY `xicheba_materials_is_low_stock_idx` (`is_low_stock`)
 ) ENGINE=InnoDB AUTO_INCREMENT=6 DEFAULT CHARSET=utf8mb4;
 
 
+-- shuancheng.xicheba_cashier definition
+
+CREATE TABLE `xicheba_cashier` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `action` varchar(10) NOT NULL,
+  `number` int(11) NOT NULL,
+  `price_type` varchar(20) NOT NULL,
+  `money` int(11) NOT NULL,
+  `remarks` varchar(100) DEFAULT NULL,
+  `create_time` datetime(6) NOT NULL,
+  `update_time` datetime(6) NOT NULL,
+  `name` bigint(20) NOT NULL,
+  `earnings` int(11) NOT NULL,
+  `unit_price` int(11) NOT NULL DEFAULT 0,
+  `original_price` int(11) NOT NULL DEFAULT 0,
+  `is_deleted` tinyint(1) NOT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `xicheba_cashier_name_fk_xicheba_materials_id` (`name`),
+  KEY `cashier_owner_live_idx` (`create_by_user`,`is_deleted`,`create_time`),
+  KEY `cashier_create_time_idx` (`create_time`),
+  KEY `cashier_earnings_status_idx` (`action`,`earnings`,`price_type`),
+  KEY `cashier_update_time_idx` (`update_time`,`create_time`),
+  CONSTRAINT `xicheba_cashier_name_fk_xicheba_materials_id` FOREIGN KEY (`name`) REFERENCES `xicheba_materials` (`id`),
+  CONSTRAINT `xicheba_cashier_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=15 DEFAULT CHARSET=utf8mb4;
+
+
 -- shuancheng.xicheba_users definition
 
 CREATE TABLE `xicheba_users` (
   `id` bigint(20) NOT NULL AUTO_INCREMENT,
   `name` varchar(20) NOT NULL,
+  `name_pinyin` varchar(128) NOT NULL,
+  `name_initials` varchar(20) NOT NULL,
   `sex` varchar(1) NOT NULL,
   `user_level` varchar(10) NOT NULL,
   `phone_number` varchar(11) DEFAULT NULL,
+  `phone_number_reversed` varchar(11) DEFAULT NULL,
   `make_collections` int(11) NOT NULL,
   `payment_methods` varchar(10) NOT NULL,
   `member_frequency` int(11) NOT NULL,
@@ -150,12 +173,150 @@ CREATE TABLE `xicheba_users` (
   `remarks` varchar(100) DEFAULT NULL,
   `create_time` datetime(6) NOT NULL,
   `update_time` datetime(6) NOT NULL,
-  `create_by_user` int(11) NOT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
   `is_deleted` tinyint(1) NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `xicheba_users_name_idx` (`name`),
+  KEY `xicheba_users_name_pinyin_idx` (`name_pinyin`),
+  KEY `xicheba_users_name_initials_idx` (`name_initials`),
+  KEY `xicheba_users_phone_number_idx` (`phone_number`),
+  KEY `xicheba_users_phone_number_reversed_idx` (`phone_number_reversed`),
+  KEY `users_owner_live_idx` (`create_by_user`,`is_deleted`,`create_time`),
+  KEY `users_create_time_idx` (`create_time`),
+  KEY `users_frequency_status_idx` (`user_level`,`using_frequency`,`member_frequency`),
+  CONSTRAINT `xicheba_users_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4;
 
 
+-- shuancheng.xicheba_stockmovement definition
+
+CREATE TABLE `xicheba_stockmovement` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `number` int(11) NOT NULL,
+  `balance` int(11) NOT NULL,
+  `create_time` datetime(6) NOT NULL,
+  `cashier_id` bigint(20) DEFAULT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `xicheba_stockmovement_cashier_id_fk_xicheba_cashier_id` (`cashier_id`),
+  KEY `xicheba_stockmovement_create_by_user_fk_auth_user_id` (`create_by_user`),
+  KEY `xicheba_stockmovement_materials_id_fk_xicheba_materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_stockmovement_cashier_id_fk_xicheba_cashier_id` FOREIGN KEY (`cashier_id`) REFERENCES `xicheba_cashier` (`id`),
+  CONSTRAINT `xicheba_stockmovement_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`),
+  CONSTRAINT `xicheba_stockmovement_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- shuancheng.xicheba_stockcheckpoint definition
+
+CREATE TABLE `xicheba_stockcheckpoint` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `opening` int(11) NOT NULL,
+  `closed` int(11) NOT NULL,
+  `cutoff` datetime(6) DEFAULT NULL,
+  `checked_time` datetime(6) DEFAULT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_stockcheckpoint_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- shuancheng.xicheba_cashierdailysummary definition
+
+CREATE TABLE `xicheba_cashierdailysummary` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `day` date NOT NULL,
+  `count` int(11) NOT NULL,
+  `number` int(11) NOT NULL,
+  `money` int(11) NOT NULL,
+  `action` varchar(10) NOT NULL,
+  `earnings` int(11) NOT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `cashier_daily_summary_uniq` (`day`,`materials_id`,`action`,((coalesce(`create_by_user`,0)))),
+  KEY `xicheba_cashierdailysummary_create_by_user_fk_auth_user_id` (`create_by_user`),
+  KEY `xicheba_cashierdailysummary_materials_id_fk_xicheba_materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_cashierdailysummary_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`),
+  CONSTRAINT `xicheba_cashierdailysummary_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- shuancheng.xicheba_extraprojectdailysummary definition
+
+CREATE TABLE `xicheba_extraprojectdailysummary` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `day` date NOT NULL,
+  `count` int(11) NOT NULL,
+  `number` int(11) NOT NULL,
+  `money` int(11) NOT NULL,
+  `action` varchar(30) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `extraproject_daily_summary_uniq` (`day`,`action`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- shuancheng.xicheba_changelistdateindex definition
+
+CREATE TABLE `xicheba_changelistdateindex` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `model` varchar(50) NOT NULL,
+  `day` date NOT NULL,
+  `count` int(11) NOT NULL,
+  `live_count` int(11) NOT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `changelist_date_index_uniq` (`model`,`day`,((coalesce(`create_by_user`,0)))),
+  KEY `xicheba_changelistdateindex_create_by_user_fk_auth_user_id` (`create_by_user`),
+  CONSTRAINT `xicheba_changelistdateindex_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- shuancheng.xicheba_archivedrecord definition
+
+CREATE TABLE `xicheba_archivedrecord` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `model` varchar(50) NOT NULL,
+  `object_id` bigint(20) NOT NULL,
+  `data` json NOT NULL,
+  `delete_time` datetime(6) NOT NULL,
+  `create_time` datetime(6) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `archivedrecord_object_idx` (`model`,`object_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- shuancheng.xicheba_lowstocknotification definition
+
+CREATE TABLE `xicheba_lowstocknotification` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `number` int(11) NOT NULL,
+  `reorder_threshold` int(11) NOT NULL,
+  `sent_time` datetime(6) DEFAULT NULL,
+  `create_time` datetime(6) NOT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `lowstock_outbox_idx` (`sent_time`,`id`),
+  KEY `xicheba_lowstocknotification_materials_id_fk_xicheba_materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_lowstocknotification_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- shuancheng.xicheba_possyncreceipt definition
+
+CREATE TABLE `xicheba_possyncreceipt` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `idempotency_key` varchar(32) NOT NULL,
+  `terminal` varchar(50) NOT NULL,
+  `object_id` bigint(20) NOT NULL,
+  `create_time` datetime(6) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `idempotency_key` (`idempotency_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
 -- shuancheng.auth_permission definition
 
 CREATE TABLE `auth_permission` (
@@ -227,4 +388,32 @@ CREATE TABLE `auth_group_permissions` (
   KEY `auth_group_permissio_permission_id_84c5c92e_fk_auth_perm` (`permission_id`),
   CONSTRAINT `auth_group_permissio_permission_id_84c5c92e_fk_auth_perm` FOREIGN KEY (`permission_id`) REFERENCES `auth_permission` (`id`),
   CONSTRAINT `auth_group_permissions_group_id_b120cbf9_fk_auth_group_id` FOREIGN KEY (`group_id`) REFERENCES `auth_group` (`id`)
-) ENGINE=InnoDB AUTO_INCREMENT=21 DEFAULT CHARSET=utf8mb4;
\ No newline at end of file
+) ENGINE=InnoDB AUTO_INCREMENT=21 DEFAULT CHARSET=utf8mb4;
+
+
+/*
+ 已有数据库的升级语句按顺序见 xicheba_upgrade.sql
+*/
+
+
+/*
+ 可选升级: 出纳、散项明细按月分区(MySQL 8.0), 由 python manage.py partition_ledger --convert 按已有数据生成并执行
+ 分区表不支持外键, 主键需要包含分区列; 之后每月执行 python manage.py partition_ledger 预建分区,
+ python manage.py partition_ledger --drop-before YYYY-MM --exchange 将历史分区交换到单独的表后删除
+
+ALTER TABLE `xicheba_stockmovement` DROP FOREIGN KEY `xicheba_stockmovement_cashier_id_fk_xicheba_cashier_id`;
+ALTER TABLE `xicheba_cashier`
+  DROP FOREIGN KEY `xicheba_cashier_create_by_user_fk_auth_user_id`,
+  DROP FOREIGN KEY `xicheba_cashier_name_fk_xicheba_materials_id`;
+ALTER TABLE `xicheba_cashier` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `create_time`);
+ALTER TABLE `xicheba_cashier` PARTITION BY RANGE COLUMNS(`create_time`) (
+  PARTITION `p202610` VALUES LESS THAN ('2026-10-31 16:00:00'),
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+ALTER TABLE `xicheba_extraproject` DROP FOREIGN KEY `xicheba_extraproject_create_by_user_fk_auth_user_id`;
+ALTER TABLE `xicheba_extraproject` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `create_time`);
+ALTER TABLE `xicheba_extraproject` PARTITION BY RANGE COLUMNS(`create_time`) (
+  PARTITION `p202610` VALUES LESS THAN ('2026-10-31 16:00:00'),
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+*/
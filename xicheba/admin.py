@@ -1,8 +1,21 @@
 from django.contrib import admin
-from .models import Users, Materials, Cashier, ExtraProject, EventType
+from .models import Users, Materials, Cashier, ExtraProject, EventType, StockMovement
+from .models import CashierDailySummary, ExtraProjectDailySummary, LowStockNotification, ChangeListDateIndex
 from .models import Choices as Cs
-from .form import RemarksModelForm
+from .form import RemarksModelForm, PosCashierForm
+from .export import csv_response, xlsx_response
+from .registry import count_cache
+from .paginator import KeysetPaginator
+from . import pos
 from django.contrib import messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponseRedirect
+from django.urls import reverse
+from django.utils.functional import cached_property
 # Register your models here.
 admin.site.site_title = '洗车吧管理系统'
 admin.site.site_header = '洗车吧管理系统'
@@ -11,6 +24,144 @@ admin.site.disable_action('delete_selected')
 admin.site.empty_value_display = '-'
 
 
+class PrefetchChangeList(ChangeList):
+    """
+    当前页的创建者名称一次查询获取
+    """
+
+    def get_results(self, request):
+        super().get_results(request)
+        if 'create_by_user_name' in self.list_display:
+            self.model.prefetch_create_by_user_name(self.result_list)
+
+
+class CachedChangeList(PrefetchChangeList):
+    """
+    没有搜索与其他过滤条件时, date_hierarchy 的年/月/日列表由 ChangeListDateIndex 提供, 不扫描明细表
+    """
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.date_index = self.get_date_index(request)
+
+    def get_date_index(self, request):
+        """
+        :param request:
+        :return: 当前 年/月 下有数据的 ChangeListDateIndex queryset, 不能使用索引时为 None
+        """
+        if not self.date_hierarchy or self.query:
+            return None
+        lookups: dict = {F'{self.date_hierarchy}__{part}': part for part in ('year', 'month', 'day')}
+        params: dict = self.get_filters_params()
+        if set(params) - lookups.keys():
+            return None
+        queryset = ChangeListDateIndex.get_queryset_for(self.model, request.user)
+        return queryset.filter(**{F'day__{part}': params[lookup] for lookup, part in lookups.items() if lookup in params})
+
+
+class KeysetMixin(ChangeList):
+    """
+    按排序列定位翻页: ?cursor= 指向上一页的第一行/最后一行, 不执行 COUNT(*) 与 OFFSET, 深页与第一页成本相同
+    排序不是本模型非空的列(如按外键、可为空的列排序)时退回页码分页
+    result_count 为本页行数, 有其他页时 actions.html 提供不显示总数的"选择全部符合条件的", 动作作用于过滤后的全部行
+    """
+    CURSOR_VAR: str = 'cursor'
+
+    def get_filters_params(self, params=None):
+        lookup_params: dict = super().get_filters_params(params)
+        lookup_params.pop(self.CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        # 过滤、排序、date_hierarchy 的链接回到第一页
+        cursor: str = self.params.pop(self.CURSOR_VAR, None)
+        ordering: list = KeysetPaginator.get_keyset_ordering(self.model, self.queryset.query.order_by)
+        self.keyset_page = None
+        if ordering is None:
+            return super().get_results(request)
+        paginator = KeysetPaginator(self.queryset, self.list_per_page, ordering)
+        try:
+            page = paginator.page(cursor or None)
+        except ValueError:
+            raise IncorrectLookupParameters
+        self.result_count = len(page)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = page.object_list
+        self.can_show_all = False
+        self.multi_page = page.has_next() or page.has_previous()
+        self.paginator = paginator
+        self.keyset_page = page
+
+
+class KeysetChangeList(CachedChangeList, KeysetMixin):
+    """
+    CachedChangeList 的按排序列定位翻页版本
+    """
+
+
+class CachedCountPaginator(Paginator):
+    """
+    总数由 count_cache 缓存, 翻页时不重复执行 COUNT(*)
+    """
+
+    def __init__(self, *args, timeout: int = 30, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout: int = timeout
+
+    @cached_property
+    def count(self) -> int:
+        return count_cache.count(self.object_list, self.timeout)
+
+
+@admin.action(description='导出所选 %(verbose_name_plural)s 为 CSV')
+def export_csv(modeladmin, request, queryset):
+    return csv_response(queryset)
+
+
+@admin.action(description='导出所选 %(verbose_name_plural)s 为 XLSX')
+def export_xlsx(modeladmin, request, queryset):
+    try:
+        return xlsx_response(queryset)
+    except ModuleNotFoundError:
+        messages.add_message(request, messages.ERROR, '导出失败：未安装 xlsxwriter')
+
+
+class StatusListFilter(admin.SimpleListFilter):
+    """
+    状态过滤, 使用模型 get_<parameter_name>_conditions 中原始列的比较条件, 可以命中索引
+    """
+    status_choices = None
+
+    def lookups(self, request, model_admin):
+        return self.status_choices.choices
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        try:
+            status: int = int(self.value())
+        except ValueError:
+            raise IncorrectLookupParameters
+        if status not in self.status_choices.values:
+            raise IncorrectLookupParameters
+        conditions: dict = getattr(queryset.model, F'get_{self.parameter_name}_conditions')()
+        return queryset.filter(queryset.model.build_status_filter(conditions, status))
+
+
+class FrequencyStatusFilter(StatusListFilter):
+    title = '消费次数状态'
+    parameter_name = 'frequency_status'
+    status_choices = Cs.FrequencyStatus
+
+
+class EarningsStatusFilter(StatusListFilter):
+    title = '收益状态'
+    parameter_name = 'earnings_status'
+    status_choices = Cs.EarningsStatus
+
+
 class CustomAdminAction:
     """
     # 受 Python MRO 顺序,继承时  需要把CustomAdminAction类继承放在第一位
@@ -19,11 +170,47 @@ class CustomAdminAction:
     """
     # 模型手动注册
     allow_access_class: tuple = ('UsersAdmin', 'CashierAdmin', 'ExtraProjectAdmin')
+    # 大表 changelist: 总数缓存 count_cache_timeout 秒(写入时失效), date_hierarchy 使用按日索引
+    # 开启时同时设置 show_full_result_count = False, 避免每页再执行一次未过滤的 COUNT(*)
+    cached_changelist: bool = False
+    count_cache_timeout: int = 30
+    # 按 ordering(默认 -pk)定位翻页, 只有上一页/下一页, 不显示总数, 需要 ordering 列上有索引; 默认关闭, 按 admin 开启
+    keyset_pagination: bool = False
 
     def get_class_name(self):
         # 实例的类名
         return self.__class__.__name__
 
+    def get_changelist(self, request, **kwargs):
+        if self.keyset_pagination:
+            return KeysetChangeList
+        if self.cached_changelist:
+            return CachedChangeList
+        return PrefetchChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.cached_changelist:
+            return CachedCountPaginator(queryset, per_page, orphans, allow_empty_first_page,
+                                        timeout=self.count_cache_timeout)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_queryset(self, request):
+        """
+        默认管理器 objects 只返回未逻辑删除的明细
+        超级用户通过 all_objects 可查看逻辑删除的明细, 非 超级用户只查询属于当前登录用户的明细
+        :param request:
+        :return:
+        """
+        if not hasattr(self.model, 'all_objects'):
+            return super().get_queryset(request)
+        if request.user.is_superuser:
+            qs = self.model.all_objects.get_queryset()
+            ordering = self.get_ordering(request)
+            if ordering:
+                qs = qs.order_by(*ordering)
+            return qs
+        return super().get_queryset(request).filter(create_by_user=request.user.id)
+
     def has_change_permission(self, request, obj=None):
 
         if request.user.is_superuser:
@@ -45,37 +232,69 @@ class CustomAdminAction:
         return False
 
 
+class ReadOnlyAdminAction:
+    """
+    库存流水、汇总数据由明细自动维护, 只允许查看
+    """
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class PinyinSearchAdminAction:
+    """
+    搜索框按 名称/全拼/首字母 前缀 与 手机号 前缀/后缀 查询, 均可命中索引
+    示例: zs 或 zhang 可查询到 张三, 5678 可查询到 13800005678
+    """
+    # 手机号等后缀查询的列, 需要有对应的 <列名>_reversed 倒序列
+    suffix_search_fields: tuple = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term: str = search_term.strip()
+        if not search_term:
+            return queryset, False
+        term: str = search_term.lower()
+        condition = Q(name__startswith=search_term) | Q(name_pinyin__startswith=term) | Q(
+            name_initials__startswith=term)
+        if term.isdigit():
+            for field in self.suffix_search_fields:
+                condition |= Q(**{F'{field}__startswith': term}) | Q(**{F'{field}_reversed__startswith': term[::-1]})
+        return queryset.filter(condition), False
+
+
 @admin.register(Users)
-class UsersAdmin(CustomAdminAction, admin.ModelAdmin):
+class UsersAdmin(CustomAdminAction, PinyinSearchAdminAction, admin.ModelAdmin):
     list_display = ('id', 'name', 'sex', 'user_level', 'phone_number', 'member_frequency', 'member_frequency_warning',
                     'create_by_user_name', 'create_time', 'update_time', 'remarks_context',)
 
     list_display_links = ('name', 'member_frequency_warning')
     search_fields = ['name', 'phone_number']
+    suffix_search_fields = ('phone_number',)
     list_per_page = 10
     ordering = ('-name',)
     date_hierarchy = 'create_time'
-    list_filter = ('user_level',)
+    cached_changelist = True
+    show_full_result_count = False
+    list_filter = ('user_level', FrequencyStatusFilter)
     readonly_fields = ['id']
     form = RemarksModelForm
+    actions = [export_csv, export_xlsx]
     exclude = ('is_deleted', 'create_by_user',)
 
+    def get_queryset(self, request):
+        # 消费次数状态由数据库计算, 列表按状态排序
+        return super().get_queryset(request).annotate(frequency_status=Users.frequency_status_case())
+
     def save_model(self, request, obj, form, change):
-        obj.create_by_user = request.user.id
+        obj.create_by_user = request.user
         super().save_model(request, obj, form, change)
 
-    def get_queryset(self, request):
-        """
-        非 超级用户 禁止查询逻辑删除的列
-        :param request:
-        :return:
-        """
-        if not request.user.is_superuser:
-            qs = super().get_queryset(request)
-            # 查询属于当前登录用户的出纳明细,并排除逻辑删除的明细
-            return qs.filter(create_by_user=request.user.id).exclude(is_deleted=True)
-        return super().get_queryset(request)
-
     def get_list_display(self, request):
         """
         管理员可查看逻辑删除的列
@@ -89,35 +308,59 @@ class UsersAdmin(CustomAdminAction, admin.ModelAdmin):
 
 
 @admin.register(Materials)
-class MaterialsAdmin(CustomAdminAction, admin.ModelAdmin):
+class MaterialsAdmin(CustomAdminAction, PinyinSearchAdminAction, admin.ModelAdmin):
     list_display = (
-        'id', 'id_name', 'brand', 'specifications', 'functions_and_performance', 'number', 'price', 'discount_price',
-        'remarks_context',)
+        'id', 'id_name', 'brand', 'specifications', 'functions_and_performance', 'number', 'reorder_threshold',
+        'is_low_stock', 'price', 'discount_price', 'remarks_context',)
 
     search_fields = ['name']
     list_per_page = 10
     ordering = ('-name',)
     date_hierarchy = 'create_time'
     readonly_fields = ['number', 'id']
-    list_filter = ('name',)
+    list_filter = ('is_low_stock', 'name',)
     list_display_links = ('id_name',)
     form = RemarksModelForm
 
+    def save_model(self, request, obj, form, change):
+        """
+        数量由出纳管理写入库存流水, 修改材料时不覆盖数量
+        :param request:
+        :param obj:
+        :param form:
+        :param change:
+        :return: None
+        """
+        if change:
+            obj.save(update_fields=[field.name for field in obj._meta.concrete_fields
+                                    if field.name not in ('id', 'number', 'is_low_stock', 'create_time')])
+        else:
+            super().save_model(request, obj, form, change)
+
 
 @admin.register(Cashier)
 class CashierAdmin(CustomAdminAction, admin.ModelAdmin):
     list_display = (
         'id', 'name', 'action', 'number', 'money', 'rewrite_earnings', 'create_by_user_name', 'create_time'
         , 'update_time', 'remarks_context',)
-    readonly_fields = ['money', 'id', 'earnings']
-    search_fields = ['name']
+    readonly_fields = ['money', 'id', 'earnings', 'unit_price', 'original_price']
+    search_fields = ['name__name']
     list_display_links = ('name', 'rewrite_earnings')
     list_per_page = 10
     date_hierarchy = 'create_time'
-    list_filter = ('action', 'name')
+    ordering = ('-create_time',)
+    cached_changelist = True
+    keyset_pagination = True
+    show_full_result_count = False
+    list_filter = ('action', EarningsStatusFilter, 'name')
     exclude = ('is_deleted', 'create_by_user',)
 
     form = RemarksModelForm
+    actions = [export_csv, export_xlsx]
+
+    def get_queryset(self, request):
+        # 收益状态由数据库计算, 列表按状态排序
+        return super().get_queryset(request).annotate(earnings_status=Cashier.earnings_status_case())
 
     def get_list_display(self, request):
         """
@@ -130,18 +373,6 @@ class CashierAdmin(CustomAdminAction, admin.ModelAdmin):
             return list_display
         return self.list_display
 
-    def get_queryset(self, request):
-        """
-        非 超级用户 禁止查询逻辑删除的列
-        :param request:
-        :return:
-        """
-        if not request.user.is_superuser:
-            qs = super().get_queryset(request)
-            # 查询属于当前登录用户的出纳明细,并排除已删除的明细
-            return qs.filter(create_by_user=request.user.id).exclude(is_deleted=True)
-        return super().get_queryset(request)
-
     def save_model(self, request, obj, form, change):
         """
         计算数量
@@ -156,58 +387,60 @@ class CashierAdmin(CustomAdminAction, admin.ModelAdmin):
             messages.add_message(request, messages.ERROR, '记账失败：记账类型为支出请选择:原价 < ฅʕ•̫͡•ʔฅ >')
             messages.set_level(request, messages.ERROR)
         else:
-            # 获取材料 数量
-            # id=obj.name[0] 取材料对应的id 主键 格式为：主键-物料名称 示例：1-玻璃水
-            materials_obj = Materials.objects.get(id=obj.name[0])
             # 创建用户 = 当前登录用户id
-            obj.create_by_user = request.user.id
-            match change:
-                # change == True
-                case True:
-                    # 获取出纳数量
-                    cashier_obj = Cashier.objects.get(id=obj.id)
-                    cashier_obj_number: int = cashier_obj.number
-                    # model 出纳.数量的 绝对值(旧值-新值)
-                    # abs 的安全问题
-                    differential: int = abs(cashier_obj_number - obj.number)
-                    # obj.action 记账类型
-                    match obj.action:
-                        # 记账类型为收入
-                        case Cs.CashierChoice.incoming:
-                            if cashier_obj_number > obj.number:
-                                materials_obj.number += differential
-                            elif cashier_obj_number < obj.number:
-                                materials_obj.number -= differential
-                        # 记账类型为支出
-                        case Cs.CashierChoice.outgoing:
-                            if cashier_obj_number > obj.number:
-                                materials_obj.number -= differential
-                            elif cashier_obj_number < obj.number:
-                                materials_obj.number += differential
-                        case _:
-                            pass
-                # change == False
-                case False:
-                    match obj.action:
-                        # 记账类型为收入
-                        case Cs.CashierChoice.incoming:
-                            # 售价、折扣价格
-                            if obj.price_type in (Cs.MaterialsPriceType.price, Cs.MaterialsPriceType.discount_price):
-                                # 则材料数 -= 销售数量
-                                materials_obj.number -= obj.number
-                        #  记账类型为支出
-                        case Cs.CashierChoice.outgoing:
-                            # 原价
-                            if obj.price_type == Cs.MaterialsPriceType.original_price:
-                                # 则材料数 += 进货数量
-                                materials_obj.number += obj.number
-                        case _:
-                            pass
-                case _:
-                    pass
-            materials_obj.save()
+            obj.create_by_user = request.user
+            if pos.is_enabled():
+                # 本地收银模式: 写入终端的本地队列, 由 sync_pos 同步到主库并调整材料数量
+                obj._pos_entry = pos.enqueue_cashier(obj, request.user, change)
+                return
+            # 材料数量在 Cashier.save 的事务中加锁调整, 并写入库存流水
             super().save_model(request, obj, form, change)
 
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        if pos.is_enabled():
+            kwargs['form'] = PosCashierForm
+        return super().get_form(request, obj, change, **kwargs)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        # 本地收银模式的保存只写本地队列, 事务开在本地队列数据库上, 不在主库上开启事务
+        if not pos.is_enabled():
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        pos.ensure_journal()
+        pos.load_content_type(self.model)
+        with transaction.atomic(using=pos.POS_JOURNAL_DB_ALIAS):
+            return self._changeform_view(request, object_id, form_url, extra_context)
+
+    def log_addition(self, request, obj, message):
+        if not hasattr(obj, '_pos_entry'):
+            return super().log_addition(request, obj, message)
+
+    def log_change(self, request, obj, message):
+        if not hasattr(obj, '_pos_entry'):
+            return super().log_change(request, obj, message)
+
+    def response_add(self, request, obj, post_url_continue=None):
+        if not hasattr(obj, '_pos_entry'):
+            return super().response_add(request, obj, post_url_continue)
+        return self.response_pos_queued(request, obj)
+
+    def response_change(self, request, obj):
+        if not hasattr(obj, '_pos_entry'):
+            return super().response_change(request, obj)
+        return self.response_pos_queued(request, obj)
+
+    def response_pos_queued(self, request, obj):
+        """
+        已写入本地队列的明细还没有主库 id, 新增后回到新增页面(列表页需要主库, 主库不可用时也能继续记账),
+        修改后回到新增页面或列表
+        :param request:
+        :param obj: 出纳明细对象
+        :return: HttpResponseRedirect
+        """
+        self.message_user(request, F'已保存到本地队列, 等待同步到主库: {obj.name} {obj.number}', messages.SUCCESS)
+        if '_addanother' in request.POST or obj._pos_entry.operation == Cs.PosOperation.create:
+            return HttpResponseRedirect(reverse('admin:xicheba_cashier_add', current_app=self.admin_site.name))
+        return self.response_post_save_add(request, obj)
+
 
 @admin.register(ExtraProject)
 class ExtraProjectAdmin(CustomAdminAction, admin.ModelAdmin):
@@ -216,28 +449,20 @@ class ExtraProjectAdmin(CustomAdminAction, admin.ModelAdmin):
     list_display_links = ('action',)
     list_per_page = 10
     date_hierarchy = 'create_time'
+    ordering = ('-create_time',)
+    cached_changelist = True
+    show_full_result_count = False
     search_fields = ['remarks']
     list_filter = ('action',)
     readonly_fields = ['id']
     form = RemarksModelForm
+    actions = [export_csv, export_xlsx]
     exclude = ('is_deleted', 'create_by_user',)
 
     def save_model(self, request, obj, form, change):
-        obj.create_by_user = request.user.id
+        obj.create_by_user = request.user
         super().save_model(request, obj, form, change)
 
-    def get_queryset(self, request):
-        """
-        非 超级用户 禁止查询逻辑删除的列
-        :param request:
-        :return:
-        """
-        if not request.user.is_superuser:
-            qs = super().get_queryset(request)
-            # 查询属于当前登录用户的出纳明细,并排除已删除的明细
-            return qs.filter(create_by_user=request.user.id).exclude(is_deleted=True)
-        return super().get_queryset(request)
-
     def get_list_display(self, request):
         """
         管理员可查看逻辑删除的列
@@ -260,3 +485,42 @@ class EventTypeAdmin(CustomAdminAction, admin.ModelAdmin):
     list_filter = ('name',)
     readonly_fields = ('id',)
     form = RemarksModelForm
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(ReadOnlyAdminAction, admin.ModelAdmin):
+    list_display = ('id', 'materials', 'number', 'balance', 'cashier', 'create_by_user_name', 'create_time',)
+    list_display_links = ('id',)
+    list_per_page = 10
+    date_hierarchy = 'create_time'
+    list_filter = ('materials',)
+    list_select_related = ('materials', 'cashier__name')
+
+    def get_changelist(self, request, **kwargs):
+        return PrefetchChangeList
+
+
+@admin.register(CashierDailySummary)
+class CashierDailySummaryAdmin(ReadOnlyAdminAction, admin.ModelAdmin):
+    list_display = ('day', 'materials', 'action', 'count', 'number', 'money', 'earnings', 'create_by_user',)
+    list_per_page = 10
+    date_hierarchy = 'day'
+    list_filter = ('action', 'materials')
+    list_select_related = ('materials', 'create_by_user')
+
+
+@admin.register(ExtraProjectDailySummary)
+class ExtraProjectDailySummaryAdmin(ReadOnlyAdminAction, admin.ModelAdmin):
+    list_display = ('day', 'action', 'count', 'number', 'money',)
+    list_per_page = 10
+    date_hierarchy = 'day'
+    list_filter = ('action',)
+
+
+@admin.register(LowStockNotification)
+class LowStockNotificationAdmin(ReadOnlyAdminAction, admin.ModelAdmin):
+    list_display = ('id', 'materials', 'number', 'reorder_threshold', 'create_time', 'sent_time',)
+    list_per_page = 10
+    date_hierarchy = 'create_time'
+    list_filter = ('materials',)
+    list_select_related = ('materials',)
@@ -5,3 +5,7 @@ class XichebaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'xicheba'
     verbose_name = '洗车吧'
+
+    def ready(self):
+        # 注册信号
+        from . import signals  # noqa: F401
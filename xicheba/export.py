@@ -0,0 +1,128 @@
+import csv
+import tempfile
+
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils import timezone
+
+from .models import Users, Cashier, ExtraProject, ToolsBox
+
+# 导出列, 外键使用 __ 取关联对象的列
+EXPORT_FIELDS: dict = {
+    Users: ('id', 'name', 'sex', 'user_level', 'phone_number', 'make_collections', 'payment_methods',
+            'member_frequency', 'using_frequency', 'remarks', 'create_by_user', 'is_deleted', 'create_time',
+            'update_time'),
+    Cashier: ('id', 'name__name', 'action', 'number', 'price_type', 'unit_price', 'original_price', 'money', 'earnings',
+              'remarks', 'create_by_user', 'is_deleted', 'create_time', 'update_time'),
+    ExtraProject: ('id', 'action', 'number', 'money', 'remarks', 'create_by_user', 'is_deleted', 'create_time',
+                   'update_time'),
+}
+CHUNK_SIZE: int = 2000
+
+
+class Echo:
+    """
+    csv.writer 的伪文件对象, write 直接返回写入的内容
+    """
+
+    def write(self, value):
+        return value
+
+
+def get_user_names() -> dict:
+    """
+    全部用户的名称, 由 reference_cache 缓存
+    :return: {user_id: last_name + first_name or username}
+    """
+    return {user_id: full_name or username for user_id, (full_name, username) in ToolsBox.get_user_names().items()}
+
+
+def get_header(model) -> list:
+    """
+    :param model: 导出的模型
+    :return: 列的 verbose_name
+    """
+    return [str(model._meta.get_field(field.split('__')[0]).verbose_name) for field in EXPORT_FIELDS[model]]
+
+
+def iter_rows(queryset):
+    """
+    按 id 分块读取 values_list: 每块 filter(id__gt=上一块最后的 id)[:CHUNK_SIZE], 走主键范围扫描,
+    不依赖服务端游标, 也不随块数增加 OFFSET; 按 id 顺序导出, 枚举与创建者在内存字典中转换, 不实例化模型对象
+    :param queryset: 导出的 queryset
+    :return: 每一行的列表
+    """
+    model = queryset.model
+    fields: tuple = EXPORT_FIELDS[model]
+    id_index: int = fields.index('id')
+    converters: dict = dict()
+    for index, field in enumerate(fields):
+        if field == 'create_by_user':
+            converters[index] = get_user_names()
+        elif '__' not in field and model._meta.get_field(field).choices:
+            converters[index] = {key: str(label) for key, label in model._meta.get_field(field).flatchoices}
+    queryset = queryset.values_list(*fields).order_by('id')
+    last_id = None
+    while True:
+        chunk: list = list((queryset if last_id is None else queryset.filter(id__gt=last_id))[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_id = chunk[-1][id_index]
+        for row in chunk:
+            row = list(row)
+            for index, mapping in converters.items():
+                row[index] = mapping.get(row[index], row[index])
+            for index, value in enumerate(row):
+                if hasattr(value, 'tzinfo') and value.tzinfo is not None:
+                    row[index] = timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+            yield row
+
+
+def iter_csv(queryset):
+    """
+    :param queryset: 导出的 queryset
+    :return: csv 文本生成器, 每次返回一行
+    """
+    writer = csv.writer(Echo())
+    # BOM, Excel 打开时识别为 utf-8
+    yield '\ufeff'
+    yield writer.writerow(get_header(queryset.model))
+    for row in iter_rows(queryset):
+        yield writer.writerow(row)
+
+
+def write_xlsx(queryset, file) -> None:
+    """
+    使用 xlsxwriter constant_memory 模式逐行写入, 内存占用不随行数增长
+    :param queryset: 导出的 queryset
+    :param file: 文件路径或二进制文件对象
+    :return: None
+    """
+    try:
+        import xlsxwriter
+    except ModuleNotFoundError as notFoundModuleXlsxwriter:
+        raise ModuleNotFoundError(
+            F'NotFound module xlsxwriter from functionName={write_xlsx.__name__}'
+        ) from notFoundModuleXlsxwriter
+    workbook = xlsxwriter.Workbook(file, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(str(queryset.model._meta.verbose_name_plural))
+    worksheet.write_row(0, 0, get_header(queryset.model))
+    for row_number, row in enumerate(iter_rows(queryset), start=1):
+        worksheet.write_row(row_number, 0, row)
+    workbook.close()
+
+
+def get_filename(queryset, suffix: str) -> str:
+    return F'{queryset.model._meta.model_name}_{timezone.localtime():%Y%m%d%H%M%S}.{suffix}'
+
+
+def csv_response(queryset) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(iter_csv(queryset), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = F'attachment; filename="{get_filename(queryset, "csv")}"'
+    return response
+
+
+def xlsx_response(queryset) -> FileResponse:
+    file = tempfile.TemporaryFile(suffix='.xlsx')
+    write_xlsx(queryset, file)
+    file.seek(0)
+    return FileResponse(file, as_attachment=True, filename=get_filename(queryset, 'xlsx'))
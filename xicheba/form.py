@@ -1,5 +1,7 @@
 from django import forms
 
+from . import pos
+
 
 class RemarksModelForm(forms.ModelForm):
     """
@@ -9,3 +11,16 @@ class RemarksModelForm(forms.ModelForm):
 
     class Meta:
         fields = '__all__'
+
+
+class PosCashierForm(RemarksModelForm):
+    """
+    本地收银模式的出纳表单: 物品名称的选项与校验使用终端缓存的材料, 不查询主库
+    """
+    name = forms.TypedChoiceField(label='物品名称', choices=pos.get_materials_choices, coerce=pos.get_materials_obj)
+
+    def _get_validation_exclusions(self):
+        exclusions = super()._get_validation_exclusions()
+        # 物品名称已按缓存的材料校验, 不再由 ForeignKey.validate 查询主库
+        exclusions.add('name')
+        return exclusions
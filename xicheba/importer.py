@@ -0,0 +1,270 @@
+import csv
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from .export import EXPORT_FIELDS, get_header
+from .models import Users, Materials, Cashier, EventType, ExtraProject, Choices, ToolsBox, CashierDailySummary, \
+    ExtraProjectDailySummary, ChangeListDateIndex
+from .registry import count_cache
+
+TRUE_VALUES: tuple = ('1', 'true', 'yes', 'y', '是')
+# 按 值或中文名称 导入的枚举列, 散项的事件类型单独处理
+CHOICE_FIELDS: dict = {
+    Users: ('sex', 'user_level', 'payment_methods'),
+    Cashier: ('action', 'price_type'),
+    ExtraProject: (),
+}
+
+
+class LedgerImporter:
+    """
+    流式导入客户、出纳、散项明细 CSV, 列与 export_ledger 导出的 CSV 相同(表头可以是列名或中文名称)
+    材料、事件类型、枚举、创建用户在内存字典中校验与转换, 每 batch_size 行一次 bulk_create
+    出纳的材料数量在全部写入后按材料汇总一次调整, 日汇总与按日索引按导入的日期范围重建
+    出纳的总金额与收益按 单价/原价 列计算, 没有这两列时使用材料的当前价格
+    每行按模型的列校验长度与取值范围, 中途写入失败时已提交的批次同样调整材料数量并重建汇总
+    """
+
+    def __init__(self, model, default_user=None, batch_size: int = 5000):
+        self.model = model
+        self.default_user = default_user
+        self.batch_size: int = batch_size
+        self.rows: int = 0
+        self.errors: list = list()
+        self.first_day = None
+        self.last_day = None
+        # material_id --> 数量变动
+        self.stock_deltas: dict = dict()
+        # 表头 --> 列名
+        self.columns: dict = dict()
+        for field, header in zip(EXPORT_FIELDS[model], get_header(model)):
+            self.columns[header] = self.columns[field] = self.columns[field.split('__')[0]] = field.split('__')[0]
+        # 枚举列: 值或中文名称 --> 值
+        self.choices: dict = dict()
+        for field in CHOICE_FIELDS[model]:
+            flatchoices: list = model._meta.get_field(field).flatchoices
+            self.choices[field] = {str(label): key for key, label in flatchoices}
+            self.choices[field].update({key: key for key, label in flatchoices})
+        # 创建用户: 用户名、显示名称、id --> id
+        self.users: dict = dict()
+        for user_id, (full_name, username) in ToolsBox.get_user_names().items():
+            self.users.update({str(user_id): user_id, full_name: user_id, username: user_id})
+        self.users.pop('', None)
+        # clean_fields 不校验的列: 外键、枚举与事件类型已在内存字典中校验, 不逐行查询数据库
+        self.clean_exclude: list = [field.name for field in model._meta.concrete_fields if field.is_relation]
+        self.clean_exclude += list(CHOICE_FIELDS[model]) + (['action'] if model is ExtraProject else [])
+        if model is Cashier:
+            # 材料: 名称、id、id-名称 --> 材料对象
+            self.materials: dict = dict()
+            for obj in Materials.objects.order_by('-id'):
+                self.materials.update({obj.name: obj, str(obj.id): obj, obj.id_name(): obj})
+        if model is ExtraProject:
+            # 事件类型: 枚举值、id-名称、名称 --> 枚举值
+            self.actions: dict = dict()
+            for obj_id, name in EventType.objects.order_by('-id').values_list('id', 'name'):
+                key: str = F'{obj_id}-{EventType.get_pinyin(name)[1]}'
+                self.actions.update({key: key, F'{obj_id}-{name}': key, name: key})
+
+    def read(self, file):
+        """
+        :param file: 文本文件对象
+        :return: (行号, {列名: 值}) 生成器
+        """
+        reader = csv.reader(file)
+        header: list = next(reader, None)
+        if header is None:
+            raise ValidationError('CSV 文件为空')
+        header = [column.lstrip('\ufeff').strip() for column in header]
+        unknown: list = [column for column in header if column not in self.columns]
+        if unknown:
+            raise ValidationError(F'无法识别的列: {", ".join(unknown)}')
+        fields: list = [self.columns[column] for column in header]
+        for line_number, values in enumerate(reader, start=2):
+            if any(value.strip() for value in values):
+                yield line_number, dict(zip(fields, (value.strip() for value in values)))
+
+    @staticmethod
+    def parse_int(row: dict, field: str) -> int:
+        value: str = row.get(field) or '0'
+        try:
+            return int(float(value))
+        except ValueError:
+            raise ValidationError(F'{field} 不是数字: {value}')
+
+    @staticmethod
+    def parse_time(value: str):
+        if not value:
+            return timezone.now()
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise ValidationError(F'时间格式有误: {value}')
+            parsed = datetime.datetime.combine(date, datetime.time())
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def parse_choice(self, row: dict, field: str) -> str:
+        """
+        :param row: {列名: 值}
+        :param field: 枚举列, 为空时使用列的默认值
+        :return: 枚举值
+        """
+        default = self.model._meta.get_field(field).default
+        value: str = row.get(field) or (default if isinstance(default, str) else None)
+        if value not in self.choices[field]:
+            raise ValidationError(F'{self.model._meta.get_field(field).verbose_name} 有误: {value}')
+        return self.choices[field][value]
+
+    def parse_common(self, row: dict) -> dict:
+        """
+        :param row: {列名: 值}
+        :return: 各模型共有的列
+        """
+        create_by_user_id = self.default_user.id if self.default_user else None
+        if row.get('create_by_user'):
+            if row['create_by_user'] not in self.users:
+                raise ValidationError(F'创建用户不存在: {row["create_by_user"]}')
+            create_by_user_id = self.users[row['create_by_user']]
+        return {
+            'remarks': row.get('remarks') or None,
+            'create_by_user_id': create_by_user_id,
+            'is_deleted': (row.get('is_deleted') or '').lower() in TRUE_VALUES,
+            'create_time': self.parse_time(row.get('create_time')),
+        }
+
+    def clean(self, obj):
+        """
+        按模型的列校验 max_length、整数范围与必填, 避免 MySQL 严格模式在写入时报 DataError
+        :param obj: 构建的对象
+        :return: obj
+        """
+        try:
+            obj.clean_fields(exclude=self.clean_exclude)
+        except ValidationError as error:
+            raise ValidationError([F'{self.model._meta.get_field(field).verbose_name} {message}'
+                                   for field, messages in error.message_dict.items() for message in messages])
+        return obj
+
+    def build_users(self, row: dict) -> Users:
+        obj = Users(
+            name=row.get('name'), phone_number=row.get('phone_number') or None,
+            sex=self.parse_choice(row, 'sex'), user_level=self.parse_choice(row, 'user_level'),
+            payment_methods=self.parse_choice(row, 'payment_methods'),
+            make_collections=self.parse_int(row, 'make_collections'),
+            member_frequency=self.parse_int(row, 'member_frequency'),
+            using_frequency=self.parse_int(row, 'using_frequency'), **self.parse_common(row),
+        )
+        if not obj.name:
+            raise ValidationError('客户名称不能为空')
+        obj.update_search_index()
+        return self.clean(obj)
+
+    def build_cashier(self, row: dict) -> Cashier:
+        materials_obj = self.materials.get(row.get('name'))
+        if materials_obj is None:
+            raise ValidationError(F'物品名称不存在: {row.get("name")}')
+        obj = Cashier(name=materials_obj, action=self.parse_choice(row, 'action'),
+                      price_type=self.parse_choice(row, 'price_type'), number=self.parse_int(row, 'number'),
+                      **self.parse_common(row))
+        if obj.action == Choices.CashierChoice.outgoing and obj.price_type != Choices.MaterialsPriceType.original_price:
+            raise ValidationError('记账类型为支出请选择:原价')
+        if obj.number <= 0:
+            raise ValidationError(F'数量有误: {obj.number}')
+        obj.unit_price = self.parse_int(row, 'unit_price')
+        obj.original_price = self.parse_int(row, 'original_price')
+        # 没有价格快照时使用材料的当前价格
+        obj.compute_money(materials_obj if obj.unit_price == obj.original_price == 0 else None)
+        return self.clean(obj)
+
+    def build_extraproject(self, row: dict) -> ExtraProject:
+        action: str = self.actions.get(row.get('action'))
+        if action is None:
+            raise ValidationError(F'事件类型不存在: {row.get("action")}')
+        return self.clean(ExtraProject(action=action, number=self.parse_int(row, 'number'),
+                                       money=self.parse_int(row, 'money'), **self.parse_common(row)))
+
+    def iter_objects(self, file):
+        """
+        :param file: 文本文件对象
+        :return: 校验通过的对象生成器, 校验失败的行记录到 self.errors
+        """
+        build = getattr(self, F'build_{self.model._meta.model_name}')
+        for line_number, row in self.read(file):
+            try:
+                yield build(row)
+            except ValidationError as error:
+                self.errors.append(F'第{line_number}行: {"; ".join(error.messages)}')
+
+    def validate(self, file) -> list:
+        """
+        只校验不写入
+        :param file: 文本文件对象
+        :return: 错误信息列表
+        """
+        for _ in self.iter_objects(file):
+            self.rows += 1
+        return self.errors
+
+    def run(self, file) -> int:
+        """
+        分批写入, 每批一个事务, 校验失败的行跳过并记录到 self.errors
+        写入失败时之前的批次已提交, 仍在 finally 中调整这些批次的材料数量并重建汇总, 再抛出异常
+        :param file: 文本文件对象
+        :return: 写入行数
+        """
+        batch: list = list()
+        try:
+            for obj in self.iter_objects(file):
+                batch.append(obj)
+                if len(batch) >= self.batch_size:
+                    self.write(batch)
+                    batch = list()
+            if batch:
+                self.write(batch)
+        finally:
+            self.finish()
+        return self.rows
+
+    def track(self, obj) -> None:
+        day = timezone.localdate(obj.create_time)
+        self.first_day = min(self.first_day or day, day)
+        self.last_day = max(self.last_day or day, day)
+        if self.model is Cashier and not obj.is_deleted:
+            self.stock_deltas[obj.name_id] = self.stock_deltas.get(obj.name_id, 0) + obj.get_stock_delta()
+
+    def write(self, batch: list) -> None:
+        """
+        一个事务写入一批, 提交后才计入行数、日期范围与材料数量变动
+        :param batch: 对象列表
+        :return: None
+        """
+        with transaction.atomic():
+            self.model.objects.bulk_create(batch, batch_size=self.batch_size)
+        self.rows += len(batch)
+        for obj in batch:
+            self.track(obj)
+
+    def finish(self) -> None:
+        """
+        写入完毕后: 每个材料一次数量调整, 重建导入日期范围的日汇总与按日索引
+        :return: None
+        """
+        if not self.rows:
+            return
+        user_id = self.default_user.id if self.default_user else None
+        with transaction.atomic():
+            materials_map: dict = Materials.objects.select_for_update().order_by('id').in_bulk(
+                [material_id for material_id, stock_delta in self.stock_deltas.items() if stock_delta])
+            for material_id, materials_obj in materials_map.items():
+                materials_obj.adjust_number(self.stock_deltas[material_id], create_by_user_id=user_id)
+        summary = {Cashier: CashierDailySummary, ExtraProject: ExtraProjectDailySummary}.get(self.model)
+        if summary is not None:
+            summary.rebuild(self.first_day, self.last_day)
+        ChangeListDateIndex.rebuild(self.model, self.first_day, self.last_day)
+        count_cache.invalidate(self.model)
@@ -0,0 +1,20 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from xicheba.models import Users, Cashier, ExtraProject, ArchivedRecord
+
+
+class Command(BaseCommand):
+    help = '分批归档逻辑删除超过 N 天的客户、出纳、散项明细'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='逻辑删除后保留的天数')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批归档的行数')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        for model in (Users, Cashier, ExtraProject):
+            archived: int = ArchivedRecord.archive(model, cutoff, batch_size=options['batch_size'])
+            self.stdout.write(F'{model._meta.verbose_name_plural}: 归档 {archived} 行')
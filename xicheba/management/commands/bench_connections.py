@@ -0,0 +1,42 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, close_old_connections, DEFAULT_DB_ALIAS
+from django.test import Client
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    help = '对比每个请求新建数据库连接与持久连接(CONN_MAX_AGE)的每秒请求数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='每种模式的请求数')
+        parser.add_argument('--conn-max-age', type=int, default=60, help='持久连接模式的 CONN_MAX_AGE')
+        parser.add_argument('--url', default=None, help='压测地址, 默认材料管理列表页')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('请先创建超级用户: python manage.py createsuperuser')
+        url: str = options['url'] or reverse('admin:xicheba_materials_changelist')
+        client = Client()
+        client.force_login(user)
+        connection = connections[DEFAULT_DB_ALIAS]
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for label, max_age in (('每个请求新建连接', 0), ('持久连接', options['conn_max_age'])):
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                start: float = time.perf_counter()
+                for _ in range(options['requests']):
+                    response = client.get(url)
+                    if response.status_code != 200:
+                        raise CommandError(F'{url} 返回 {response.status_code}')
+                    # 测试客户端不会在请求结束时处理连接, 这里按 WSGI 请求结束的行为关闭过期连接
+                    close_old_connections()
+                seconds: float = time.perf_counter() - start
+                self.stdout.write(F'{label}(CONN_MAX_AGE={max_age}): {options["requests"] / seconds:.1f} 请求/秒')
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
@@ -0,0 +1,51 @@
+import asyncio
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.urls import reverse
+
+DASHBOARD_URLS: tuple = ('xicheba:dashboard_revenue', 'xicheba:dashboard_low_stock',
+                         'xicheba:dashboard_members_near_limit')
+
+
+class Command(BaseCommand):
+    help = '模拟多个平板并发轮询 ASGI 看板接口, 输出每秒请求数与延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='并发轮询的客户端数')
+        parser.add_argument('--requests', type=int, default=30, help='每个客户端的请求数')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('请先创建超级用户: python manage.py createsuperuser')
+        clients: list = list()
+        for _ in range(options['clients']):
+            client = AsyncClient()
+            client.force_login(user)
+            clients.append(client)
+        urls: list = [reverse(name) for name in DASHBOARD_URLS]
+        latencies: list = list()
+
+        async def poll(client):
+            for index in range(options['requests']):
+                start: float = time.perf_counter()
+                response = await client.get(urls[index % len(urls)])
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(F'{urls[index % len(urls)]} 返回 {response.status_code}')
+
+        async def run():
+            await asyncio.gather(*(poll(client) for client in clients))
+
+        start: float = time.perf_counter()
+        asyncio.run(run())
+        seconds: float = time.perf_counter() - start
+        latencies.sort()
+        self.stdout.write(
+            F'{options["clients"]} 个客户端 共 {len(latencies)} 次请求: {len(latencies) / seconds:.1f} 请求/秒, '
+            F'p50={statistics.median(latencies) * 1000:.1f}ms p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms'
+        )
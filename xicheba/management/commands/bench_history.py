@@ -0,0 +1,107 @@
+import datetime
+import json
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from xicheba.models import Cashier, ExtraProject, Materials, Choices
+from xicheba.partitioning import MonthlyPartitioner
+from .bench_suite import Command as SuiteCommand
+
+
+class Command(SuiteCommand):
+    help = '历史数据增长压测: 每轮追加当前月份之前的历史明细, 测量当前月份的 changelist、汇总查询与新增出纳, 耗时不应随历史增长'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=3, help='追加历史数据的轮数')
+        parser.add_argument('--scale', default='10k', help='每轮追加的出纳明细行数, 同 bench_seed --scale')
+        parser.add_argument('--days', type=int, default=365, help='每轮追加的历史天数')
+        parser.add_argument('--repeat', type=int, default=5, help='每项的执行次数, 取中位数')
+        parser.add_argument('--output', default=None, help='结果 JSON 文件')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='最后一轮中位数超过第一轮的比例, 超过视为退化')
+
+    def handle(self, *args, **options):
+        self.user = User.objects.filter(is_superuser=True).first()
+        if self.user is None:
+            raise CommandError('请先创建超级用户: python manage.py createsuperuser')
+        self.month = MonthlyPartitioner.month_start(timezone.localdate())
+        if not Cashier.objects.filter(create_time__gte=self.month_start_time()).exists():
+            raise CommandError('当前月份没有出纳明细, 请先执行: python manage.py bench_seed')
+        self.repeat: int = options['repeat']
+        self.client = Client()
+        self.client.force_login(self.user)
+        # 历史数据从上个月末开始向前追加, 不落入当前月份
+        offset_days: int = (timezone.localdate() - self.month).days + 1
+        rounds: list = list()
+        for index in range(options['rounds'] + 1):
+            if index:
+                call_command('bench_seed', scale=options['scale'], days=options['days'], append=True, seed=index,
+                             offset_days=offset_days + (index - 1) * options['days'], stdout=self.stdout)
+            rows: dict = {model.__name__: model._base_manager.count() for model in (Cashier, ExtraProject)}
+            results: dict = {name: self.measure(func) for name, func in self.get_cases()}
+            rounds.append({'rows': rows, 'results': results})
+            self.stdout.write(F'第{index}轮 历史行数 {rows}')
+            for name, result in results.items():
+                self.stdout.write('  ' + self.format_result(name, result))
+        self.explain()
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'meta': {'time': timezone.now().isoformat(), 'vendor': connection.vendor},
+                           'rounds': rounds}, file, ensure_ascii=False, indent=2)
+            self.stdout.write(F'结果已保存到 {options["output"]}')
+        self.check_degradation(rounds, options['tolerance'])
+
+    def month_start_time(self) -> datetime.datetime:
+        return timezone.make_aware(datetime.datetime.combine(self.month, datetime.time()))
+
+    def get_cases(self) -> list[tuple]:
+        """
+        当前月份的用例: changelist 按月下钻、按日汇总查询、新增出纳(事务回滚)
+        :return: [(用例名称, 函数)]
+        """
+        url: str = F'{reverse("admin:xicheba_cashier_changelist")}?create_time__year={self.month.year}' \
+                   F'&create_time__month={self.month.month}'
+        materials_obj = Materials.objects.order_by('id').first()
+
+        def month_sum():
+            Cashier.objects.filter(create_time__gte=self.month_start_time()).aggregate(Sum('money'))
+
+        def cashier_insert():
+            with transaction.atomic():
+                Cashier(name=materials_obj, action=Choices.CashierChoice.incoming,
+                        price_type=Choices.MaterialsPriceType.price, number=1, create_by_user=self.user).save()
+                transaction.set_rollback(True)
+
+        return [
+            ('current_month:changelist', lambda: self.get(url)),
+            ('current_month:sum', month_sum),
+            ('current_month:insert', cashier_insert),
+        ]
+
+    def explain(self) -> None:
+        """
+        MySQL 输出当前月份查询的 EXPLAIN, 分区表的 partitions 列应只有当前月份的分区
+        :return: None
+        """
+        if connection.vendor != 'mysql':
+            return
+        queryset = Cashier.objects.filter(create_time__gte=self.month_start_time())
+        self.stdout.write(queryset.explain())
+
+    def check_degradation(self, rounds: list, tolerance: float) -> None:
+        regressions: list = list()
+        first, last = rounds[0]['results'], rounds[-1]['results']
+        for name, result in last.items():
+            ratio: float = result['median_ms'] / first[name]['median_ms'] if first[name]['median_ms'] else 1
+            if result['queries'] > first[name]['queries'] or ratio > 1 + tolerance:
+                regressions.append(F'{name}: {first[name]["median_ms"]:.1f}ms -> {result["median_ms"]:.1f}ms '
+                                   F'({ratio:.2f}x), SQL {first[name]["queries"]} -> {result["queries"]}')
+        if regressions:
+            raise CommandError('当前月份的查询随历史数据增长而退化:\n' + '\n'.join(regressions))
+        self.stdout.write(F'历史数据增长 {len(rounds) - 1} 轮, 当前月份的查询与新增无退化')
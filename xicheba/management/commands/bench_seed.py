@@ -0,0 +1,164 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from xicheba.models import Users, Materials, Cashier, EventType, ExtraProject, Choices, CashierDailySummary, \
+    ExtraProjectDailySummary, ChangeListDateIndex
+from xicheba.registry import choice_registry
+
+# 规模 --> 出纳明细行数, 其余表按比例生成
+SCALES: dict = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+SURNAMES: str = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN_NAMES: str = '伟芳娜敏静丽强磊军洋勇艳杰涛明超秀霞平刚'
+MATERIALS: tuple = ('洗车液', '镀晶', '玻璃水', '轮胎蜡', '内饰清洁剂', '打蜡', '防冻液', '机油', '雨刮', '脚垫')
+EVENTS: tuple = ('普通洗车', '精洗', '打蜡', '内饰清洗', '发动机清洗', '抛光', '镀膜', '补胎', '换油', '四轮定位')
+
+
+class Command(BaseCommand):
+    help = '生成压测数据: 客户、材料、出纳明细、散项明细, 并同步材料数量、日汇总与按日索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='10k', help='出纳明细行数 10k 100k 1m')
+        parser.add_argument('--days', type=int, default=365, help='创建时间分布在最近多少天')
+        parser.add_argument('--offset-days', type=int, default=0, help='创建时间整体提前的天数, 用于追加历史数据')
+        parser.add_argument('--seed', type=int, default=1, help='随机数种子, 相同种子生成相同数据')
+        parser.add_argument('--batch-size', type=int, default=5000, help='每批 bulk_create 的行数')
+        parser.add_argument('--append', action='store_true', help='已有出纳明细时仍然追加数据')
+
+    def handle(self, *args, **options):
+        if Cashier.all_objects.exists() and not options['append']:
+            raise CommandError('已存在出纳明细, 请在空库中生成压测数据或使用 --append')
+        self.random = random.Random(options['seed'])
+        self.batch_size: int = options['batch_size']
+        self.now = timezone.now() - timedelta(days=options['offset_days'])
+        self.seconds: int = options['days'] * 86400
+        rows: int = SCALES[options['scale']]
+        start: float = time.perf_counter()
+        user, _ = User.objects.get_or_create(username='bench', defaults={'is_staff': True, 'last_name': '压测'})
+        users: int = self.seed_users(rows // 10, user)
+        materials: list = self.seed_materials()
+        event_types: list = self.seed_event_types()
+        cashiers: int = self.seed_cashiers(rows, materials, user)
+        extra_projects: int = self.seed_extra_projects(rows // 2, event_types, user)
+        start_day = timezone.localdate(self.now - timedelta(seconds=self.seconds))
+        CashierDailySummary.rebuild(start_day, timezone.localdate(self.now))
+        ExtraProjectDailySummary.rebuild(start_day, timezone.localdate(self.now))
+        for model in (Users, Cashier, ExtraProject):
+            ChangeListDateIndex.rebuild(model, start_day, timezone.localdate(self.now))
+        self.stdout.write(
+            F'客户 {users} 材料 {len(materials)} 事件类型 {len(event_types)} 出纳明细 {cashiers} 散项明细 {extra_projects}, '
+            F'耗时 {time.perf_counter() - start:.1f}s'
+        )
+
+    def random_time(self):
+        return self.now - timedelta(seconds=self.random.randrange(self.seconds))
+
+    def random_name(self) -> str:
+        return self.random.choice(SURNAMES) + ''.join(
+            self.random.choice(GIVEN_NAMES) for _ in range(self.random.randint(1, 2)))
+
+    def bulk_create(self, model, objs) -> int:
+        """
+        分批写入, 每批一个事务, 不在内存中保留全部对象
+        :param model: 模型类
+        :param objs: 对象迭代器
+        :return: 写入行数
+        """
+        count: int = 0
+        batch: list = list()
+        for obj in objs:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch)
+                count += len(batch)
+                batch = list()
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            count += len(batch)
+        return count
+
+    def seed_users(self, rows: int, user) -> int:
+        def objs():
+            for _ in range(rows):
+                is_member: bool = self.random.random() < 0.3
+                obj = Users(
+                    name=self.random_name(), phone_number='1' + ''.join(self.random.choices('0123456789', k=10)),
+                    user_level=Choices.IsMembersChoice.member if is_member else Choices.IsMembersChoice.not_member,
+                    make_collections=self.random.randint(100, 2000) if is_member else 0,
+                    member_frequency=self.random.randint(5, 50) if is_member else 0,
+                    using_frequency=self.random.randint(0, 50), create_by_user=user, create_time=self.random_time(),
+                    is_deleted=self.random.random() < 0.02,
+                )
+                obj.update_search_index()
+                yield obj
+
+        return self.bulk_create(Users, objs())
+
+    def seed_materials(self) -> list:
+        objs: list = list()
+        for index in range(200):
+            original_price: int = self.random.randint(5, 200)
+            obj = Materials(
+                name=F'{MATERIALS[index % len(MATERIALS)]}{index // len(MATERIALS) + 1}', original_price=original_price,
+                price=original_price * 2, discount_price=int(original_price * 1.5),
+                reorder_threshold=self.random.choice((0, 10, 20, 50)), brand='压测', create_time=self.random_time(),
+            )
+            obj.update_search_index()
+            objs.append(obj)
+        Materials.objects.bulk_create(objs)
+        # MySQL 的 bulk_create 不返回主键, 重新查询; bulk_create 不发送 post_save, 手动失效枚举缓存
+        choice_registry.invalidate(Materials)
+        return list(Materials.objects.filter(name__in=[obj.name for obj in objs]))
+
+    def seed_event_types(self) -> list:
+        EventType.objects.bulk_create([EventType(name=name) for name in EVENTS])
+        choice_registry.invalidate(EventType)
+        return list(EventType.objects.filter(name__in=EVENTS))
+
+    def seed_cashiers(self, rows: int, materials: list, user) -> int:
+        stock_deltas: dict = dict()
+
+        def objs():
+            for _ in range(rows):
+                materials_obj = self.random.choice(materials)
+                if self.random.random() < 0.8:
+                    action, price_type = Choices.CashierChoice.incoming, self.random.choice(
+                        (Choices.MaterialsPriceType.price, Choices.MaterialsPriceType.discount_price))
+                else:
+                    action, price_type = Choices.CashierChoice.outgoing, Choices.MaterialsPriceType.original_price
+                obj = Cashier(name=materials_obj, action=action, price_type=price_type,
+                              number=self.random.randint(1, 10), create_by_user=user, create_time=self.random_time(),
+                              is_deleted=self.random.random() < 0.02)
+                obj.compute_money(materials_obj)
+                if not obj.is_deleted:
+                    stock_deltas[obj.name_id] = stock_deltas.get(obj.name_id, 0) + obj.get_stock_delta()
+                yield obj
+
+        count: int = self.bulk_create(Cashier, objs())
+        # 材料数量与出纳明细一致, 一次 bulk_update
+        for materials_obj in materials:
+            materials_obj.number += stock_deltas.get(materials_obj.id, 0)
+            materials_obj.is_low_stock = 0 < materials_obj.reorder_threshold and \
+                materials_obj.number <= materials_obj.reorder_threshold
+        Materials.objects.bulk_update(materials, ['number', 'is_low_stock'])
+        return count
+
+    def seed_extra_projects(self, rows: int, event_types: list, user) -> int:
+        # 与 EventType.get_values 的 key 一致: id-首字母
+        actions: list = [F'{obj.id}-{obj.get_pinyin(obj.name)[1]}' for obj in event_types]
+
+        def objs():
+            for _ in range(rows):
+                number: int = self.random.randint(1, 3)
+                yield ExtraProject(action=self.random.choice(actions), number=number,
+                                   money=number * self.random.choice((20, 30, 50, 100)), create_by_user=user,
+                                   create_time=self.random_time(), is_deleted=self.random.random() < 0.02)
+
+        return self.bulk_create(ExtraProject, objs())
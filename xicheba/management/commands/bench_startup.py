@@ -0,0 +1,46 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 子进程: 禁止建立数据库连接后执行 django.setup(), 输出耗时
+STARTUP_SCRIPT: str = """
+import json, os, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+def ensure_connection(self):
+    raise RuntimeError('django.setup() 期间访问了数据库: ' + self.alias)
+
+BaseDatabaseWrapper.ensure_connection = ensure_connection
+start = time.perf_counter()
+import django
+django.setup()
+from django.core import checks
+errors = [str(error) for error in checks.run_checks() if error.is_serious()]
+print(json.dumps({{'seconds': time.perf_counter() - start, 'errors': errors}}))
+"""
+
+
+class Command(BaseCommand):
+    help = '测量 worker 启动(django.setup + 系统检查)耗时, 并确认启动期间不访问数据库'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='启动次数')
+
+    def handle(self, *args, **options):
+        script: str = STARTUP_SCRIPT.format(settings_module=settings.SETTINGS_MODULE)
+        durations: list = list()
+        for _ in range(options['runs']):
+            process = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+            if process.returncode:
+                raise CommandError(process.stderr.strip().splitlines()[-1])
+            result: dict = json.loads(process.stdout.strip().splitlines()[-1])
+            if result['errors']:
+                raise CommandError('\n'.join(result['errors']))
+            durations.append(result['seconds'])
+        self.stdout.write(F'启动 {len(durations)} 次, 未访问数据库, '
+                          F'耗时 min={min(durations) * 1000:.1f}ms median={statistics.median(durations) * 1000:.1f}ms')
@@ -0,0 +1,233 @@
+import json
+import platform
+import statistics
+import time
+
+import django
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from xicheba.admin import KeysetMixin
+from xicheba.models import Users, Materials, Cashier, ExtraProject, Choices
+from xicheba.paginator import KeysetPaginator
+from .bench_dashboard import DASHBOARD_URLS
+
+
+class Command(BaseCommand):
+    help = '压测套件: changelist、date_hierarchy 下钻、搜索、看板、出纳保存与库存更新, 记录耗时与 SQL 条数并保存为 JSON 基线'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='每项的执行次数, 取中位数')
+        parser.add_argument('--username', default=None, help='访问 admin 的用户, 默认第一个超级用户')
+        parser.add_argument('--output', default=None, help='结果 JSON 文件, 作为之后对比的基线')
+        parser.add_argument('--baseline', default=None, help='对比的基线 JSON 文件')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='中位数超过基线的比例, 超过视为退化')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(username=options['username']) if options['username'] else \
+            User.objects.filter(is_superuser=True)
+        user = users.first()
+        if user is None:
+            raise CommandError('请先创建超级用户或使用 --username 指定用户')
+        if not Materials.objects.exists():
+            raise CommandError('没有材料数据, 请先执行: python manage.py bench_seed')
+        self.repeat: int = options['repeat']
+        self.client = Client()
+        self.client.force_login(user)
+        self.user = user
+        results: dict = dict()
+        for name, url in self.get_read_cases():
+            results[name] = self.measure(lambda: self.get(url))
+            self.stdout.write(self.format_result(name, results[name]))
+        # 写入类用例在一个事务中执行, 结束后回滚, 不改变压测数据
+        with transaction.atomic():
+            for name, func in self.get_write_cases():
+                results[name] = self.measure(func)
+                self.stdout.write(self.format_result(name, results[name]))
+            transaction.set_rollback(True)
+        report: dict = {
+            'meta': {
+                'time': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'repeat': self.repeat,
+                'rows': {model.__name__: model._base_manager.count() for model in (Users, Materials, Cashier, ExtraProject)},
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(F'结果已保存到 {options["output"]}')
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    def get(self, url: str) -> None:
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise CommandError(F'{url} 返回 {response.status_code}')
+
+    def measure(self, func) -> dict:
+        """
+        执行 repeat 次, 记录耗时与最后一次的 SQL 条数
+        :param func: 用例
+        :return: {'median_ms': 中位数, 'min_ms': 最小值, 'max_ms': 最大值, 'queries': SQL 条数}
+        """
+        seconds: list = list()
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as context:
+                start: float = time.perf_counter()
+                func()
+                seconds.append(time.perf_counter() - start)
+        return {
+            'median_ms': round(statistics.median(seconds) * 1000, 3),
+            'min_ms': round(min(seconds) * 1000, 3),
+            'max_ms': round(max(seconds) * 1000, 3),
+            'queries': len(context.captured_queries),
+        }
+
+    @staticmethod
+    def format_result(name: str, result: dict) -> str:
+        return F'{name}: {result["median_ms"]:.1f}ms (min {result["min_ms"]:.1f}ms) {result["queries"]} 条SQL'
+
+    def get_read_cases(self) -> list[tuple[str, str]]:
+        """
+        只读用例: 每个 admin 的 changelist、date_hierarchy 年/月/日下钻、搜索、状态过滤与看板接口
+        :return: [(用例名称, url)]
+        """
+        cases: list = list()
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label != 'xicheba':
+                continue
+            model_name: str = model._meta.model_name
+            url: str = reverse(F'admin:xicheba_{model_name}_changelist')
+            cases.append((F'changelist:{model_name}', url))
+            if getattr(model_admin, 'keyset_pagination', False):
+                cases.append((F'changelist_deep:{model_name}', F'{url}?{self.get_deep_cursor(model, model_admin)}'))
+            field: str = model_admin.date_hierarchy
+            if not field:
+                continue
+            latest = model._base_manager.order_by(F'-{field}').values_list(field, flat=True).first()
+            if latest is None:
+                continue
+            if hasattr(latest, 'tzinfo'):
+                latest = timezone.localtime(latest)
+            params: str = ''
+            for part in ('year', 'month', 'day'):
+                params += F'&{field}__{part}={getattr(latest, part)}'
+                cases.append((F'date_hierarchy:{model_name}:{part}', F'{url}?{params[1:]}'))
+        users_obj = Users.objects.exclude(phone_number=None).first()
+        if users_obj is not None:
+            url: str = reverse('admin:xicheba_users_changelist')
+            cases.append(('search:users:initials', F'{url}?q={users_obj.name_initials[:2]}'))
+            cases.append(('search:users:phone_suffix', F'{url}?q={users_obj.phone_number[-4:]}'))
+        cases.append(('filter:users:exhausted',
+                      F'{reverse("admin:xicheba_users_changelist")}?frequency_status={Choices.FrequencyStatus.exhausted}'))
+        cases.append(('filter:cashier:loss',
+                      F'{reverse("admin:xicheba_cashier_changelist")}?earnings_status={Choices.EarningsStatus.loss}'))
+        materials_obj = Materials.objects.first()
+        cases.append(('search:materials:name', F'{reverse("admin:xicheba_materials_changelist")}?q={materials_obj.name}'))
+        cases.append(('search:cashier:name', F'{reverse("admin:xicheba_cashier_changelist")}?q={materials_obj.name}'))
+        for name in DASHBOARD_URLS:
+            cases.append((F'dashboard:{name.split(":")[-1]}', reverse(name)))
+        return cases
+
+    @staticmethod
+    def get_deep_cursor(model, model_admin) -> str:
+        """
+        :param model: 模型类
+        :param model_admin: 开启 keyset_pagination 的 ModelAdmin
+        :return: 指向最后 10% 行的游标参数, 深页应与第一页耗时、SQL 条数相同
+        """
+        ordering: list = KeysetPaginator.get_keyset_ordering(model, [*(model_admin.ordering or ()), '-pk'])
+        queryset = model._base_manager.order_by(*ordering)
+        obj = queryset[max(queryset.count() * 9 // 10, 0):].first()
+        if obj is None:
+            return ''
+        cursor: str = KeysetPaginator(queryset, model_admin.list_per_page, ordering).encode_cursor(obj, 'next')
+        return F'{KeysetMixin.CURSOR_VAR}={cursor}'
+
+    def get_write_cases(self) -> list[tuple]:
+        """
+        写入用例: 出纳新增、出纳修改数量、材料数量调整、批量记账、会员到店消费(按手机号码请求接口)
+        :return: [(用例名称, 函数)]
+        """
+        materials_obj = Materials.objects.order_by('id').first()
+
+        def cashier_create():
+            Cashier(name=materials_obj, action=Choices.CashierChoice.incoming, price_type=Choices.MaterialsPriceType.price,
+                    number=1, create_by_user=self.user).save()
+
+        cashier_obj = Cashier(name=materials_obj, action=Choices.CashierChoice.outgoing,
+                              price_type=Choices.MaterialsPriceType.original_price, number=1, create_by_user=self.user)
+        cashier_obj.save()
+
+        def cashier_update():
+            cashier_obj.number += 1
+            cashier_obj.save()
+
+        def stock_update():
+            with transaction.atomic():
+                Materials.objects.select_for_update().get(id=materials_obj.id).adjust_number(
+                    1, create_by_user_id=self.user.id)
+
+        material_ids: list = list(Materials.objects.order_by('id').values_list('id', flat=True)[:20])
+        lines: list = [
+            {'name': material_ids[index % len(material_ids)], 'action': Choices.CashierChoice.outgoing,
+             'price_type': Choices.MaterialsPriceType.original_price, 'number': 1}
+            for index in range(100)
+        ]
+
+        def cashier_bulk_book():
+            Cashier.bulk_book(lines, user=self.user)
+
+        # 压测专用的会员, 次数足够 repeat 次消费, 随写入用例的事务回滚
+        member_obj = Users.objects.create(name='压测会员', user_level=Choices.IsMembersChoice.member,
+                                          phone_number='10000000000', member_frequency=self.repeat)
+        check_in_url: str = reverse('xicheba:users_check_in')
+
+        def check_in():
+            response = self.client.post(check_in_url, {'phone_number': member_obj.phone_number},
+                                        content_type='application/json')
+            if response.status_code != 200:
+                raise CommandError(F'{check_in_url} 返回 {response.status_code}: {response.content.decode()}')
+
+        return [
+            ('write:cashier_create', cashier_create),
+            ('write:cashier_update', cashier_update),
+            ('write:stock_update', stock_update),
+            ('write:cashier_bulk_book_100', cashier_bulk_book),
+            ('write:check_in', check_in),
+        ]
+
+    def compare(self, report: dict, path: str, tolerance: float) -> None:
+        """
+        与基线对比, SQL 条数增加或中位数超过 tolerance 视为退化
+        :param report: 本次结果
+        :param path: 基线 JSON 文件
+        :param tolerance: 允许的耗时增长比例
+        :return: None
+        """
+        with open(path, encoding='utf-8') as file:
+            baseline: dict = json.load(file)['results']
+        regressions: list = list()
+        for name, result in report['results'].items():
+            base: dict = baseline.get(name)
+            if base is None:
+                continue
+            ratio: float = result['median_ms'] / base['median_ms'] if base['median_ms'] else 1
+            if result['queries'] > base['queries'] or ratio > 1 + tolerance:
+                regressions.append(
+                    F'{name}: {base["median_ms"]:.1f}ms -> {result["median_ms"]:.1f}ms ({ratio:.2f}x), '
+                    F'SQL {base["queries"]} -> {result["queries"]}'
+                )
+        if regressions:
+            raise CommandError('与基线对比存在退化:\n' + '\n'.join(regressions))
+        self.stdout.write(F'与基线 {path} 对比无退化')
@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from xicheba.export import EXPORT_FIELDS, iter_csv, write_xlsx
+
+
+class Command(BaseCommand):
+    help = '流式导出客户、出纳、散项明细为 CSV 或 XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=[model._meta.model_name for model in EXPORT_FIELDS])
+        parser.add_argument('output', help='导出文件路径')
+        parser.add_argument('--format', choices=('csv', 'xlsx'), default='csv')
+        parser.add_argument('--start', type=datetime.date.fromisoformat, help='创建日期起 YYYY-MM-DD')
+        parser.add_argument('--end', type=datetime.date.fromisoformat, help='创建日期止 YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        model = next(model for model in EXPORT_FIELDS if model._meta.model_name == options['model'])
+        queryset = model.all_objects.order_by('id')
+        if options['start']:
+            queryset = queryset.filter(create_time__date__gte=options['start'])
+        if options['end']:
+            queryset = queryset.filter(create_time__date__lte=options['end'])
+        if options['format'] == 'xlsx':
+            try:
+                write_xlsx(queryset, options['output'])
+            except ModuleNotFoundError as notFoundModule:
+                raise CommandError(notFoundModule) from notFoundModule
+        else:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                file.writelines(iter_csv(queryset))
+        self.stdout.write(F'{model._meta.verbose_name_plural} 已导出到 {options["output"]}')
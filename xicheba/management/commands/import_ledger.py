@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from xicheba.export import EXPORT_FIELDS
+from xicheba.importer import LedgerImporter
+
+
+class Command(BaseCommand):
+    help = '流式导入客户、出纳、散项明细 CSV(与 export_ledger 导出的格式相同), 先校验全部行再分批写入'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=[model._meta.model_name for model in EXPORT_FIELDS])
+        parser.add_argument('input', help='CSV 文件路径')
+        parser.add_argument('--user', default=None, help='没有创建用户列时使用的用户名')
+        parser.add_argument('--batch-size', type=int, default=5000, help='每批 bulk_create 的行数')
+        parser.add_argument('--encoding', default='utf-8-sig', help='文件编码, Excel 另存的 CSV 可能为 gbk')
+        parser.add_argument('--skip-invalid', action='store_true', help='跳过校验失败的行, 默认有错误时不写入')
+        parser.add_argument('--dry-run', action='store_true', help='只校验不写入')
+
+    def handle(self, *args, **options):
+        model = next(model for model in EXPORT_FIELDS if model._meta.model_name == options['model'])
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(F'用户不存在: {options["user"]}')
+        start: float = time.perf_counter()
+        try:
+            importer = LedgerImporter(model, default_user=user, batch_size=options['batch_size'])
+            if options['dry_run'] or not options['skip_invalid']:
+                # 第一遍只校验, 有错误时不写入任何行
+                with open(options['input'], encoding=options['encoding'], newline='') as file:
+                    errors: list = importer.validate(file)
+                if options['dry_run']:
+                    for message in errors[:50]:
+                        self.stderr.write(message)
+                    self.stdout.write(F'校验通过 {importer.rows} 行, 失败 {len(errors)} 行, '
+                                      F'耗时 {time.perf_counter() - start:.1f}s')
+                    return
+                if errors:
+                    raise CommandError(F'校验失败 {len(errors)} 行, 未写入:\n' + '\n'.join(errors[:50]))
+                importer = LedgerImporter(model, default_user=user, batch_size=options['batch_size'])
+            with open(options['input'], encoding=options['encoding'], newline='') as file:
+                rows: int = importer.run(file)
+        except ValidationError as error:
+            raise CommandError('; '.join(error.messages)) from error
+        seconds: float = time.perf_counter() - start
+        for message in importer.errors[:50]:
+            self.stderr.write(message)
+        self.stdout.write(
+            F'{model._meta.verbose_name_plural}: 导入 {rows} 行, 跳过 {len(importer.errors)} 行, '
+            F'耗时 {seconds:.1f}s, {rows / seconds if seconds else 0:.0f} 行/秒'
+        )
@@ -0,0 +1,75 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from xicheba.partitioning import PARTITIONED_MODELS, MonthlyPartitioner
+
+
+class Command(BaseCommand):
+    help = ('出纳、散项明细按月分区(MySQL): --convert 转换已有表, 默认预建未来月份的分区, '
+            '--drop-before 删除历史分区(--exchange 先交换到单独的表再删除); 建议每月由 cron 执行一次')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='将未分区的表转换为按月分区, 会删除相关外键')
+        parser.add_argument('--ahead', type=int, default=3, help='预建当前月份之后多少个月的分区')
+        parser.add_argument('--drop-before', default=None, help='删除该月份之前的分区, 格式 YYYY-MM')
+        parser.add_argument('--exchange', action='store_true', help='删除前将分区交换到 {表名}_pYYYYMM 表保留')
+        parser.add_argument('--model', choices=[model._meta.model_name for model in PARTITIONED_MODELS], default=None,
+                            help='只处理一个模型, 默认出纳与散项明细')
+        parser.add_argument('--dry-run', action='store_true', help='只输出 SQL 不执行')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'mysql' and not options['dry_run']:
+            raise CommandError(F'按月分区只支持 MySQL, 当前数据库为 {connection.vendor}, 可以使用 --dry-run 查看 SQL')
+        if options['ahead'] < 0:
+            raise CommandError('--ahead 不能小于 0')
+        until: datetime.date = MonthlyPartitioner.month_start(timezone.localdate())
+        for _ in range(options['ahead']):
+            until = MonthlyPartitioner.next_month(until)
+        before = None
+        if options['drop_before']:
+            try:
+                before = datetime.datetime.strptime(options['drop_before'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError(F'--drop-before 格式有误: {options["drop_before"]}, 示例 2024-01')
+            if before > MonthlyPartitioner.month_start(timezone.localdate()):
+                raise CommandError('--drop-before 不能晚于当前月份')
+        for model in PARTITIONED_MODELS:
+            if options['model'] and model._meta.model_name != options['model']:
+                continue
+            partitioner = MonthlyPartitioner(model)
+            partitions: list = partitioner.get_partitions()
+            if options['convert']:
+                if partitions:
+                    self.stdout.write(F'{partitioner.table}: 已分区, 跳过转换')
+                    statements: list = partitioner.extend_sql(partitions, until)
+                else:
+                    statements = partitioner.convert_sql(until)
+            elif not partitions:
+                if not options['dry_run']:
+                    raise CommandError(F'{partitioner.table} 未分区, 请先执行 --convert')
+                self.stdout.write(F'{partitioner.table}: 未分区, 请先执行 --convert')
+                continue
+            else:
+                statements = partitioner.extend_sql(partitions, until)
+            dropped: list = list()
+            if before is not None:
+                dropped = [month for month in partitioner.get_months(partitions) if month < before]
+                statements += partitioner.drop_sql(partitions, before, exchange=options['exchange'])
+            for statement in statements:
+                self.stdout.write(statement + ';')
+            if options['dry_run']:
+                continue
+            last_day = partitioner.next_month(dropped[-1]) - datetime.timedelta(days=1) if dropped else None
+            if dropped:
+                partitioner.before_drop(last_day)
+            partitioner.execute(statements)
+            if dropped:
+                partitioner.after_drop(dropped[0], last_day)
+            months: list = partitioner.get_months(partitioner.get_partitions())
+            self.stdout.write(
+                F'{partitioner.table}: 执行 {len(statements)} 条 SQL, 删除 {len(dropped)} 个分区, '
+                F'现有 {len(months)} 个月份分区' + (F' {months[0]:%Y-%m} ~ {months[-1]:%Y-%m}' if months else '')
+            )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from xicheba.models import Users, Materials
+
+# 模型 --> (读取列, 回填列)
+SEARCH_INDEX_FIELDS: dict = {
+    Users: (('id', 'name', 'phone_number'), ('name_pinyin', 'name_initials', 'phone_number_reversed')),
+    Materials: (('id', 'name'), ('name_pinyin', 'name_initials')),
+}
+
+
+class Command(BaseCommand):
+    help = '回填客户、材料的拼音与手机号倒序查询列'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批更新的行数')
+
+    def handle(self, *args, **options):
+        batch_size: int = options['batch_size']
+        for model, (source_fields, fields) in SEARCH_INDEX_FIELDS.items():
+            manager = getattr(model, 'all_objects', model.objects)
+            batch: list = list()
+            total: int = 0
+            for obj in manager.only(*source_fields).iterator(chunk_size=batch_size):
+                obj.update_search_index()
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    manager.bulk_update(batch, fields)
+                    total += len(batch)
+                    batch = list()
+            if batch:
+                manager.bulk_update(batch, fields)
+                total += len(batch)
+            self.stdout.write(F'{model._meta.verbose_name_plural}: 更新 {total} 行')
@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+from django.utils import timezone
+
+from xicheba.models import CashierDailySummary, ExtraProjectDailySummary, ChangeListDateIndex, Users, Cashier, \
+    ExtraProject
+
+
+class Command(BaseCommand):
+    help = '按日期范围回填或修复出纳、散项日汇总, 以及客户、出纳、散项 changelist 的按日索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=datetime.date.fromisoformat, help='开始日期 YYYY-MM-DD, 默认最早一条明细')
+        parser.add_argument('--end', type=datetime.date.fromisoformat, help='结束日期 YYYY-MM-DD, 默认最近一条明细')
+
+    def handle(self, *args, **options):
+        for summary in (CashierDailySummary, ExtraProjectDailySummary):
+            bounds: dict = summary.get_source_queryset().aggregate(start=Min('create_time'), end=Max('create_time'))
+            if bounds['start'] is None:
+                continue
+            start = options['start'] or timezone.localdate(bounds['start'])
+            end = options['end'] or timezone.localdate(bounds['end'])
+            if start > end:
+                raise CommandError(F'开始日期 {start} 大于结束日期 {end}')
+            rows: int = summary.rebuild(start, end)
+            self.stdout.write(F'{summary._meta.verbose_name}: {start} ~ {end} 共 {rows} 行')
+        for model in (Users, Cashier, ExtraProject):
+            bounds: dict = model.all_objects.aggregate(start=Min('create_time'), end=Max('create_time'))
+            if bounds['start'] is None:
+                continue
+            start = options['start'] or timezone.localdate(bounds['start'])
+            end = options['end'] or timezone.localdate(bounds['end'])
+            if start > end:
+                raise CommandError(F'开始日期 {start} 大于结束日期 {end}')
+            rows: int = ChangeListDateIndex.rebuild(model, start, end)
+            self.stdout.write(F'{model._meta.verbose_name_plural}按日索引: {start} ~ {end} 共 {rows} 行')
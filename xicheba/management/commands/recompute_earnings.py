@@ -0,0 +1,40 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min, Max
+from django.utils import timezone
+
+from xicheba.models import Cashier, CashierDailySummary
+
+
+class Command(BaseCommand):
+    help = '按日期范围根据出纳明细的价格快照批量重算总金额与收益, 并重建出纳日汇总'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=datetime.date.fromisoformat, help='开始日期 YYYY-MM-DD, 默认最早一条明细')
+        parser.add_argument('--end', type=datetime.date.fromisoformat, help='结束日期 YYYY-MM-DD, 默认最近一条明细')
+        parser.add_argument('--batch-days', type=int, default=31, help='每个事务处理的天数')
+        parser.add_argument('--snapshot', action='store_true',
+                            help='先为未记录价格快照的历史明细补记材料的当前价格')
+
+    def handle(self, *args, **options):
+        bounds: dict = Cashier.all_objects.aggregate(start=Min('create_time'), end=Max('create_time'))
+        if bounds['start'] is None:
+            self.stdout.write('没有出纳明细')
+            return
+        start = options['start'] or timezone.localdate(bounds['start'])
+        end = options['end'] or timezone.localdate(bounds['end'])
+        if start > end:
+            raise CommandError(F'开始日期 {start} 大于结束日期 {end}')
+        if options['batch_days'] <= 0:
+            raise CommandError('--batch-days 必须大于 0')
+        rows: int = 0
+        batch_start = start
+        while batch_start <= end:
+            batch_end = min(batch_start + datetime.timedelta(days=options['batch_days'] - 1), end)
+            with transaction.atomic():
+                rows += Cashier.recompute_earnings(batch_start, batch_end, snapshot=options['snapshot'])
+                CashierDailySummary.rebuild(batch_start, batch_end)
+            batch_start = batch_end + datetime.timedelta(days=1)
+        self.stdout.write(F'{start} ~ {end} 共重算 {rows} 行出纳明细')
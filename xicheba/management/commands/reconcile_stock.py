@@ -0,0 +1,34 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from xicheba.stock import StockReconciler
+
+
+class Command(BaseCommand):
+    help = ('按出纳明细核对材料数量: 一次分组聚合计算各材料应有的数量并输出差异, --fix 一次批量修正并写入库存流水; '
+            '默认从检查点增量扫描, 建议每日由 cron 执行; 导入历史明细时不要执行 --fix')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='按出纳明细修正材料数量')
+        parser.add_argument('--full', action='store_true', help='忽略检查点, 扫描全部出纳明细')
+        parser.add_argument('--close-days', type=int, default=7, help='多少天之前的明细结转到检查点, 之后的每次重新汇总')
+        parser.add_argument('--user', default=None, help='--fix 写入库存流水的用户名')
+
+    def handle(self, *args, **options):
+        if options['close_days'] < 0:
+            raise CommandError('--close-days 不能小于 0')
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(F'用户不存在: {options["user"]}')
+        reconciler = StockReconciler(close_days=options['close_days'])
+        drifts: list = reconciler.run(fix=options['fix'], full=options['full'], user=user)
+        for drift in drifts:
+            self.stdout.write(F'{drift["materials"]}: 材料数量 {drift["number"]}, 出纳明细 {drift["ledger"]}, '
+                              F'差异 {drift["drift"]:+d}')
+        scan: str = F'增量扫描 {timezone.localtime(reconciler.start):%Y-%m-%d} 之后的明细' if reconciler.incremental \
+            else '全量扫描'
+        result: str = '已修正' if options['fix'] else '未修正, 使用 --fix 修正'
+        self.stdout.write(F'{scan}, {len(drifts)} 个材料数量与出纳明细不一致' + (F', {result}' if drifts else ''))
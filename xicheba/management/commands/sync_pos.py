@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from django.db.models import Count
+
+from xicheba import pos
+from xicheba.models import PosJournal, Choices
+
+
+class Command(BaseCommand):
+    help = '本地收银队列同步到主库: 按记账时间顺序分批写入出纳明细并调整材料数量, 冲突以主库为准'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='每批同步的记录数, 每批一个主库事务')
+        parser.add_argument('--loop', action='store_true', help='持续运行, 主库不可用时等待后重试')
+        parser.add_argument('--interval', type=float, default=5, help='--loop 时每轮的间隔秒数')
+        parser.add_argument('--status', action='store_true', help='只输出队列各状态的数量与冲突记录')
+
+    def handle(self, *args, **options):
+        if not pos.is_enabled():
+            raise CommandError('未配置本地收银队列, 请设置环境变量 XICHEBA_POS_JOURNAL')
+        pos.ensure_journal()
+        if options['status']:
+            return self.print_status()
+        while True:
+            sync = pos.PosSync(batch_size=options['batch_size'])
+            start: float = time.perf_counter()
+            try:
+                processed: int = sync.run()
+            except DatabaseError as error:
+                # 已提交的批次状态已更新, 未提交的批次下一轮按幂等键重试
+                if not options['loop']:
+                    raise CommandError(F'同步中断: {error}')
+                self.stderr.write(F'同步中断, {options["interval"]}s 后重试: {error}')
+                processed = 0
+            if processed:
+                self.stdout.write(F'同步 {sync.synced} 条, 冲突 {sync.conflicts} 条, 耗时 {time.perf_counter() - start:.2f}s')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def print_status(self) -> None:
+        counts: dict = dict(PosJournal.objects.values_list('status').annotate(count=Count('id')))
+        self.stdout.write(', '.join(F'{label} {counts.get(value, 0)}' for value, label in Choices.PosStatus.choices))
+        for entry in PosJournal.objects.filter(status=Choices.PosStatus.conflict).order_by('create_time'):
+            self.stdout.write(F'{entry.idempotency_key} {entry.get_operation_display()} 出纳明细ID={entry.object_id}: '
+                              F'{entry.message}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from xicheba import pos
+from xicheba.models import Materials, EventType, ToolsBox
+from xicheba.registry import reference_cache
+
+
+class Command(BaseCommand):
+    help = ('预热参考数据缓存(材料、事件类型枚举与用户显示名称), 部署后执行使各 worker 直接命中共享缓存; '
+            '本地收银模式下同时刷新终端缓存的材料与用户, 建议主库可用时由 cron 定期执行')
+
+    def handle(self, *args, **options):
+        for model in (Materials, EventType):
+            self.stdout.write(F'{model._meta.verbose_name_plural}: {len(model.get_values(value="name"))} 项')
+        self.stdout.write(F'用户显示名称: {len(ToolsBox.get_user_names())} 项')
+        if pos.is_enabled():
+            materials_count, users_count = pos.warm_cache()
+            self.stdout.write(F'终端缓存: 材料 {materials_count} 项, 用户 {users_count} 项')
+        stats: dict = reference_cache.stats()
+        self.stdout.write(F'进程内命中 {stats["hits"]} 共享缓存命中 {stats["shared_hits"]} 查询数据库 {stats["misses"]}')
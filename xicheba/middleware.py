@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('xicheba.metrics')
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper 回调, 记录一次请求的 SQL 条数、耗时与最慢的语句
+    """
+
+    def __init__(self, slow_queries: int):
+        self.slow_queries: int = slow_queries
+        self.count: int = 0
+        self.seconds: float = 0.0
+        self.slowest: list = list()
+
+    def __call__(self, execute, sql, params, many, context):
+        start: float = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds: float = time.perf_counter() - start
+            self.count += 1
+            self.seconds += seconds
+            if self.slow_queries:
+                self.slowest.append((seconds, sql[:200]))
+                self.slowest.sort(key=lambda item: item[0], reverse=True)
+                del self.slowest[self.slow_queries:]
+
+
+class ViewMetrics:
+    """
+    进程内按视图汇总的指标, 以 Prometheus 文本格式输出
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # view --> [请求数, 请求耗时, SQL 条数, SQL 耗时, 单次请求最多 SQL 条数]
+        self._views: dict = dict()
+
+    def observe(self, view: str, seconds: float, recorder: QueryRecorder) -> None:
+        with self._lock:
+            values: list = self._views.setdefault(view, [0, 0.0, 0, 0.0, 0])
+            values[0] += 1
+            values[1] += seconds
+            values[2] += recorder.count
+            values[3] += recorder.seconds
+            values[4] = max(values[4], recorder.count)
+
+    def render(self) -> str:
+        metrics: tuple = (
+            ('xicheba_requests_total', 'counter', '采样的请求数', 0),
+            ('xicheba_request_seconds_total', 'counter', '请求总耗时(秒)', 1),
+            ('xicheba_db_queries_total', 'counter', 'SQL 条数', 2),
+            ('xicheba_db_seconds_total', 'counter', 'SQL 总耗时(秒)', 3),
+            ('xicheba_db_queries_max', 'gauge', '单次请求最多 SQL 条数', 4),
+        )
+        with self._lock:
+            views: dict = {view: list(values) for view, values in self._views.items()}
+        lines: list = list()
+        for name, metric_type, description, index in metrics:
+            lines.append(F'# HELP {name} {description}')
+            lines.append(F'# TYPE {name} {metric_type}')
+            for view, values in sorted(views.items()):
+                lines.append(F'{name}{{view="{view}"}} {values[index]}')
+        lines.append('# HELP xicheba_python_seconds_total 请求中 SQL 以外的耗时(秒)')
+        lines.append('# TYPE xicheba_python_seconds_total counter')
+        for view, values in sorted(views.items()):
+            lines.append(F'xicheba_python_seconds_total{{view="{view}"}} {values[1] - values[3]}')
+        return '\n'.join(lines) + '\n'
+
+
+view_metrics = ViewMetrics()
+
+
+class QueryMetricsMiddleware:
+    """
+    按 XICHEBA_METRICS_SAMPLE_RATE 采样请求, 记录每个视图的 SQL 条数、SQL 耗时、最慢语句与 Python 耗时
+    结果写入 xicheba.metrics 日志(JSON) 并汇总到 /api/metrics/ (Prometheus 文本格式)
+    同时支持 WSGI 与 ASGI, ASGI 下 await 视图, 不占用线程池等待整个请求
+    """
+    sync_capable: bool = True
+    async_capable: bool = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # 与 django.utils.deprecation.MiddlewareMixin 相同, 标记为协程函数后 ASGI 直接 await __call__
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        else:
+            self._is_coroutine = None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        recorder: QueryRecorder = self.get_recorder()
+        if recorder is None:
+            return self.get_response(request)
+        with ExitStack() as stack:
+            self.wrap_connections(stack, recorder)
+            start: float = time.perf_counter()
+            response = self.get_response(request)
+            seconds: float = time.perf_counter() - start
+        self.report(request, response, seconds, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder: QueryRecorder = self.get_recorder()
+        if recorder is None:
+            return await self.get_response(request)
+        # 数据库连接按线程保存, 同一请求中的同步视图与 ORM 调用都在 sync_to_async 的同一个线程中执行,
+        # 在该线程中包装连接, 请求结束后在该线程中移除
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, recorder)
+        try:
+            start: float = time.perf_counter()
+            response = await self.get_response(request)
+            seconds: float = time.perf_counter() - start
+        finally:
+            await sync_to_async(stack.close)()
+        self.report(request, response, seconds, recorder)
+        return response
+
+    @staticmethod
+    def get_recorder():
+        """
+        :return: 本次请求被采样时返回 QueryRecorder, 否则返回 None
+        """
+        sample_rate: float = getattr(settings, 'XICHEBA_METRICS_SAMPLE_RATE', 0)
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return None
+        return QueryRecorder(getattr(settings, 'XICHEBA_METRICS_SLOW_QUERIES', 3))
+
+    @staticmethod
+    def wrap_connections(stack: ExitStack, recorder: QueryRecorder) -> None:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    @staticmethod
+    def report(request, response, seconds: float, recorder: QueryRecorder) -> None:
+        """
+        汇总到 view_metrics 并写入 xicheba.metrics 日志
+        :param request: 请求
+        :param response: 响应
+        :param seconds: 请求耗时
+        :param recorder: 本次请求的 QueryRecorder
+        :return: None
+        """
+        match = request.resolver_match
+        view: str = match.view_name if match else 'unresolved'
+        view_metrics.observe(view, seconds, recorder)
+        logger.info(json.dumps({
+            'view': view,
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'seconds': round(seconds, 6),
+            'queries': recorder.count,
+            'sql_seconds': round(recorder.seconds, 6),
+            'python_seconds': round(seconds - recorder.seconds, 6),
+            'slowest': [{'seconds': round(sql_seconds, 6), 'sql': sql} for sql_seconds, sql in recorder.slowest],
+        }, ensure_ascii=False))
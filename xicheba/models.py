@@ -1,13 +1,23 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F, Q, Sum, Count, Case, When, Value, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce, TruncDate, TruncWeek, TruncMonth
+from django.db.utils import IntegrityError
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import User
 
+from .registry import choice_registry, count_cache, reference_cache, LazyChoices, LazyChoiceCharField
+
 
 # Create your models here.
 
 
 class ToolsBox:
+    _pinyin = None
+
     def remarks_context(self) -> str:
         """
          remarks 备注字符大于30个字符使用省略号替代
@@ -32,39 +42,143 @@ class ToolsBox:
     @classmethod
     def get_values(cls, value: str = None) -> tuple[tuple[str, str]]:
         """
-        获取枚举对象
+        获取枚举对象, 由 choice_registry 缓存, Materials/EventType 变更时自动失效
+        :param value:   对象 cls 的列名称
+        :return: examples (('x','y'),('z', 'm'),)
+        """
+        return choice_registry.get(cls, value=value)
+
+    @classmethod
+    def get_pinyin(cls, text: str) -> tuple[str, str]:
+        """
+        获取全拼与首字母, Pinyin 对象只创建一次
+        :param text: 中文字符串
+        :return: examples ('zhangsan', 'ZS')
+        """
+        if ToolsBox._pinyin is None:
+            try:
+                from xpinyin import Pinyin as Py
+            except ModuleNotFoundError as notFoundModulePinyin:
+                raise ModuleNotFoundError(
+                    F'NotFound module xpinyin.Pinyin from className={cls.__name__} functionName={cls.get_pinyin.__name__}'
+                ) from notFoundModulePinyin
+            ToolsBox._pinyin = Py()
+        return ToolsBox._pinyin.get_pinyin(text, ''), ToolsBox._pinyin.get_initials(text, '')
+
+    @classmethod
+    def build_values(cls, value: str = None) -> tuple[tuple[str, str]]:
+        """
+        构建枚举对象, 只查询 id 与 value 两列
         :param value:   对象 cls 的列名称
         :return: examples (('x','y'),('z', 'm'),)
         """
-        try:
-            from xpinyin import Pinyin as Py
-        except ModuleNotFoundError as notFoundModulePinyin:
-            raise ModuleNotFoundError(
-                F'NotFound module xpinyin.Pinyin from className={cls.__name__} functionName={cls.get_values.__name__}'
-            ) from notFoundModulePinyin
-        p = Py()
         data_list: list = list()
-        for obj in cls.objects.all():
-            val: str = F'obj.{value}'
-            vals: str = str(obj.id) + '-' + eval(val)
-            key: str = str(obj.id) + '-' + p.get_initials(eval(val), '')
+        for obj_id, val in cls.objects.values_list('id', value):
+            vals: str = str(obj_id) + '-' + val
+            key: str = str(obj_id) + '-' + cls.get_pinyin(val)[1]
             data_list.append((key, vals))
         return tuple(data_list)
 
+    def update_search_index(self) -> None:
+        """
+        同步 name 的全拼、首字母(小写)列, 以及手机号倒序列, 用于前缀索引查询
+        :return: None
+        """
+        name_pinyin, name_initials = self.get_pinyin(self.name)
+        self.name_pinyin, self.name_initials = name_pinyin.lower(), name_initials.lower()
+        if hasattr(self, 'phone_number_reversed'):
+            self.phone_number_reversed = self.phone_number[::-1] if self.phone_number else None
+
+    @staticmethod
+    def get_user_names() -> dict:
+        """
+        全部登录用户的显示名称, 由 reference_cache 缓存, User 变更时自动失效
+        :return: {user_id: (last_name + first_name, username)}
+        """
+        return reference_cache.get_or_build(User, 'names', lambda: {
+            user_id: (last_name + first_name, username)
+            for user_id, username, last_name, first_name in User.objects.values_list(
+                'id', 'username', 'last_name', 'first_name')
+        })
+
+    @staticmethod
+    def prefetch_create_by_user_name(objs) -> None:
+        """
+        从 get_user_names 获取 objs 全部的创建者名称, 避免 changelist 每一行都查询一次 User
+        :param objs: 对象列表或已切片的 queryset
+        :return: None
+        """
+        user_names: dict = ToolsBox.get_user_names()
+        for obj in objs:
+            full_name: str = user_names.get(obj.create_by_user_id, ('', None))[0]
+            obj._create_by_user_name = full_name or obj.create_by_user_id
+
     def create_by_user_name(self) -> str:
         """
-        通过 用户 Id 获取 用户名
+        通过 用户 Id 获取 用户名, 优先使用 prefetch_create_by_user_name 预取的结果
         :return: last_name + first_name
         """
-
-        user_obj: object = User.objects.get(id=self.create_by_user)
-        # user_obj.get_full_name()
-        full_name: str = user_obj.last_name + user_obj.first_name
-        return full_name or user_obj.id
+        if hasattr(self, '_create_by_user_name'):
+            return self._create_by_user_name
+        if self.create_by_user_id is None:
+            return None
+        full_name: str = self.get_user_names().get(self.create_by_user_id, ('', None))[0]
+        return full_name or self.create_by_user_id
 
     create_by_user_name.admin_order_field = 'create_by_user'
     create_by_user_name.short_description = '创建者'
 
+    @staticmethod
+    def build_status_case(conditions: dict, default: int) -> Case:
+        """
+        状态列的 Case/When 表达式, 用于 annotate 与 order_by
+        :param conditions: {状态值: Q}, 各 Q 互斥
+        :param default: 都不满足时的状态值
+        :return: Case
+        """
+        return Case(*[When(condition, then=Value(status)) for status, condition in conditions.items()],
+                    default=Value(default), output_field=IntegerField())
+
+    @staticmethod
+    def build_status_filter(conditions: dict, status: int) -> Q:
+        """
+        按状态过滤的条件, 直接比较原始列以便命中索引, 不比较 annotate 的 Case 结果
+        :param conditions: {状态值: Q}, 各 Q 互斥
+        :param status: 状态值, 不在 conditions 中时为默认状态
+        :return: Q
+        """
+        if status in conditions:
+            return conditions[status]
+        condition = Q()
+        for other in conditions.values():
+            condition &= ~other
+        return condition
+
+
+class SoftDeleteManager(models.Manager):
+    """
+    默认管理器只返回未逻辑删除的行, 使用 is_deleted = False 等值条件以便命中索引
+    包含逻辑删除的行请使用 all_objects
+    """
+
+    def get_queryset(self):
+        # is_deleted=False 在 SQLite 上生成 NOT is_deleted, 复合索引 (create_by_user, is_deleted, create_time)
+        # 只能使用第一列并对结果排序; 与 Value 比较时各数据库都生成等值条件
+        return super().get_queryset().filter(is_deleted=Value(False))
+
+
+class CreateTimeField(models.DateTimeField):
+    """
+    auto_now_add 的创建时间, 新增时对象上已有值则保留
+    导入、本地收银同步、生成压测数据时在对象上指定 create_time 后直接 bulk_create, 不修改字段的 auto_now_add
+    """
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if add and value is not None:
+            return value
+        return super().pre_save(model_instance, add)
+
 
 class Choices:
     class IsMembersChoice(models.TextChoices):
@@ -104,49 +218,166 @@ class Choices:
         price = 'price', _('售价')
         discount_price = 'discount_price', _('折扣价')
 
+    class FrequencyStatus(models.IntegerChoices):
+        """
+        枚举 客户消费次数状态, 按数值排序
+        """
+        normal = 0, _('正常')
+        zero = 1, _('消费次数0')
+        exhausted = 2, _('消费次数已用完')
+        invalid = 3, _('消费次数有误')
+
+    class PosOperation(models.TextChoices):
+        """
+        枚举 本地收银队列的操作
+        """
+        create = 'create', _('新增')
+        update = 'update', _('修改')
+
+    class PosStatus(models.TextChoices):
+        """
+        枚举 本地收银队列的同步状态
+        """
+        pending = 'pending', _('待同步')
+        synced = 'synced', _('已同步')
+        conflict = 'conflict', _('冲突')
+
+    class EarningsStatus(models.IntegerChoices):
+        """
+        枚举 出纳收益状态, 按数值排序
+        """
+        loss = 0, _('亏本')
+        no_earnings = 1, _('暂无收益')
+        original_price = 2, _('原价出售')
+        profit = 3, _('有收益')
+        outgoing = 4, _('支出')
+        unknown = 5, _('未知')
+
 
 class Users(models.Model, ToolsBox):
     id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
-    name = models.CharField(max_length=20, verbose_name='客户名称')
+    name = models.CharField(max_length=20, db_index=True, verbose_name='客户名称')
+    name_pinyin = models.CharField(max_length=128, default='', db_index=True, editable=False, verbose_name='全拼')
+    name_initials = models.CharField(max_length=20, default='', db_index=True, editable=False, verbose_name='首字母')
     sex = models.CharField(choices=Choices.UserGenderChoice.choices, max_length=1, default=Choices.UserGenderChoice.G,
                            verbose_name='客户性别')
     user_level = models.CharField(choices=Choices.IsMembersChoice.choices, max_length=10,
                                   default=Choices.IsMembersChoice.not_member,
                                   verbose_name='客户等级')
-    phone_number = models.CharField(max_length=11, blank=True, null=True, verbose_name='手机号码')
+    phone_number = models.CharField(max_length=11, blank=True, null=True, db_index=True, verbose_name='手机号码')
+    phone_number_reversed = models.CharField(max_length=11, blank=True, null=True, db_index=True, editable=False,
+                                             verbose_name='手机号码倒序', help_text='手机号后缀查询')
     make_collections = models.IntegerField(default=0, verbose_name='已收会员款')
     payment_methods = models.CharField(max_length=10, choices=Choices.PaymentMethodsChoice.choices,
                                        default=Choices.PaymentMethodsChoice.wechat, verbose_name='支付方式')
     member_frequency = models.IntegerField(default=0, verbose_name='会员价次数')
     using_frequency = models.IntegerField(default=0, verbose_name='消费次数', help_text='每消费一次加一')
     remarks = models.CharField(max_length=100, blank=True, null=True, verbose_name='备注', help_text='100字以内的备注内容')
-    create_by_user = models.IntegerField(default='0', verbose_name='创建用户')
+    create_by_user = models.ForeignKey(User, on_delete=models.PROTECT, db_column='create_by_user', db_index=False,
+                                       null=True, blank=True, related_name='+', verbose_name='创建用户')
     is_deleted = models.BooleanField(default=False, verbose_name='逻辑删除')
-    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    create_time = CreateTimeField(auto_now_add=True, verbose_name='创建时间')
     update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
     def delete(self, using=None, keep_parents=False):
         # 逻辑删除
         self.is_deleted = True
         self.save()
 
-    def member_frequency_warning(self) -> int:
+    def save(self, *args, **kwargs) -> None:
+        # 同步拼音、手机号倒序查询列
+        self.update_search_index()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def check_in(cls, user_id: int = None, phone_number: str = None) -> dict:
         """
-        会员价洗车次数 > 剩余次数 return 剩余次数有误
-        剩余次数 <= 0 return 剩余次数0
-        会员价洗车次数 ==  剩余次数 return 消费次数已用完
-        :return: 对象 self 的 using_frequency 列
+        会员消费一次: 单条 UPDATE 原子加一, 并在同一条语句中校验会员价次数
+        :param user_id: 客户 id
+        :param phone_number: 手机号码, 未传 user_id 时使用
+        :return: {'id', 'name', 'member_frequency', 'using_frequency', 'remaining'}
+        """
+        if user_id is None:
+            user_ids: list = list(cls.objects.filter(phone_number=phone_number).values_list('id', flat=True)[:2])
+            if not user_ids:
+                raise cls.DoesNotExist(F'手机号码 {phone_number} 不存在')
+            if len(user_ids) > 1:
+                raise cls.MultipleObjectsReturned(F'手机号码 {phone_number} 对应多个客户, 请使用客户 ID')
+            user_id = user_ids[0]
+        fields: tuple = ('id', 'name', 'user_level', 'member_frequency', 'using_frequency')
+        with transaction.atomic():
+            updated: int = cls.objects.filter(
+                id=user_id, user_level=Choices.IsMembersChoice.member, using_frequency__lt=F('member_frequency')
+            ).update(using_frequency=F('using_frequency') + 1, update_time=timezone.now())
+            # 同一事务内持有行锁, 读取到的就是本次更新后的次数
+            row: dict = cls.objects.filter(id=user_id).values(*fields).first()
+        if row is None:
+            raise cls.DoesNotExist(F'客户 {user_id} 不存在')
+        if not updated:
+            if row['user_level'] != Choices.IsMembersChoice.member:
+                raise ValidationError('非会员客户')
+            raise ValidationError('消费次数已用完')
+        row['remaining'] = row['member_frequency'] - row['using_frequency']
+        return row
+
+    @staticmethod
+    def get_frequency_status_conditions() -> dict:
+        """
+        会员 剩余次数 <= 0 --> 消费次数0
+        会员 会员价洗车次数 == 剩余次数 --> 消费次数已用完
+        会员 会员价洗车次数 < 剩余次数 --> 消费次数有误
+        索引 users_frequency_status_idx (user_level, using_frequency, member_frequency)
+        :return: {Choices.FrequencyStatus: Q}
+        """
+        member = Q(user_level=Choices.IsMembersChoice.member)
+        used = Q(using_frequency__gt=0)
+        return {
+            Choices.FrequencyStatus.zero: member & Q(using_frequency__lte=0),
+            Choices.FrequencyStatus.exhausted: member & used & Q(using_frequency=F('member_frequency')),
+            Choices.FrequencyStatus.invalid: member & used & Q(using_frequency__gt=F('member_frequency')),
+        }
+
+    @classmethod
+    def frequency_status_case(cls) -> Case:
+        """
+        :return: 消费次数状态的 Case 表达式, examples Users.objects.annotate(frequency_status=Users.frequency_status_case())
+        """
+        return cls.build_status_case(cls.get_frequency_status_conditions(), Choices.FrequencyStatus.normal)
+
+    def get_frequency_status(self) -> int:
+        """
+        优先使用 annotate 的 frequency_status, 否则按 get_frequency_status_conditions 的规则计算
+        :return: Choices.FrequencyStatus
         """
+        if hasattr(self, 'frequency_status'):
+            return self.frequency_status
         if self.user_level == Choices.IsMembersChoice.member:
             if self.using_frequency <= 0:
-                return format_html('<span style="color: green;">{}</span>', '消费次数0')
+                return Choices.FrequencyStatus.zero
             elif self.using_frequency == self.member_frequency:
-                return format_html('<span style="color: red;">{}</span>', '消费次数已用完')
+                return Choices.FrequencyStatus.exhausted
             elif self.using_frequency > self.member_frequency:
+                return Choices.FrequencyStatus.invalid
+        return Choices.FrequencyStatus.normal
+
+    def member_frequency_warning(self) -> int:
+        """
+        消费次数状态, 正常时显示消费次数
+        :return: 对象 self 的 using_frequency 列
+        """
+        match self.get_frequency_status():
+            case Choices.FrequencyStatus.zero:
+                return format_html('<span style="color: green;">{}</span>', '消费次数0')
+            case Choices.FrequencyStatus.exhausted:
+                return format_html('<span style="color: red;">{}</span>', '消费次数已用完')
+            case Choices.FrequencyStatus.invalid:
                 return format_html('<span style="color: red;">{}</span>', '消费次数有误')
         return self.using_frequency
 
-    member_frequency_warning.admin_order_field = 'using_frequency'
+    member_frequency_warning.admin_order_field = 'frequency_status'
     member_frequency_warning.short_description = '消费次数'
 
     def __str__(self) -> str:
@@ -155,112 +386,395 @@ class Users(models.Model, ToolsBox):
     class Meta:
         verbose_name = "客户明细"
         verbose_name_plural = "客户管理"
+        indexes = [
+            # 非超级用户 changelist: filter(create_by_user=...).exclude(is_deleted=True) + date_hierarchy
+            models.Index(fields=['create_by_user', 'is_deleted', 'create_time'], name='users_owner_live_idx'),
+            # 超级用户 changelist: date_hierarchy
+            models.Index(fields=['create_time'], name='users_create_time_idx'),
+            # 消费次数状态过滤: user_level 等值 + using_frequency 范围, member_frequency 在索引内比较
+            models.Index(fields=['user_level', 'using_frequency', 'member_frequency'], name='users_frequency_status_idx'),
+        ]
 
 
 class Materials(models.Model, ToolsBox):
     id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
-    name = models.CharField(max_length=15, verbose_name='材料名')
+    name = models.CharField(max_length=15, db_index=True, verbose_name='材料名')
+    name_pinyin = models.CharField(max_length=128, default='', db_index=True, editable=False, verbose_name='全拼')
+    name_initials = models.CharField(max_length=15, default='', db_index=True, editable=False, verbose_name='首字母')
     specifications = models.CharField(max_length=15, blank=True, null=True, verbose_name='规格')
     original_price = models.IntegerField(default=0, verbose_name='原价')
     price = models.IntegerField(default=0, verbose_name='售价')
     discount_price = models.IntegerField(default=0, verbose_name='折扣价')
     number = models.IntegerField(default=0, verbose_name='数量', help_text='由出纳管理自动记数')
+    reorder_threshold = models.IntegerField(default=0, verbose_name='补货提醒数量', help_text='数量小于等于该值时提醒补货, 0 不提醒')
+    is_low_stock = models.BooleanField(default=False, db_index=True, editable=False, verbose_name='库存不足')
     brand = models.CharField(max_length=10, blank=True, verbose_name='品牌名')
     functions_and_performance = models.CharField(max_length=20, blank=True, null=True, verbose_name='功能')
     remarks = models.CharField(max_length=100, blank=True, null=True, verbose_name='备注', help_text='100字以内的备注内容')
-    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    create_time = CreateTimeField(auto_now_add=True, verbose_name='创建时间')
     update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
     def __str__(self) -> str:
         return str(self.id) + '-' + self.name
 
+    def save(self, *args, **kwargs) -> None:
+        # 同步拼音查询列
+        self.update_search_index()
+        stock_state: tuple = (self.number, self.reorder_threshold)
+        update_fields = kwargs.get('update_fields')
+        # 新增、读取后修改了数量或补货提醒数量时才需要重新检查库存不足, 只修改名称价格等不锁定材料行
+        check: bool = self._state.adding or self._stock_state != stock_state
+        if update_fields is not None:
+            check = check and not {'number', 'reorder_threshold'}.isdisjoint(update_fields)
+        if not check:
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # 按加锁读取的数量更新库存不足标记
+            materials_obj: Materials = Materials.objects.select_for_update().get(id=self.id)
+            materials_obj.update_low_stock()
+        self._stock_state = materials_obj._stock_state
+
+    def update_low_stock(self) -> None:
+        """
+        根据 number 与 reorder_threshold 更新库存不足标记, 由正常变为不足时写入补货提醒发件箱
+        需要在 transaction.atomic() 中以 select_for_update() 获取 self 后调用, 并发出库时只提醒一次
+        :return: None
+        """
+        is_low_stock: bool = 0 < self.reorder_threshold and self.number <= self.reorder_threshold
+        if is_low_stock == self.is_low_stock:
+            return
+        Materials.objects.filter(id=self.id).update(is_low_stock=is_low_stock)
+        self.is_low_stock = is_low_stock
+        if is_low_stock:
+            LowStockNotification.objects.create(materials=self, number=self.number,
+                                                reorder_threshold=self.reorder_threshold)
+
+    def adjust_number(self, number: int, cashier=None, create_by_user_id: int = None) -> None:
+        """
+        调整材料数量并写入库存流水
+        需要在 transaction.atomic() 中以 select_for_update() 获取 self 后调用
+        :param number: 变动数量, 入库为正 出库为负
+        :param cashier: 引起变动的出纳明细, 批量记账时为 None
+        :param create_by_user_id: 创建用户 id, 默认取 cashier 的创建用户
+        :return: None
+        """
+        if cashier is not None and create_by_user_id is None:
+            create_by_user_id = cashier.create_by_user_id
+        Materials.objects.filter(id=self.id).update(number=F('number') + number)
+        self.number += number
+        StockMovement.objects.create(materials=self, cashier=cashier, number=number, balance=self.number,
+                                     create_by_user_id=create_by_user_id)
+        # 只检查本次变动的材料
+        self.update_low_stock()
+
     class Meta:
         verbose_name = '材料明细'
         verbose_name_plural = '材料管理'
 
 
 class Cashier(models.Model, ToolsBox):
-    def __init__(self, *args, **kwargs):
-        """
-        动态获取材料名
-        """
-        self.materials = Materials
-        super().__init__(*args, **kwargs)
-        self._meta.get_field('name').choices = Materials.get_values(value='name')
-
     id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
-    name = models.CharField(max_length=30, choices=Materials.get_values(value='name'), default='', verbose_name='物品名称')
+    name = models.ForeignKey(Materials, on_delete=models.PROTECT, db_column='name', verbose_name='物品名称')
     action = models.CharField(choices=Choices.CashierChoice.choices, max_length=10, verbose_name="记账类型")
     number = models.IntegerField(default=0, verbose_name='数量', help_text='自动记数到材料管理')
     price_type = models.CharField(max_length=20, choices=Choices.MaterialsPriceType.choices, verbose_name='价格类型',
                                   help_text='记账类型为支出请选择: 原价 < ฅʕ•̫͡•ʔฅ > 记账类型为收入请选择：售价或者折扣价')
     money = models.IntegerField(default=0, verbose_name='总金额', help_text='总价格自动计算')
     earnings = models.IntegerField(default=0, verbose_name='收益', help_text='收益自动计算')
+    unit_price = models.IntegerField(default=0, verbose_name='单价', help_text='记账时价格类型对应的材料价格')
+    original_price = models.IntegerField(default=0, verbose_name='原价', help_text='记账时材料的原价')
     remarks = models.CharField(max_length=100, blank=True, null=True, verbose_name='备注', help_text='100字以内的备注内容')
     is_deleted = models.BooleanField(default=False, verbose_name='逻辑删除')
-    create_by_user = models.IntegerField(default='0', verbose_name='创建用户')
-    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    create_by_user = models.ForeignKey(User, on_delete=models.PROTECT, db_column='create_by_user', db_index=False,
+                                       null=True, blank=True, related_name='+', verbose_name='创建用户')
+    create_time = CreateTimeField(auto_now_add=True, verbose_name='创建时间')
     update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
     def delete(self, using=None, keep_parents=False):
         # 逻辑删除
         if not self.is_deleted:
             self.is_deleted = True
         self.save()
 
-    def save(self, *args, **kwargs) -> None:
+    # 价格类型 --> 材料的价格列
+    price_fields: dict = {
+        Choices.MaterialsPriceType.original_price: 'original_price',
+        Choices.MaterialsPriceType.price: 'price',
+        Choices.MaterialsPriceType.discount_price: 'discount_price',
+    }
+
+    def snapshot_price(self, materials_obj) -> None:
         """
-         提交保存数据时,根据记账类型 计算总价格以及收益
-        :param args:
-        :param kwargs:
-        :return:
+        记录记账时的原价与价格类型对应的单价, 之后材料调价不影响本条明细
+        :param materials_obj: 对应的材料对象
+        :return: None
+        """
+        self.original_price = materials_obj.original_price
+        self.unit_price = getattr(materials_obj, self.price_fields.get(self.price_type, 'original_price'))
+
+    def compute_money(self, materials_obj=None) -> None:
+        """
+        根据记账类型 使用价格快照计算总价格以及收益
+        :param materials_obj: 对应的材料对象, 不为 None 时先记录价格快照
+        :return: None
         """
-        # 实例化材料对象
-        materials_obj = self.materials.objects.get(id=self.name[0])
+        if materials_obj is not None:
+            self.snapshot_price(materials_obj)
         match self.action:
             # 记账类型为收入
             case Choices.CashierChoice.incoming:
                 # 计算价格(售价、折扣价格)
                 # 如果使用原价作为收入类型则收益为 0
                 if self.price_type in (Choices.MaterialsPriceType.price, Choices.MaterialsPriceType.discount_price):
-                    val = F'materials_obj.{self.price_type}'
-                    self.money = self.number * eval(val)
+                    self.money = self.number * self.unit_price
                     # 计算收益
-                    #self.earnings = (self.number * eval(val)) - (self.number * materials_obj.original_price)
-                    self.earnings = (eval(val) - materials_obj.original_price) * self.number
+                    self.earnings = (self.unit_price - self.original_price) * self.number
             case Choices.CashierChoice.outgoing:
                 # 计算价格(原价)
                 if self.price_type == Choices.MaterialsPriceType.original_price:
-                    self.money = self.number * materials_obj.original_price
-            # 上述处理完毕,保存 Materials 对象
-        materials_obj.save()
-        # 上述处理完毕,保存 Cashier 对象
-        super().save(*args, **kwargs)
+                    self.money = self.number * self.original_price
 
-    def rewrite_earnings(self) -> format_html:
+    @classmethod
+    def recompute_earnings(cls, start, end, snapshot: bool = False) -> int:
+        """
+        按日期范围用一条 UPDATE 根据价格快照重算总价格与收益, 与 compute_money 的规则一致
+        :param start: 开始日期
+        :param end: 结束日期
+        :param snapshot: 先为未记录价格快照(单价与原价均为 0)的历史明细补记材料的当前价格
+        :return: 重算的行数
+        """
+        queryset = cls.all_objects.filter(create_time__date__gte=start, create_time__date__lte=end)
+        if snapshot:
+            materials = Materials.objects.filter(id=OuterRef('name'))
+            queryset.filter(unit_price=0, original_price=0).update(
+                original_price=Subquery(materials.values('original_price')[:1]),
+                unit_price=Case(
+                    *(When(price_type=price_type, then=Subquery(materials.values(field)[:1]))
+                      for price_type, field in cls.price_fields.items()),
+                    default=Subquery(materials.values('original_price')[:1]),
+                ),
+            )
+        is_sale = Q(action=Choices.CashierChoice.incoming,
+                    price_type__in=(Choices.MaterialsPriceType.price, Choices.MaterialsPriceType.discount_price))
+        is_purchase = Q(action=Choices.CashierChoice.outgoing, price_type=Choices.MaterialsPriceType.original_price)
+        return queryset.filter(is_sale | is_purchase).update(
+            money=Case(When(is_sale, then=F('number') * F('unit_price')),
+                       default=F('number') * F('original_price')),
+            earnings=Case(When(is_sale, then=(F('unit_price') - F('original_price')) * F('number')),
+                          default=F('earnings')),
+        )
+
+    @classmethod
+    def bulk_book(cls, lines: list[dict], user=None) -> list:
+        """
+        批量记账: 一次查询获取全部材料并加锁, bulk_create 出纳明细, 每个材料只执行一次数量 UPDATE
+        :param lines: [{'name': 材料id, 'action': 记账类型, 'price_type': 价格类型, 'number': 数量, 'remarks': 备注}]
+        :param user: 创建用户
+        :return: 新增的出纳明细对象列表
+        """
+        errors: list = list()
+        material_ids: set = set()
+        for index, line in enumerate(lines):
+            try:
+                # JSON 的 true/false 是 int 的子类, 不作为材料id
+                if isinstance(line['name'], bool):
+                    raise TypeError(line['name'])
+                material_ids.add(int(line['name']))
+            except (KeyError, TypeError, ValueError):
+                errors.append(F'第{index + 1}行: 物品名称有误')
+        if errors:
+            raise ValidationError(errors)
+        with transaction.atomic():
+            materials_map: dict = Materials.objects.select_for_update().order_by('id').in_bulk(material_ids)
+            objs: list = list()
+            for index, line in enumerate(lines):
+                obj = cls(name_id=int(line['name']), action=line.get('action'), price_type=line.get('price_type'),
+                          number=line.get('number', 0), remarks=line.get('remarks'), create_by_user=user)
+                if obj.name_id not in materials_map:
+                    errors.append(F'第{index + 1}行: 物品名称不存在')
+                elif obj.action not in Choices.CashierChoice.values:
+                    errors.append(F'第{index + 1}行: 记账类型有误')
+                elif obj.price_type not in Choices.MaterialsPriceType.values:
+                    errors.append(F'第{index + 1}行: 价格类型有误')
+                elif obj.action == Choices.CashierChoice.outgoing and \
+                        obj.price_type != Choices.MaterialsPriceType.original_price:
+                    errors.append(F'第{index + 1}行: 记账类型为支出请选择:原价')
+                elif type(obj.number) is not int or obj.number <= 0:
+                    errors.append(F'第{index + 1}行: 数量有误')
+                else:
+                    obj.compute_money(materials_map[obj.name_id])
+                    objs.append(obj)
+            if errors:
+                raise ValidationError(errors)
+            cls.objects.bulk_create(objs, batch_size=500)
+            # 按材料汇总数量变动, 每个材料一次 UPDATE
+            stock_deltas: dict = dict()
+            for obj in objs:
+                stock_deltas[obj.name_id] = stock_deltas.get(obj.name_id, 0) + obj.get_stock_delta()
+            for material_id, stock_delta in stock_deltas.items():
+                if stock_delta:
+                    materials_map[material_id].adjust_number(stock_delta, create_by_user_id=user.id if user else None)
+            CashierDailySummary.record([(None, obj) for obj in objs])
+            ChangeListDateIndex.record(cls, [(None, ChangeListDateIndex.get_state(obj)) for obj in objs])
+        count_cache.invalidate(cls)
+        return objs
+
+    # 记账类型 --> (材料数量变动的方向, 调整数量的价格类型), get_stock_delta 与 stock_delta_expression 共用
+    stock_rules: dict = {
+        Choices.CashierChoice.incoming: (-1, (Choices.MaterialsPriceType.price, Choices.MaterialsPriceType.discount_price)),
+        Choices.CashierChoice.outgoing: (1, (Choices.MaterialsPriceType.original_price,)),
+    }
+
+    def get_stock_delta(self) -> int:
+        """
+        本条明细对材料数量的贡献: 收入(售价、折扣价) 材料数 -= 数量, 支出(原价) 材料数 += 数量, 其他为 0
+        :return: 材料数量变动值
+        """
+        sign, price_types = self.stock_rules.get(self.action, (0, ()))
+        return sign * self.number if self.price_type in price_types else 0
+
+    def get_stock_deltas(self, old_obj=None) -> dict:
+        """
+        保存时各材料的数量变动: 减去修改前明细的贡献, 加上修改后明细的贡献, 逻辑删除的明细不计入
+        修改物品、记账类型、价格类型以及逻辑删除时, 材料数量与出纳明细保持一致
+        :param old_obj: 修改前的明细, None 表示新增
+        :return: {材料id: 变动数量}, 不含变动为 0 的材料
+        """
+        stock_deltas: dict = dict()
+        for obj, sign in ((old_obj, -1), (self, 1)):
+            if obj is None or obj.is_deleted:
+                continue
+            stock_deltas[obj.name_id] = stock_deltas.get(obj.name_id, 0) + sign * obj.get_stock_delta()
+        return {material_id: stock_delta for material_id, stock_delta in stock_deltas.items() if stock_delta}
+
+    @classmethod
+    def stock_delta_expression(cls) -> Case:
+        """
+        :return: get_stock_delta 的 SQL 表达式, examples Cashier.objects.values('name').annotate(
+            stock=Sum(Cashier.stock_delta_expression()))
+        """
+        return Case(
+            *(When(action=action, price_type__in=price_types, then=F('number') * sign)
+              for action, (sign, price_types) in cls.stock_rules.items()),
+            default=Value(0), output_field=IntegerField()
+        )
+
+    def save(self, *args, **kwargs) -> None:
+        """
+         提交保存数据时,根据记账类型 计算总价格以及收益, 并在同一事务中调整材料数量
+         只有需要记录价格快照或调整数量时才读取材料行(加锁), 数量使用 F() 更新并写入库存流水
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        with transaction.atomic():
+            old_obj = None
+            if not self._state.adding:
+                old_obj = Cashier.all_objects.select_for_update().filter(id=self.id).first()
+            # 新增、修改了物品或价格类型、历史明细未记录价格快照时, 按材料当前价格记录快照, 否则沿用记账时的价格
+            snapshot: bool = old_obj is None or old_obj.name_id != self.name_id or \
+                old_obj.price_type != self.price_type or old_obj.unit_price == old_obj.original_price == 0
+            stock_deltas: dict = self.get_stock_deltas(old_obj)
+            material_ids: set = set(stock_deltas) | ({self.name_id} if snapshot else set())
+            materials_map: dict = dict()
+            if material_ids:
+                # 实例化材料对象(行锁), 修改物品时按 id 顺序锁定新旧两个材料
+                materials_map = Materials.objects.select_for_update().order_by('id').in_bulk(material_ids)
+            self.compute_money(materials_map[self.name_id] if snapshot else None)
+            # 上述处理完毕,保存 Cashier 对象
+            super().save(*args, **kwargs)
+            # 调整材料数量并写入库存流水
+            for material_id, stock_delta in sorted(stock_deltas.items()):
+                materials_map[material_id].adjust_number(stock_delta, cashier=self)
+            # 增量更新日汇总
+            CashierDailySummary.record([(old_obj, self)])
+
+    @staticmethod
+    def get_earnings_status_conditions() -> dict:
+        """
+        收入 原价 收益 == 0 --> 原价出售
+        收入 收益 == 0 --> 暂无收益
+        收入 收益 < 0 --> 亏本
+        收入 收益 > 0 --> 有收益
+        支出 --> 支出
+        索引 cashier_earnings_status_idx (action, earnings, price_type)
+        :return: {Choices.EarningsStatus: Q}
+        """
+        incoming = Q(action=Choices.CashierChoice.incoming)
+        original_price = Q(price_type=Choices.MaterialsPriceType.original_price)
+        return {
+            Choices.EarningsStatus.original_price: incoming & Q(earnings=0) & original_price,
+            Choices.EarningsStatus.no_earnings: incoming & Q(earnings=0) & ~original_price,
+            Choices.EarningsStatus.loss: incoming & Q(earnings__lt=0),
+            Choices.EarningsStatus.profit: incoming & Q(earnings__gt=0),
+            Choices.EarningsStatus.outgoing: Q(action=Choices.CashierChoice.outgoing),
+        }
+
+    @classmethod
+    def earnings_status_case(cls) -> Case:
+        """
+        :return: 收益状态的 Case 表达式, examples Cashier.objects.annotate(earnings_status=Cashier.earnings_status_case())
+        """
+        return cls.build_status_case(cls.get_earnings_status_conditions(), Choices.EarningsStatus.unknown)
+
+    def get_earnings_status(self) -> int:
+        """
+        优先使用 annotate 的 earnings_status, 否则按 get_earnings_status_conditions 的规则计算
+        :return: Choices.EarningsStatus
+        """
+        if hasattr(self, 'earnings_status'):
+            return self.earnings_status
         match self.action:
             case Choices.CashierChoice.incoming:
-                if self.price_type == Choices.MaterialsPriceType.original_price and self.earnings == 0:
-                    return format_html('<span style="color: green;">{}</span>', '原价出售')
-                elif self.earnings == 0:
-                    return format_html('<span style="color: green;">{}</span>', '暂无收益')
-                elif self.earnings <= 0:
-                    return format_html('<span style="color: read;">{}</span>', '亏本')
+                if self.earnings == 0:
+                    if self.price_type == Choices.MaterialsPriceType.original_price:
+                        return Choices.EarningsStatus.original_price
+                    return Choices.EarningsStatus.no_earnings
+                elif self.earnings < 0:
+                    return Choices.EarningsStatus.loss
+                return Choices.EarningsStatus.profit
             case Choices.CashierChoice.outgoing:
+                return Choices.EarningsStatus.outgoing
+        return Choices.EarningsStatus.unknown
+
+    def rewrite_earnings(self) -> format_html:
+        match self.get_earnings_status():
+            case Choices.EarningsStatus.original_price:
+                return format_html('<span style="color: green;">{}</span>', '原价出售')
+            case Choices.EarningsStatus.no_earnings:
+                return format_html('<span style="color: green;">{}</span>', '暂无收益')
+            case Choices.EarningsStatus.loss:
+                return format_html('<span style="color: red;">{}</span>', '亏本')
+            case Choices.EarningsStatus.outgoing:
                 return format_html('<span style="color: blue;">{}</span>', '<---')
-            case _:
+            case Choices.EarningsStatus.unknown:
                 return format_html('<span style="color: blue;">{}</span>', '请联系开发人员')
         return format_html('<span style="color: green;">{}</span>', self.earnings)
 
-    rewrite_earnings.admin_order_field = 'earnings'
+    rewrite_earnings.admin_order_field = 'earnings_status'
     rewrite_earnings.short_description = '收益'
 
     def __str__(self) -> str:
-        return self.name
+        return str(self.name)
 
     class Meta:
         verbose_name = '出纳明细'
         verbose_name_plural = '出纳管理'
+        indexes = [
+            # 非超级用户 changelist: filter(create_by_user=...).exclude(is_deleted=True) + date_hierarchy
+            models.Index(fields=['create_by_user', 'is_deleted', 'create_time'], name='cashier_owner_live_idx'),
+            # 超级用户 changelist: date_hierarchy
+            models.Index(fields=['create_time'], name='cashier_create_time_idx'),
+            # 收益状态过滤: action 等值 + earnings 范围/等值 + price_type
+            models.Index(fields=['action', 'earnings', 'price_type'], name='cashier_earnings_status_idx'),
+            # 库存核对: 检查点之后修改过的历史明细 update_time 范围 + create_time
+            models.Index(fields=['update_time', 'create_time'], name='cashier_update_time_idx'),
+        ]
 
 
 class EventType(models.Model, ToolsBox):
@@ -280,24 +794,462 @@ class EventType(models.Model, ToolsBox):
 
 class ExtraProject(models.Model, ToolsBox):
     id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
-    action = models.CharField(choices=EventType.get_values(value='name'), default='', max_length=30,
-                              verbose_name="事件类型")
+    action = LazyChoiceCharField(choices=LazyChoices(EventType, value='name'), default='', max_length=30,
+                                 verbose_name="事件类型")
     number = models.IntegerField(default=0, verbose_name='次数')
     money = models.IntegerField(default=0, verbose_name='总金额')
     remarks = models.CharField(max_length=100, blank=True, null=True, verbose_name='备注', help_text='100字以内的备注内容')
-    create_by_user = models.IntegerField(default='0', verbose_name='创建用户')
+    create_by_user = models.ForeignKey(User, on_delete=models.PROTECT, db_column='create_by_user', db_index=False,
+                                       null=True, blank=True, related_name='+', verbose_name='创建用户')
     is_deleted = models.BooleanField(default=False, verbose_name='逻辑删除')
-    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    create_time = CreateTimeField(auto_now_add=True, verbose_name='创建时间')
     update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
     def delete(self, using=None, keep_parents=False):
         # 逻辑删除
         self.is_deleted = True
         self.save()
 
+    def save(self, *args, **kwargs) -> None:
+        """
+        保存时在同一事务中增量更新日汇总
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        with transaction.atomic():
+            old_obj = None
+            if not self._state.adding:
+                old_obj = ExtraProject.all_objects.select_for_update().filter(id=self.id).first()
+            super().save(*args, **kwargs)
+            ExtraProjectDailySummary.record([(old_obj, self)])
+
     class Meta:
         verbose_name = '散项明细'
         verbose_name_plural = '散项管理'
+        indexes = [
+            # 非超级用户 changelist: filter(create_by_user=...).exclude(is_deleted=True) + date_hierarchy
+            models.Index(fields=['create_by_user', 'is_deleted', 'create_time'], name='extraproject_owner_live_idx'),
+            # 超级用户 changelist: date_hierarchy
+            models.Index(fields=['create_time'], name='extraproject_create_time_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.action
+
+
+class StockMovement(models.Model, ToolsBox):
+    """
+    库存流水, 只追加不修改
+    """
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    materials = models.ForeignKey(Materials, on_delete=models.PROTECT, verbose_name='材料')
+    cashier = models.ForeignKey(Cashier, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='出纳明细')
+    number = models.IntegerField(default=0, verbose_name='变动数量', help_text='入库为正 出库为负')
+    balance = models.IntegerField(default=0, verbose_name='结存数量')
+    create_by_user = models.ForeignKey(User, on_delete=models.PROTECT, db_column='create_by_user', null=True,
+                                       blank=True, related_name='+', verbose_name='创建用户')
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    def __str__(self) -> str:
+        return str(self.materials_id) + ':' + str(self.number)
+
+    class Meta:
+        verbose_name = '库存流水'
+        verbose_name_plural = '库存流水'
+
+
+class StockCheckpoint(models.Model):
+    """
+    库存核对的检查点, 每个材料一行, 由 reconcile_stock 写入
+    材料数量 = opening + closed + cutoff 之后未删除的出纳明细的数量合计
+    checked_time 之后没有新增或修改 cutoff 之前的明细时, 下次核对只扫描 cutoff 之后的明细
+    """
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    materials = models.OneToOneField(Materials, on_delete=models.CASCADE, verbose_name='材料')
+    opening = models.IntegerField(default=0, verbose_name='期初数量', help_text='已删除的历史分区中出纳明细的数量合计')
+    closed = models.IntegerField(default=0, verbose_name='结转数量', help_text='cutoff 之前未删除的出纳明细的数量合计')
+    cutoff = models.DateTimeField(blank=True, null=True, verbose_name='结转截止时间', help_text='为空时下次核对扫描全部明细')
+    checked_time = models.DateTimeField(blank=True, null=True, verbose_name='核对时间')
+
+    def __str__(self) -> str:
+        return str(self.materials_id) + ':' + str(self.opening + self.closed)
+
+    class Meta:
+        verbose_name = '库存检查点'
+        verbose_name_plural = '库存检查点'
+
+
+class CounterRow(models.Model):
+    """
+    按键累加的计数行基类
+    """
+
+    @classmethod
+    def apply(cls, key: dict, delta: dict) -> None:
+        """
+        使用 F() 累加汇总行, 不存在时新增
+        :param key: 汇总行的键
+        :param delta: 求和列的增量
+        :return: None
+        """
+        updates: dict = {field: F(field) + value for field, value in delta.items()}
+        if cls.objects.filter(**key).update(**updates):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(**key, **delta)
+        except IntegrityError:
+            # 并发新增了同一汇总行
+            cls.objects.filter(**key).update(**updates)
+
+    class Meta:
+        abstract = True
+
+
+class DailySummary(CounterRow):
+    """
+    日汇总基类
+    source_fields: 汇总列 --> 明细列, sum_fields: 求和列
+    明细保存、逻辑删除时调用 record 增量更新, rebuild 按日期范围重建
+    """
+    source_fields: dict = dict()
+    sum_fields: tuple = ('number', 'money')
+
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    day = models.DateField(verbose_name='日期')
+    count = models.IntegerField(default=0, verbose_name='笔数')
+    number = models.IntegerField(default=0, verbose_name='数量')
+    money = models.IntegerField(default=0, verbose_name='总金额')
+
+    @classmethod
+    def get_source_queryset(cls):
+        raise NotImplementedError
+
+    @classmethod
+    def record(cls, pairs: list[tuple]) -> None:
+        """
+        增量更新汇总, 旧对象的贡献减去 新对象的贡献加上, 逻辑删除的对象不计入
+        :param pairs: [(旧对象 or None, 新对象)]
+        :return: None
+        """
+        deltas: dict = dict()
+        for old_obj, new_obj in pairs:
+            for obj, sign in ((old_obj, -1), (new_obj, 1)):
+                if obj is None or obj.is_deleted:
+                    continue
+                key: tuple = (('day', timezone.localdate(obj.create_time)),) + tuple(
+                    (field, getattr(obj, attr)) for field, attr in cls.source_fields.items())
+                delta: dict = deltas.setdefault(key, dict.fromkeys(('count',) + cls.sum_fields, 0))
+                delta['count'] += sign
+                for field in cls.sum_fields:
+                    delta[field] += sign * getattr(obj, field)
+        for key, delta in deltas.items():
+            if any(delta.values()):
+                cls.apply(dict(key), delta)
+
+    @classmethod
+    def rebuild(cls, start, end) -> int:
+        """
+        按日期范围用一次分组聚合重建汇总
+        :param start: 开始日期
+        :param end: 结束日期
+        :return: 汇总行数
+        """
+        rows = cls.get_source_queryset().filter(
+            is_deleted=False, create_time__date__gte=start, create_time__date__lte=end
+        ).annotate(summary_day=TruncDate('create_time')).values('summary_day', *cls.source_fields.values()).annotate(
+            summary_count=Count('id'), **{F'summary_{field}': Sum(field) for field in cls.sum_fields}
+        ).order_by()
+        objs: list = [
+            cls(day=row['summary_day'], count=row['summary_count'],
+                **{field: row[attr] for field, attr in cls.source_fields.items()},
+                **{field: row[F'summary_{field}'] for field in cls.sum_fields})
+            for row in rows
+        ]
+        with transaction.atomic():
+            cls.objects.filter(day__gte=start, day__lte=end).delete()
+            cls.objects.bulk_create(objs, batch_size=500)
+        return len(objs)
+
+    @classmethod
+    def report(cls, start, end, period: str = 'day', **filters) -> list[dict]:
+        """
+        按 日/周/月 统计, 只扫描汇总表
+        :param start: 开始日期
+        :param end: 结束日期
+        :param period: day week month
+        :param filters: 汇总表过滤条件
+        :return: [{'period': 日期, 'total_count': 笔数, 'total_money': 总金额, ...}]
+        """
+        trunc = {'day': F('day'), 'week': TruncWeek('day'), 'month': TruncMonth('day')}[period]
+        return list(
+            cls.objects.filter(day__gte=start, day__lte=end, **filters).annotate(period=trunc).values('period').annotate(
+                total_count=Sum('count'), **{F'total_{field}': Sum(field) for field in cls.sum_fields}
+            ).order_by('period')
+        )
+
+    class Meta:
+        abstract = True
+
+
+class CashierDailySummary(DailySummary):
+    source_fields: dict = {'materials_id': 'name_id', 'action': 'action', 'create_by_user_id': 'create_by_user_id'}
+    sum_fields: tuple = ('number', 'money', 'earnings')
+
+    materials = models.ForeignKey(Materials, on_delete=models.PROTECT, verbose_name='物品名称')
+    action = models.CharField(choices=Choices.CashierChoice.choices, max_length=10, verbose_name="记账类型")
+    create_by_user = models.ForeignKey(User, on_delete=models.PROTECT, db_column='create_by_user', null=True,
+                                       blank=True, related_name='+', verbose_name='创建用户')
+    earnings = models.IntegerField(default=0, verbose_name='收益')
+
+    @classmethod
+    def get_source_queryset(cls):
+        return Cashier.objects.all()
+
+    class Meta:
+        verbose_name = '出纳日汇总'
+        verbose_name_plural = '出纳日汇总'
+        constraints = [
+            # 唯一索引中 NULL 互不相等, 创建用户为空时以 0 代替, 并发新增同一汇总行时 apply 才能捕获 IntegrityError
+            models.UniqueConstraint(F('day'), F('materials'), F('action'),
+                                    Coalesce('create_by_user', Value(0), output_field=IntegerField()),
+                                    name='cashier_daily_summary_uniq'),
+        ]
+
+
+class ExtraProjectDailySummary(DailySummary):
+    source_fields: dict = {'action': 'action'}
+
+    action = models.CharField(max_length=30, verbose_name="事件类型")
+
+    @classmethod
+    def get_source_queryset(cls):
+        return ExtraProject.objects.all()
+
+    class Meta:
+        verbose_name = '散项日汇总'
+        verbose_name_plural = '散项日汇总'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'action'], name='extraproject_daily_summary_uniq'),
+        ]
+
+
+class ChangeListDateIndex(CounterRow):
+    """
+    changelist date_hierarchy 的按日索引, 每个模型每天每个创建用户一行
+    count 包含逻辑删除的行(超级用户可见), live_count 只计未逻辑删除的行(创建用户可见)
+    明细保存时由信号增量更新, 批量写入与归档时显式调用 record, rebuild 按日期范围重建
+    """
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    model = models.CharField(max_length=50, verbose_name='模型')
+    day = models.DateField(verbose_name='日期')
+    create_by_user = models.ForeignKey(User, on_delete=models.PROTECT, db_column='create_by_user', null=True,
+                                       blank=True, related_name='+', verbose_name='创建用户')
+    count = models.IntegerField(default=0, verbose_name='行数')
+    live_count = models.IntegerField(default=0, verbose_name='未删除行数')
+
+    @staticmethod
+    def get_state(obj) -> tuple:
+        """
+        :param obj: Users Cashier ExtraProject 对象或 values() 的行
+        :return: (日期, 创建用户id, 是否逻辑删除)
+        """
+        row: dict = obj if isinstance(obj, dict) else obj.__dict__
+        return timezone.localdate(row['create_time']), row['create_by_user_id'], row['is_deleted']
+
+    @classmethod
+    def record(cls, model, pairs: list[tuple]) -> None:
+        """
+        增量更新索引, 旧状态的贡献减去 新状态的贡献加上
+        :param model: Users Cashier ExtraProject
+        :param pairs: [(旧状态 or None, 新状态 or None)], 状态由 get_state 获取, 新增时旧状态为 None, 删除时新状态为 None
+        :return: None
+        """
+        deltas: dict = dict()
+        for old_state, new_state in pairs:
+            for state, sign in ((old_state, -1), (new_state, 1)):
+                if state is None:
+                    continue
+                day, create_by_user_id, is_deleted = state
+                delta: dict = deltas.setdefault((day, create_by_user_id), {'count': 0, 'live_count': 0})
+                delta['count'] += sign
+                if not is_deleted:
+                    delta['live_count'] += sign
+        for (day, create_by_user_id), delta in deltas.items():
+            if any(delta.values()):
+                cls.apply({'model': model._meta.label_lower, 'day': day, 'create_by_user_id': create_by_user_id}, delta)
+
+    @classmethod
+    def rebuild(cls, model, start, end) -> int:
+        """
+        按日期范围用一次分组聚合重建模型的索引
+        :param model: Users Cashier ExtraProject
+        :param start: 开始日期
+        :param end: 结束日期
+        :return: 索引行数
+        """
+        label: str = model._meta.label_lower
+        rows = model.all_objects.filter(create_time__date__gte=start, create_time__date__lte=end).annotate(
+            index_day=TruncDate('create_time')).values('index_day', 'create_by_user_id').annotate(
+            index_count=Count('id'), index_live_count=Count('id', filter=Q(is_deleted=False))
+        ).order_by()
+        objs: list = [
+            cls(model=label, day=row['index_day'], create_by_user_id=row['create_by_user_id'],
+                count=row['index_count'], live_count=row['index_live_count'])
+            for row in rows
+        ]
+        with transaction.atomic():
+            cls.objects.filter(model=label, day__gte=start, day__lte=end).delete()
+            cls.objects.bulk_create(objs, batch_size=500)
+        return len(objs)
+
+    @classmethod
+    def get_queryset_for(cls, model, user):
+        """
+        与 CustomAdminAction.get_queryset 的可见范围一致
+        超级用户: 包含逻辑删除的行, 非超级用户: 属于自己且未逻辑删除的行
+        :param model: Users Cashier ExtraProject
+        :param user: 当前登录用户
+        :return: 有数据的日期
+        """
+        queryset = cls.objects.filter(model=model._meta.label_lower)
+        if user.is_superuser:
+            return queryset.filter(count__gt=0)
+        return queryset.filter(create_by_user=user.id, live_count__gt=0)
+
+    def __str__(self) -> str:
+        return self.model + ':' + str(self.day)
+
+    class Meta:
+        verbose_name = '按日索引'
+        verbose_name_plural = '按日索引'
+        constraints = [
+            # 同 CashierDailySummary, 创建用户为空时以 0 代替
+            models.UniqueConstraint(F('model'), F('day'),
+                                    Coalesce('create_by_user', Value(0), output_field=IntegerField()),
+                                    name='changelist_date_index_uniq'),
+        ]
+
+
+class ArchivedRecord(models.Model):
+    """
+    逻辑删除超过保留天数后归档的明细, 由 archive_deleted 命令写入
+    """
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    model = models.CharField(max_length=50, verbose_name='模型')
+    object_id = models.BigIntegerField(verbose_name='原ID')
+    data = models.JSONField(encoder=DjangoJSONEncoder, verbose_name='数据')
+    delete_time = models.DateTimeField(verbose_name='删除时间')
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name='归档时间')
+
+    @classmethod
+    def archive(cls, model, cutoff, batch_size: int = 1000) -> int:
+        """
+        分批归档 cutoff 之前逻辑删除的行, 每批一个短事务
+        :param model: Users Cashier ExtraProject
+        :param cutoff: 逻辑删除时间(update_time)早于该时间的行
+        :param batch_size: 每批行数
+        :return: 归档行数
+        """
+        archived: int = 0
+        label: str = model._meta.label_lower
+        while True:
+            with transaction.atomic():
+                rows: list = list(
+                    model.all_objects.select_for_update().filter(is_deleted=True, update_time__lt=cutoff).order_by(
+                        'id').values()[:batch_size]
+                )
+                if not rows:
+                    break
+                cls.objects.bulk_create([
+                    cls(model=label, object_id=row['id'], data=row, delete_time=row['update_time']) for row in rows
+                ])
+                model.all_objects.filter(id__in=[row['id'] for row in rows]).delete()
+                ChangeListDateIndex.record(model, [(ChangeListDateIndex.get_state(row), None) for row in rows])
+            count_cache.invalidate(model)
+            archived += len(rows)
+        return archived
+
+    def __str__(self) -> str:
+        return self.model + ':' + str(self.object_id)
+
+    class Meta:
+        verbose_name = '归档明细'
+        verbose_name_plural = '归档明细'
+        indexes = [
+            models.Index(fields=['model', 'object_id'], name='archivedrecord_object_idx'),
+        ]
+
+
+class LowStockNotification(models.Model):
+    """
+    补货提醒发件箱, 材料数量降到 reorder_threshold 以下时写入, sent_time 为空表示未发送
+    """
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    materials = models.ForeignKey(Materials, on_delete=models.CASCADE, verbose_name='材料')
+    number = models.IntegerField(default=0, verbose_name='数量')
+    reorder_threshold = models.IntegerField(default=0, verbose_name='补货提醒数量')
+    sent_time = models.DateTimeField(blank=True, null=True, verbose_name='发送时间')
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    def __str__(self) -> str:
+        return str(self.materials_id) + ':' + str(self.number)
+
+    class Meta:
+        verbose_name = '补货提醒'
+        verbose_name_plural = '补货提醒'
+        indexes = [
+            models.Index(fields=['sent_time', 'id'], name='lowstock_outbox_idx'),
+        ]
+
+
+class PosJournal(models.Model):
+    """
+    本地收银队列, 保存在收银终端的 SQLite(settings.DATABASES['pos_journal']), 由 sync_pos 按 create_time 顺序批量同步到主库
+    payload 为出纳明细的列与记账时的价格快照, 修改时另有 base_update_time(修改前主库的更新时间)
+    """
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    idempotency_key = models.CharField(max_length=32, unique=True, verbose_name='幂等键')
+    terminal = models.CharField(max_length=50, verbose_name='终端')
+    operation = models.CharField(max_length=10, choices=Choices.PosOperation.choices, verbose_name='操作')
+    object_id = models.BigIntegerField(blank=True, null=True, verbose_name='出纳明细ID', help_text='修改的明细, 新增同步后为新明细')
+    payload = models.JSONField(encoder=DjangoJSONEncoder, verbose_name='内容')
+    create_by_user = models.IntegerField(blank=True, null=True, verbose_name='创建用户ID')
+    status = models.CharField(max_length=10, choices=Choices.PosStatus.choices, default=Choices.PosStatus.pending,
+                              verbose_name='同步状态')
+    message = models.CharField(max_length=200, blank=True, null=True, verbose_name='冲突原因')
+    create_time = models.DateTimeField(verbose_name='记账时间')
+    synced_time = models.DateTimeField(blank=True, null=True, verbose_name='同步时间')
+
+    def __str__(self) -> str:
+        return self.terminal + ':' + self.idempotency_key
+
+    class Meta:
+        verbose_name = '本地收银队列'
+        verbose_name_plural = '本地收银队列'
+        indexes = [
+            models.Index(fields=['status', 'create_time'], name='posjournal_pending_idx'),
+        ]
+
+
+class PosSyncReceipt(models.Model):
+    """
+    主库的本地收银队列同步回执, 与出纳明细在同一事务中写入
+    同步后未能更新终端队列状态时, 重试按幂等键跳过已同步的记录, 不重复记账与调整数量
+    """
+    id = models.BigAutoField(primary_key=True, verbose_name='ID', help_text='自动增长')
+    idempotency_key = models.CharField(max_length=32, unique=True, verbose_name='幂等键')
+    terminal = models.CharField(max_length=50, verbose_name='终端')
+    object_id = models.BigIntegerField(verbose_name='出纳明细ID')
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name='同步时间')
+
+    def __str__(self) -> str:
+        return self.terminal + ':' + self.idempotency_key
+
+    class Meta:
+        verbose_name = '同步回执'
+        verbose_name_plural = '同步回执'
@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """
+    KeysetPaginator 的一页
+    """
+
+    def __init__(self, object_list: list, next_cursor: str = None, previous_cursor: str = None):
+        self.object_list: list = object_list
+        self.next_cursor: str = next_cursor
+        self.previous_cursor: str = previous_cursor
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    按排序列定位(seek)的分页: WHERE (排序列) 在上一页最后一行之后 LIMIT per_page
+    不执行 COUNT(*) 与 OFFSET, 任意深度的页与第一页成本相同, 只能上一页/下一页
+    排序列需要是本模型非空的列, 并以主键结尾保证顺序唯一
+    """
+
+    def __init__(self, queryset, per_page: int, ordering: list[str]):
+        """
+        :param queryset: 已按 ordering 排序的 queryset
+        :param per_page: 每页行数
+        :param ordering: 排序列, examples ['-create_time', '-pk']
+        """
+        self.queryset = queryset
+        self.per_page: int = per_page
+        self.ordering: list = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.fields: list = [queryset.model._meta.pk if name == 'pk' else queryset.model._meta.get_field(name)
+                             for name, descending in self.ordering]
+
+    @classmethod
+    def get_keyset_ordering(cls, model, ordering) -> list[str] | None:
+        """
+        :param model: 模型类
+        :param ordering: queryset 的排序, 可能含重复的列, examples ['-create_time', '-create_time', '-pk', '-id']
+        :return: 去重并截止到主键的排序列, 有不是本模型非空的列或不以主键结尾时为 None
+        """
+        keyset_ordering: list = list()
+        names: set = set()
+        for name in ordering:
+            if not isinstance(name, str):
+                return None
+            field_name: str = name.lstrip('-')
+            if field_name in ('pk', model._meta.pk.name):
+                keyset_ordering.append(name[:-len(field_name)] + 'pk')
+                return keyset_ordering
+            if field_name in names:
+                continue
+            try:
+                field = model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.null or field.is_relation:
+                return None
+            names.add(field_name)
+            keyset_ordering.append(name)
+        return None
+
+    def encode_cursor(self, obj, direction: str) -> str:
+        # value_to_string 保留时间的微秒, 定位条件中的等值比较才能命中
+        values: list = [field.value_to_string(obj) for field in self.fields]
+        data: str = json.dumps({'d': direction, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str) -> tuple[str, list]:
+        try:
+            data: dict = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            direction, values = data['d'], data['v']
+            if direction not in ('next', 'previous') or len(values) != len(self.fields):
+                raise ValueError(cursor)
+            return direction, [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (binascii.Error, ValueError, KeyError, TypeError, ValidationError) as error:
+            raise ValueError(F'无效的分页游标: {cursor}') from error
+
+    def get_seek_filter(self, values: list, reverse: bool) -> Q:
+        """
+        (a, b, pk) 在 (x, y, z) 之后: a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z), 降序列使用 <
+        :param values: 定位行的排序列的值
+        :param reverse: 向前翻页
+        :return: Q
+        """
+        condition = Q()
+        equals: dict = dict()
+        for (name, descending), value in zip(self.ordering, values):
+            lookup: str = 'lt' if descending != reverse else 'gt'
+            condition |= Q(**equals, **{F'{name}__{lookup}': value})
+            equals[name] = value
+        return condition
+
+    def page(self, cursor: str = None) -> KeysetPage:
+        """
+        :param cursor: 上一次返回的 next_cursor 或 previous_cursor, None 为第一页
+        :return: KeysetPage
+        :raise ValueError: 游标无效
+        """
+        if cursor is None:
+            direction, queryset = 'next', self.queryset
+        else:
+            direction, values = self.decode_cursor(cursor)
+            queryset = self.queryset.filter(self.get_seek_filter(values, reverse=direction == 'previous'))
+        if direction == 'previous':
+            queryset = queryset.reverse()
+        object_list: list = list(queryset[:self.per_page + 1])
+        has_more: bool = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if direction == 'previous':
+            object_list.reverse()
+        has_next: bool = has_more if direction == 'next' else True
+        has_previous: bool = cursor is not None if direction == 'next' else has_more
+        if not object_list:
+            return KeysetPage(object_list)
+        return KeysetPage(
+            object_list,
+            next_cursor=self.encode_cursor(object_list[-1], 'next') if has_next else None,
+            previous_cursor=self.encode_cursor(object_list[0], 'previous') if has_previous else None,
+        )
@@ -0,0 +1,182 @@
+import datetime
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Cashier, ExtraProject, StockMovement, ChangeListDateIndex
+from .registry import count_cache
+from .stock import StockReconciler
+
+# 按月分区的明细表, 分区列 create_time
+PARTITIONED_MODELS: tuple = (Cashier, ExtraProject)
+FUTURE_PARTITION: str = 'p_future'
+
+
+class MonthlyPartitioner:
+    """
+    MySQL 按月 RANGE COLUMNS(create_time) 分区, 分区名 pYYYYMM(本地时间的月份), 最后一个分区 p_future 存放之后的行
+    MySQL 分区表不支持外键, 且主键需要包含分区列: 转换时删除该表与引用该表的外键, 主键改为 (id, create_time)
+    删除外键后由 Django 的 on_delete 保证关联, 删除分区后由 drop 清理库存流水的出纳明细引用
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.table: str = model._meta.db_table
+        # 被删除分区中出纳明细的材料数量合计, before_drop 计算, after_drop 转入库存检查点
+        self.dropped_stock: dict = dict()
+
+    @staticmethod
+    def month_start(day) -> datetime.date:
+        return datetime.date(day.year, day.month, 1)
+
+    @staticmethod
+    def next_month(month: datetime.date) -> datetime.date:
+        return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+    @staticmethod
+    def partition_name(month: datetime.date) -> str:
+        return F'p{month:%Y%m}'
+
+    @staticmethod
+    def boundary(month: datetime.date) -> str:
+        """
+        :param month: 本地时间的月份第一天
+        :return: 数据库中该月份开始的时间, USE_TZ 时为 UTC, examples '2026-09-30 16:00:00'
+        """
+        value = datetime.datetime.combine(month, datetime.time())
+        if settings.USE_TZ:
+            value = timezone.make_aware(value).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+
+    def get_partitions(self) -> list[tuple[str, int]]:
+        """
+        :return: 按顺序的 [(分区名, 估算行数)], 未分区时为空列表
+        """
+        if connection.vendor != 'mysql':
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL '
+                'ORDER BY PARTITION_ORDINAL_POSITION', [self.table])
+            return [(name, rows or 0) for name, rows in cursor.fetchall()]
+
+    def get_months(self, partitions: list) -> list[datetime.date]:
+        months: list = list()
+        for name, rows in partitions:
+            matched = re.fullmatch(r'p(\d{4})(\d{2})', name)
+            if matched:
+                months.append(datetime.date(int(matched[1]), int(matched[2]), 1))
+        return months
+
+    def get_foreign_keys(self) -> list[tuple[str, str]]:
+        """
+        :return: 本表与引用本表的外键 [(表名, 外键名)]
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT TABLE_NAME, CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS '
+                'WHERE CONSTRAINT_SCHEMA = DATABASE() AND (TABLE_NAME = %s OR REFERENCED_TABLE_NAME = %s) '
+                'ORDER BY TABLE_NAME, CONSTRAINT_NAME', [self.table, self.table])
+            return list(cursor.fetchall())
+
+    def get_partition_clause(self, months: list) -> str:
+        clauses: list = [F"PARTITION `{self.partition_name(month)}` VALUES LESS THAN "
+                         F"('{self.boundary(self.next_month(month))}')" for month in months]
+        clauses.append(F'PARTITION `{FUTURE_PARTITION}` VALUES LESS THAN (MAXVALUE)')
+        return ',\n  '.join(clauses)
+
+    def convert_sql(self, until: datetime.date) -> list[str]:
+        """
+        未分区的表转换为按月分区, 从最早的明细月份到 until 每月一个分区
+        :param until: 预建分区到该月份(包含)
+        :return: SQL 列表
+        """
+        first_time = self.model._base_manager.order_by('create_time').values_list('create_time', flat=True).first()
+        month: datetime.date = self.month_start(timezone.localdate(first_time) if first_time else until)
+        months: list = list()
+        while month <= until:
+            months.append(month)
+            month = self.next_month(month)
+        statements: list = list()
+        foreign_keys: dict = dict()
+        for table, name in (self.get_foreign_keys() if connection.vendor == 'mysql' else []):
+            foreign_keys.setdefault(table, []).append(name)
+        for table, names in foreign_keys.items():
+            statements.append(F'ALTER TABLE `{table}` ' + ', '.join(F'DROP FOREIGN KEY `{name}`' for name in names))
+        statements.append(F'ALTER TABLE `{self.table}` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `create_time`)')
+        statements.append(F'ALTER TABLE `{self.table}` PARTITION BY RANGE COLUMNS(`create_time`) (\n  '
+                          F'{self.get_partition_clause(months)}\n)')
+        return statements
+
+    def extend_sql(self, partitions: list, until: datetime.date) -> list[str]:
+        """
+        从 p_future 拆分出 until 之前缺少的月份分区, p_future 为空时只修改元数据
+        :param partitions: get_partitions 的结果
+        :param until: 预建分区到该月份(包含)
+        :return: SQL 列表
+        """
+        months: list = self.get_months(partitions)
+        month: datetime.date = self.next_month(months[-1]) if months else self.month_start(timezone.localdate())
+        new_months: list = list()
+        while month <= until:
+            new_months.append(month)
+            month = self.next_month(month)
+        if not new_months:
+            return []
+        return [F'ALTER TABLE `{self.table}` REORGANIZE PARTITION `{FUTURE_PARTITION}` INTO (\n  '
+                F'{self.get_partition_clause(new_months)}\n)']
+
+    def drop_sql(self, partitions: list, before: datetime.date, exchange: bool = False) -> list[str]:
+        """
+        删除 before 之前月份的分区, 只修改元数据, 不逐行删除
+        :param partitions: get_partitions 的结果
+        :param before: 删除该月份之前的分区
+        :param exchange: 删除前将分区交换到单独的表 {表名}_pYYYYMM, 可以 mysqldump 导出后再删除该表
+        :return: SQL 列表
+        """
+        statements: list = list()
+        for month in self.get_months(partitions):
+            if month >= before:
+                continue
+            name: str = self.partition_name(month)
+            if exchange:
+                archive_table: str = F'{self.table}_{name}'
+                statements.append(F'CREATE TABLE `{archive_table}` LIKE `{self.table}`')
+                statements.append(F'ALTER TABLE `{archive_table}` REMOVE PARTITIONING')
+                statements.append(F'ALTER TABLE `{self.table}` EXCHANGE PARTITION `{name}` WITH TABLE `{archive_table}`')
+            statements.append(F'ALTER TABLE `{self.table}` DROP PARTITION `{name}`')
+        return statements
+
+    def before_drop(self, last_day: datetime.date) -> None:
+        """
+        删除分区前: 计算将被删除的出纳明细的材料数量合计, 删除后材料数量仍可按出纳明细核对
+        :param last_day: 被删除的最后一天
+        :return: None
+        """
+        if self.model is Cashier:
+            end = timezone.make_aware(datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time()))
+            self.dropped_stock = StockReconciler.get_dropped_totals(end)
+
+    def after_drop(self, first_day: datetime.date, last_day: datetime.date) -> None:
+        """
+        删除分区后: 清理库存流水中已不存在的出纳明细引用, 被删除明细的材料数量转入库存检查点的期初数量,
+        重建被删除日期范围的按日索引, 日汇总保留
+        :param first_day: 被删除的第一天
+        :param last_day: 被删除的最后一天
+        :return: None
+        """
+        if self.model is Cashier:
+            StockMovement.objects.filter(cashier__isnull=False).exclude(
+                cashier_id__in=Cashier.all_objects.values('id')).update(cashier=None)
+            StockReconciler.fold_dropped(self.dropped_stock)
+        ChangeListDateIndex.rebuild(self.model, first_day, last_day)
+        count_cache.invalidate(self.model)
+
+    @staticmethod
+    def execute(statements: list) -> None:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
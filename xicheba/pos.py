@@ -0,0 +1,300 @@
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Cashier, Materials, Choices, PosJournal, PosSyncReceipt, CashierDailySummary, ChangeListDateIndex
+from .registry import count_cache
+from .routers import POS_JOURNAL_DB_ALIAS
+
+# 出纳明细在队列中保存的列, 新增时另有记账时的价格快照
+UPDATE_FIELDS: tuple = ('name_id', 'action', 'price_type', 'number', 'remarks')
+PAYLOAD_FIELDS: tuple = UPDATE_FIELDS + ('unit_price', 'original_price')
+# 终端本机缓存: 登录用户(含权限)与材料, 新增出纳明细的请求不访问主库
+POS_CACHE_ALIAS: str = 'pos'
+CACHE_KEY_PREFIX: str = 'xicheba:pos'
+_journal_ready: bool = False
+
+
+def is_enabled() -> bool:
+    """
+    :return: 是否配置了本地收银队列 settings.DATABASES['pos_journal']
+    """
+    return POS_JOURNAL_DB_ALIAS in settings.DATABASES
+
+
+def ensure_journal() -> None:
+    """
+    终端的队列数据库中没有队列表时建表, 不依赖迁移, 每个进程只检查一次; SQLite 建表不能在事务中执行
+    :return: None
+    """
+    global _journal_ready
+    if _journal_ready:
+        return
+    connection = connections[POS_JOURNAL_DB_ALIAS]
+    if PosJournal._meta.db_table not in connection.introspection.table_names():
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(PosJournal)
+    _journal_ready = True
+
+
+def enqueue_cashier(obj: Cashier, user, change: bool) -> PosJournal:
+    """
+    出纳明细写入本地队列, 新增的价格快照取表单中已读取的材料, 不访问主库
+    需要先在事务外调用 ensure_journal
+    :param obj: 表单保存前的出纳明细对象
+    :param user: 当前登录用户
+    :param change: True=修改, False=新增
+    :return: 队列记录
+    """
+    if change:
+        payload: dict = {field: getattr(obj, field) for field in UPDATE_FIELDS}
+        # isoformat 保留微秒, 同步时与主库的 update_time 精确比较
+        payload['base_update_time'] = obj.update_time.isoformat()
+    else:
+        obj.snapshot_price(obj.name)
+        payload = {field: getattr(obj, field) for field in PAYLOAD_FIELDS}
+    return PosJournal.objects.create(
+        idempotency_key=uuid.uuid4().hex, terminal=settings.XICHEBA_POS_TERMINAL,
+        operation=Choices.PosOperation.update if change else Choices.PosOperation.create,
+        object_id=obj.id if change else None, payload=payload, create_by_user=user.id if user else None,
+        create_time=timezone.now(),
+    )
+
+
+def get_cached(key: str, builder):
+    """
+    读取终端本机缓存, 未命中时调用 builder 从主库读取, settings.XICHEBA_POS_CACHE_TIMEOUT 秒后过期
+    :param key: 缓存键
+    :param builder: 无参数的构建函数, 返回 None 时不缓存
+    :return: builder 的返回值
+    """
+    cache = caches[POS_CACHE_ALIAS]
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        if value is not None:
+            cache.set(key, value, settings.XICHEBA_POS_CACHE_TIMEOUT)
+    return value
+
+
+def build_user(user_id):
+    """
+    :param user_id: 用户id
+    :return: 预先计算了权限的用户对象, 与权限一起缓存后 admin 的权限检查不查询主库; 不存在时返回 None
+    """
+    user = User._default_manager.filter(pk=user_id).first()
+    if user is not None:
+        ModelBackend().get_all_permissions(user)
+    return user
+
+
+def get_user(user_id):
+    return get_cached(F'{CACHE_KEY_PREFIX}:user:{user_id}', lambda: build_user(user_id))
+
+
+def get_materials() -> dict:
+    """
+    :return: 终端缓存的全部材料 {材料id: 材料对象}, 新增出纳明细的选项、校验与价格快照使用
+    """
+    return get_cached(F'{CACHE_KEY_PREFIX}:materials', lambda: Materials.objects.order_by('id').in_bulk())
+
+
+def get_materials_choices() -> list:
+    return [('', '---------')] + [(obj.id, str(obj)) for obj in get_materials().values()]
+
+
+def get_materials_obj(value) -> Materials:
+    return get_materials()[int(value)]
+
+
+def load_content_type(model) -> None:
+    """
+    admin 表单页的上下文需要模型的 ContentType, 从终端缓存放入 ContentType.objects 的进程内缓存,
+    进程重启后主库不可用时新增页面仍可打开
+    :param model: 模型
+    :return: None
+    """
+    content_type = get_cached(F'{CACHE_KEY_PREFIX}:content_type:{model._meta.label_lower}',
+                              lambda: ContentType.objects.get_for_model(model))
+    ContentType.objects._add_to_cache(ContentType.objects.db, content_type)
+
+
+def invalidate_cache(model, instance) -> None:
+    """
+    用户、材料在本进程中修改后清除终端缓存, 其他服务器上的修改在缓存过期或执行 warm_cache 后生效
+    :param model: User Materials
+    :param instance: 修改的对象
+    :return: None
+    """
+    key: str = F'{CACHE_KEY_PREFIX}:materials' if model is Materials else F'{CACHE_KEY_PREFIX}:user:{instance.pk}'
+    caches[POS_CACHE_ALIAS].delete(key)
+
+
+def warm_cache() -> tuple:
+    """
+    主库可用时重新读取材料与全部可登录后台的用户, 写入终端缓存
+    :return: (材料数, 用户数)
+    """
+    cache = caches[POS_CACHE_ALIAS]
+    materials: dict = Materials.objects.order_by('id').in_bulk()
+    cache.set(F'{CACHE_KEY_PREFIX}:materials', materials, settings.XICHEBA_POS_CACHE_TIMEOUT)
+    cache.set(F'{CACHE_KEY_PREFIX}:content_type:{Cashier._meta.label_lower}',
+              ContentType.objects.get_for_model(Cashier), settings.XICHEBA_POS_CACHE_TIMEOUT)
+    users: list = list(User._default_manager.filter(is_active=True, is_staff=True))
+    for user in users:
+        ModelBackend().get_all_permissions(user)
+        cache.set(F'{CACHE_KEY_PREFIX}:user:{user.pk}', user, settings.XICHEBA_POS_CACHE_TIMEOUT)
+    return len(materials), len(users)
+
+
+class PosCachedBackend(ModelBackend):
+    """
+    本地收银模式的认证后端: 登录时与 ModelBackend 相同, 查询主库校验密码
+    之后每个请求的用户与权限从终端缓存读取, 主库不可用时已登录的收银员仍可新增出纳明细
+    """
+
+    def get_user(self, user_id):
+        user = get_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+
+class PosSync:
+    """
+    本地收银队列同步到主库: 每批一个主库事务, 按 (create_time, id) 顺序处理
+    新增: bulk_create 出纳明细(保留记账时间与价格快照), 每个材料一次数量调整
+    修改: 主库明细在记账后被修改、逻辑删除或已不存在时以主库为准, 队列记录标记为冲突
+    同步回执与出纳明细同一事务写入, 终端队列状态在主库提交后更新, 中断后重试不会重复记账
+    """
+
+    def __init__(self, batch_size: int = 200):
+        self.batch_size: int = batch_size
+        self.synced: int = 0
+        self.conflicts: int = 0
+
+    def run(self) -> int:
+        """
+        同步全部待同步的记录
+        :return: 处理的记录数
+        """
+        ensure_journal()
+        processed: int = 0
+        while True:
+            entries: list = list(PosJournal.objects.filter(status=Choices.PosStatus.pending).order_by(
+                'create_time', 'id')[:self.batch_size])
+            if not entries:
+                return processed
+            self.sync_batch(entries)
+            processed += len(entries)
+
+    def sync_batch(self, entries: list) -> None:
+        # 幂等键 --> (状态, 出纳明细id, 冲突原因)
+        results: dict = {
+            key: (Choices.PosStatus.synced, object_id, None)
+            for key, object_id in PosSyncReceipt.objects.using(DEFAULT_DB_ALIAS).filter(
+                idempotency_key__in=[entry.idempotency_key for entry in entries]).values_list('idempotency_key', 'object_id')
+        }
+        entries = [entry for entry in entries if entry.idempotency_key not in results]
+        if entries:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                results.update(self.apply(entries))
+        self.mark(results)
+        count_cache.invalidate(Cashier)
+
+    def apply(self, entries: list) -> dict:
+        """
+        在主库事务中应用一批队列记录
+        :param entries: 未同步的队列记录
+        :return: {幂等键: (状态, 出纳明细id, 冲突原因)}
+        """
+        results: dict = dict()
+        material_ids: set = {entry.payload['name_id'] for entry in entries}
+        materials_map: dict = Materials.objects.select_for_update().order_by('id').in_bulk(material_ids)
+        creates: list = list()
+        updates: list = list()
+        for entry in entries:
+            if entry.payload['name_id'] not in materials_map:
+                results[entry.idempotency_key] = (Choices.PosStatus.conflict, entry.object_id, '物品名称不存在')
+            elif entry.operation == Choices.PosOperation.create:
+                creates.append((entry, self.build_cashier(entry)))
+            else:
+                updates.append(entry)
+        objs: list = [obj for entry, obj in creates]
+        # create_time 为前台记账时间, 由 CreateTimeField 保留
+        if connections[DEFAULT_DB_ALIAS].features.can_return_rows_from_bulk_insert:
+            Cashier.objects.bulk_create(objs, batch_size=500)
+            ChangeListDateIndex.record(Cashier, [(None, ChangeListDateIndex.get_state(obj)) for obj in objs])
+        else:
+            # MySQL 的 bulk_create 不返回主键, 逐行 INSERT 取得主键, 不经过 Cashier.save 的加锁与数量调整
+            # 按日索引由 post_save 信号记录
+            for obj in objs:
+                super(Cashier, obj).save()
+        # 按材料汇总数量变动, 每个材料一次调整
+        stock_deltas: dict = dict()
+        for obj in objs:
+            stock_deltas[obj.name_id] = stock_deltas.get(obj.name_id, 0) + obj.get_stock_delta()
+        for material_id, stock_delta in sorted(stock_deltas.items()):
+            if stock_delta:
+                materials_map[material_id].adjust_number(stock_delta)
+        CashierDailySummary.record([(None, obj) for obj in objs])
+        for entry, obj in creates:
+            results[entry.idempotency_key] = (Choices.PosStatus.synced, obj.id, None)
+        # 修改在新增的数量调整之后逐条执行, Cashier.save 重新加锁读取材料
+        for entry in updates:
+            results[entry.idempotency_key] = self.apply_update(entry)
+        PosSyncReceipt.objects.bulk_create([
+            PosSyncReceipt(idempotency_key=key, terminal=settings.XICHEBA_POS_TERMINAL, object_id=object_id)
+            for key, (status, object_id, message) in results.items() if status == Choices.PosStatus.synced
+        ])
+        return results
+
+    @staticmethod
+    def build_cashier(entry: PosJournal) -> Cashier:
+        obj = Cashier(create_by_user_id=entry.create_by_user, create_time=entry.create_time,
+                      **{field: entry.payload.get(field) for field in PAYLOAD_FIELDS})
+        obj.compute_money()
+        return obj
+
+    @staticmethod
+    def apply_update(entry: PosJournal) -> tuple:
+        """
+        主库明细的更新时间与记账时读取的一致才应用修改, 否则以主库为准
+        :param entry: 修改的队列记录
+        :return: (状态, 出纳明细id, 冲突原因)
+        """
+        obj = Cashier.all_objects.select_for_update().filter(id=entry.object_id).first()
+        if obj is None:
+            return Choices.PosStatus.conflict, entry.object_id, '出纳明细已不存在'
+        if obj.is_deleted:
+            return Choices.PosStatus.conflict, entry.object_id, '出纳明细已删除'
+        if obj.update_time != parse_datetime(entry.payload['base_update_time']):
+            return Choices.PosStatus.conflict, entry.object_id, F'出纳明细已于 {timezone.localtime(obj.update_time)} 修改'
+        for field in UPDATE_FIELDS:
+            setattr(obj, field, entry.payload.get(field))
+        obj.create_by_user_id = entry.create_by_user
+        # 价格快照与数量调整由 Cashier.save 按修改前的明细处理, 不使用终端的价格
+        obj.save()
+        return Choices.PosStatus.synced, obj.id, None
+
+    def mark(self, results: dict) -> None:
+        """
+        主库提交后更新终端队列的同步状态
+        :param results: {幂等键: (状态, 出纳明细id, 冲突原因)}
+        :return: None
+        """
+        now = timezone.now()
+        entries: list = list(PosJournal.objects.filter(idempotency_key__in=list(results)))
+        for entry in entries:
+            entry.status, entry.object_id, entry.message = results[entry.idempotency_key]
+            entry.synced_time = now
+            if entry.status == Choices.PosStatus.synced:
+                self.synced += 1
+            else:
+                self.conflicts += 1
+        PosJournal.objects.bulk_update(entries, ['status', 'object_id', 'message', 'synced_time'])
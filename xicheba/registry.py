@@ -0,0 +1,214 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.db import models
+
+
+class ReferenceCache:
+    """
+    参考数据缓存: 材料、事件类型的枚举, 用户显示名称等读多写少的数据
+    每个模型一个版本号, 数据变更时由信号升级版本号, 旧版本的键随之失效
+    进程内保留当前版本的结果, settings.XICHEBA_REFERENCE_CACHE 指定 CACHES 别名后多个 worker 共享数据与版本号
+    """
+    key_prefix: str = 'xicheba:reference'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (app_label.model, name) --> (version, value)
+        self._values: dict = dict()
+        # 进程内命中、共享缓存命中、未命中(查询数据库构建)次数
+        self.hits: int = 0
+        self.shared_hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def _label(model) -> str:
+        return model._meta.label_lower
+
+    def _shared_cache(self):
+        alias = getattr(settings, 'XICHEBA_REFERENCE_CACHE', None)
+        if not alias:
+            return None
+        return caches[alias]
+
+    def _version_key(self, model) -> str:
+        return F'{self.key_prefix}:{self._label(model)}:version'
+
+    def _data_key(self, model, name: str, version: int) -> str:
+        return F'{self.key_prefix}:{self._label(model)}:{name}:{version}'
+
+    def get_or_build(self, model, name: str, builder):
+        """
+        获取缓存的数据, 进程内与共享缓存都未命中时调用 builder 构建
+        :param model: 数据所属的模型, 模型变更时失效
+        :param name: 数据名称
+        :param builder: 无参数的构建函数, 返回值需要可以 pickle
+        :return: builder 的返回值
+        """
+        cache = self._shared_cache()
+        version: int = cache.get_or_set(self._version_key(model), time.time_ns, None) if cache is not None else 0
+        local_key: tuple = (self._label(model), name)
+        cached = self._values.get(local_key)
+        if cached is not None and cached[0] == version:
+            self.hits += 1
+            return cached[1]
+        with self._lock:
+            cached = self._values.get(local_key)
+            if cached is not None and cached[0] == version:
+                self.hits += 1
+                return cached[1]
+            value = cache.get(self._data_key(model, name, version)) if cache is not None else None
+            if value is None:
+                value = builder()
+                self.misses += 1
+                if cache is not None:
+                    cache.set(self._data_key(model, name, version), value, None)
+            else:
+                self.shared_hits += 1
+            self._values[local_key] = (version, value)
+        return value
+
+    def invalidate(self, model) -> None:
+        """
+        模型数据变更后清除该模型的全部数据
+        :param model: 模型类
+        :return: None
+        """
+        label: str = self._label(model)
+        with self._lock:
+            for local_key in [key for key in self._values if key[0] == label]:
+                del self._values[local_key]
+        cache = self._shared_cache()
+        if cache is not None:
+            try:
+                cache.incr(self._version_key(model))
+            except ValueError:
+                cache.set(self._version_key(model), time.time_ns(), None)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses}
+
+
+class ChoiceRegistry:
+    """
+    枚举缓存, 同一模型同一列的 (key, label) 元组保存在 reference_cache, Materials/EventType 变更时由信号失效
+    """
+
+    @staticmethod
+    def get(model, value: str = 'name') -> tuple[tuple[str, str]]:
+        """
+        获取枚举对象, 命中缓存时不访问数据库
+        :param model: ToolsBox 子类
+        :param value: 对象 model 的列名称
+        :return: examples (('x','y'),('z', 'm'),)
+        """
+        return reference_cache.get_or_build(model, F'choices:{value}', lambda: model.build_values(value=value))
+
+    @staticmethod
+    def invalidate(model) -> None:
+        reference_cache.invalidate(model)
+
+
+class LazyChoices:
+    """
+    延迟枚举, 每次迭代时从 choice_registry 读取
+    用于模型字段的 choices, 避免在实例化模型时重复查询
+    """
+
+    def __init__(self, model, value: str = 'name'):
+        self.model = model
+        self.value = value
+
+    def __iter__(self):
+        return iter(choice_registry.get(self.model, value=self.value))
+
+    def __len__(self) -> int:
+        return len(choice_registry.get(self.model, value=self.value))
+
+
+class LazyChoiceCharField(models.CharField):
+    """
+    choices 为 LazyChoices 的 CharField
+    系统检查与 makemigrations 不展开 choices, 导入模型、django.setup()、manage.py check 均不查询数据库
+    """
+
+    def _check_choices(self):
+        if isinstance(self.choices, LazyChoices):
+            return []
+        return super()._check_choices()
+
+    def deconstruct(self):
+        choices, self.choices = self.choices, None
+        try:
+            name, path, args, kwargs = super().deconstruct()
+        finally:
+            self.choices = choices
+        return name, path, args, kwargs
+
+
+class CountCache:
+    """
+    changelist 总数缓存
+    键包含模型的版本号与 SQL, 模型写入时升级版本号使该模型全部总数失效, 其余 worker 的进程内缓存由超时兜底
+    使用 settings.XICHEBA_COUNT_CACHE 指定的 CACHES 别名, 多个 worker 共享时配置为 Redis/Memcached
+    """
+    key_prefix: str = 'xicheba:count'
+
+    def __init__(self):
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def _cache():
+        return caches[getattr(settings, 'XICHEBA_COUNT_CACHE', 'default')]
+
+    def _version_key(self, model) -> str:
+        return F'{self.key_prefix}:{model._meta.label_lower}:version'
+
+    def count(self, queryset, timeout: int) -> int:
+        """
+        获取 queryset 的总数, 命中缓存时不执行 COUNT(*)
+        :param queryset: changelist 过滤后的 queryset
+        :param timeout: 缓存秒数
+        :return: 总数
+        """
+        try:
+            sql: str = str(queryset.query)
+        except EmptyResultSet:
+            return 0
+        cache = self._cache()
+        version: int = cache.get_or_set(self._version_key(queryset.model), time.time_ns, None)
+        key: str = F'{self.key_prefix}:{queryset.model._meta.label_lower}:{version}:' \
+                   F'{hashlib.md5(sql.encode()).hexdigest()}'
+        count = cache.get(key)
+        if count is None:
+            self.misses += 1
+            count = queryset.count()
+            cache.set(key, count, timeout)
+        else:
+            self.hits += 1
+        return count
+
+    def invalidate(self, model) -> None:
+        """
+        模型数据变更后使该模型的全部总数失效
+        :param model: 模型类
+        :return: None
+        """
+        cache = self._cache()
+        try:
+            cache.incr(self._version_key(model))
+        except ValueError:
+            cache.set(self._version_key(model), time.time_ns(), None)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+reference_cache = ReferenceCache()
+choice_registry = ChoiceRegistry()
+count_cache = CountCache()
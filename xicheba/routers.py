@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS: str = 'replica'
+POS_JOURNAL_DB_ALIAS: str = 'pos_journal'
+POS_JOURNAL_MODEL: str = 'xicheba.posjournal'
+# 读请求走副本的模型: 明细列表与报表, 材料与事件类型等参考数据始终读主库, 避免缓存到延迟数据
+REPLICA_READ_MODELS: tuple = (
+    'xicheba.users', 'xicheba.cashier', 'xicheba.extraproject', 'xicheba.stockmovement',
+    'xicheba.cashierdailysummary', 'xicheba.extraprojectdailysummary',
+)
+
+
+class PrimaryReplicaRouter:
+    """
+    读写分离: 写入、事务内的读取、select_for_update 都走主库
+    未配置 replica 时全部返回 None, 即使用 default
+    """
+
+    def db_for_read(self, model, **hints):
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            return None
+        if model._meta.label_lower not in REPLICA_READ_MODELS:
+            return None
+        # 主库事务中的读取需要读到本事务的写入
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DB_ALIAS
+
+
+class PosJournalRouter:
+    """
+    本地收银队列只读写终端的 pos_journal 数据库, 其余模型不在 pos_journal 中建表
+    需要放在 DATABASE_ROUTERS 的第一位
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower == POS_JOURNAL_MODEL:
+            return POS_JOURNAL_DB_ALIAS
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if F'{app_label}.{model_name}' == POS_JOURNAL_MODEL:
+            return db == POS_JOURNAL_DB_ALIAS
+        if db == POS_JOURNAL_DB_ALIAS:
+            return False
+        return None
@@ -0,0 +1,119 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_init, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import pos
+from .models import Materials, EventType, Users, Cashier, ExtraProject, ChangeListDateIndex
+from .registry import choice_registry, count_cache, reference_cache
+
+
+@receiver([post_save, post_delete], sender=Materials)
+@receiver([post_save, post_delete], sender=EventType)
+def invalidate_choices(sender, **kwargs) -> None:
+    """
+    材料、事件类型变更后清除对应的枚举缓存
+    :param sender: 模型类
+    :return: None
+    """
+    choice_registry.invalidate(sender)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_names(sender, update_fields=None, **kwargs) -> None:
+    """
+    用户变更后清除缓存的显示名称, 登录时只更新 last_login 不清除
+    :param sender: User
+    :param update_fields: save(update_fields=...) 的列
+    :return: None
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    reference_cache.invalidate(sender)
+
+
+@receiver([post_save, post_delete], sender=Materials)
+@receiver([post_save, post_delete], sender=User)
+def invalidate_pos_cache(sender, instance, update_fields=None, **kwargs) -> None:
+    """
+    本地收银模式下材料、用户变更后清除终端缓存, 登录时只更新 last_login 不清除
+    :param sender: Materials User
+    :param instance: 变更的对象
+    :param update_fields: save(update_fields=...) 的列
+    :return: None
+    """
+    if not pos.is_enabled() or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    pos.invalidate_cache(sender, instance)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_pos_user_permissions(sender, instance, action: str, reverse: bool, pk_set=None, **kwargs) -> None:
+    """
+    本地收银模式下用户的权限、组变更后清除终端缓存的用户
+    :param sender: 多对多中间表
+    :param instance: reverse=False 时为用户, 否则为权限或组
+    :param action: pre_add post_add ...
+    :param reverse: 是否从权限、组一侧修改
+    :param pk_set: reverse=True 时为用户id
+    :return: None
+    """
+    if not pos.is_enabled() or not action.startswith('post_'):
+        return
+    if not reverse:
+        pos.invalidate_cache(User, instance)
+    else:
+        for user_id in pk_set or ():
+            pos.invalidate_cache(User, User(pk=user_id))
+
+
+@receiver(post_init, sender=Users)
+@receiver(post_init, sender=Cashier)
+@receiver(post_init, sender=ExtraProject)
+def remember_date_index_state(sender, instance, **kwargs) -> None:
+    """
+    记录从数据库读取时的 (日期, 创建用户, 是否逻辑删除), 保存时用于计算按日索引的变动
+    新建的对象与只读取了部分列(only/defer)的对象不记录
+    :param sender: 模型类
+    :param instance: 模型对象
+    :return: None
+    """
+    instance._date_index_state = None
+    row: dict = instance.__dict__
+    if row.get('id') is not None and row.get('create_time') is not None and \
+            {'create_by_user_id', 'is_deleted'} <= row.keys():
+        instance._date_index_state = ChangeListDateIndex.get_state(instance)
+
+
+@receiver(post_init, sender=Materials)
+def remember_stock_state(sender, instance, **kwargs) -> None:
+    """
+    记录从数据库读取时的 (数量, 补货提醒数量), 保存时两者都未修改则不重新检查库存不足
+    新建的对象与只读取了部分列(only/defer)的对象不记录
+    :param sender: Materials
+    :param instance: 材料对象
+    :return: None
+    """
+    instance._stock_state = None
+    row: dict = instance.__dict__
+    if row.get('id') is not None and {'number', 'reorder_threshold'} <= row.keys():
+        instance._stock_state = (instance.number, instance.reorder_threshold)
+
+
+@receiver(post_save, sender=Users)
+@receiver(post_save, sender=Cashier)
+@receiver(post_save, sender=ExtraProject)
+def update_date_index(sender, instance, created, **kwargs) -> None:
+    """
+    明细新增、逻辑删除、修改创建用户后更新按日索引, 并使 changelist 总数缓存失效
+    :param sender: 模型类
+    :param instance: 模型对象
+    :param created: 是否新增
+    :return: None
+    """
+    new_state: tuple = ChangeListDateIndex.get_state(instance)
+    old_state: tuple = None if created else instance._date_index_state
+    if created or (old_state is not None and old_state != new_state):
+        ChangeListDateIndex.record(sender, [(old_state, new_state)])
+    instance._date_index_state = new_state
+    count_cache.invalidate(sender)
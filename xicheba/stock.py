@@ -0,0 +1,168 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Q, Sum, Case, When, Value, IntegerField
+from django.utils import timezone
+
+from .models import Cashier, Materials, StockMovement, StockCheckpoint
+
+
+class StockReconciler:
+    """
+    按出纳明细核对材料数量: 材料数量 = 期初数量 + 结转数量 + cutoff 之后未删除的出纳明细的数量合计
+    每次核对用一次分组聚合计算各材料的数量, 检查点之后没有新增或修改 cutoff 之前的明细时只扫描 cutoff 之后的明细,
+    并把 close_days 天之前的明细结转到检查点
+    """
+    # 明细的 update_time 在事务提交前取值, 核对时间减去该时长, 避免漏掉核对时尚未提交的修改
+    settle_time: datetime.timedelta = datetime.timedelta(minutes=10)
+
+    def __init__(self, close_days: int = 7):
+        self.close_days: int = close_days
+        # 本次核对是否从检查点增量扫描, 以及扫描的起始时间
+        self.incremental: bool = False
+        self.start = None
+
+    def get_cutoff(self) -> datetime.datetime:
+        """
+        :return: close_days 天前的当地零点, 之前的明细结转到检查点
+        """
+        day: datetime.date = timezone.localdate() - datetime.timedelta(days=self.close_days)
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+
+    @staticmethod
+    def aggregate(queryset, cutoff: datetime.datetime) -> dict:
+        """
+        一次分组聚合, 按 cutoff 拆分各材料的数量合计
+        :param queryset: 未删除的出纳明细
+        :param cutoff: 拆分时间
+        :return: {材料id: (cutoff 之前的合计, cutoff 之后的合计)}
+        """
+        expression = Cashier.stock_delta_expression()
+        rows = queryset.values('name').annotate(
+            before=Sum(expression, filter=Q(create_time__lt=cutoff)),
+            after=Sum(expression, filter=Q(create_time__gte=cutoff)),
+        ).order_by()
+        return {row['name']: (row['before'] or 0, row['after'] or 0) for row in rows}
+
+    @staticmethod
+    def is_stale(checkpoints: list) -> bool:
+        """
+        没有检查点、部分材料未结转, 或检查点之后新增(导入、本地收银同步)、修改、逻辑删除了 cutoff 之前的明细时,
+        结转数量需要重新计算; 索引 cashier_update_time_idx (update_time, create_time)
+        :param checkpoints: 全部材料的检查点, 核对时写入的 cutoff 与 checked_time 相同
+        :return: True=需要全量扫描
+        """
+        if not checkpoints or any(checkpoint.cutoff is None for checkpoint in checkpoints):
+            return True
+        checkpoint: StockCheckpoint = checkpoints[0]
+        return Cashier.all_objects.filter(
+            update_time__gt=checkpoint.checked_time, create_time__lt=checkpoint.cutoff).exists()
+
+    def run(self, fix: bool = False, full: bool = False, user=None) -> list[dict]:
+        """
+        核对全部材料的数量并更新检查点
+        修正时在同一事务中锁定全部材料, 记账需要等待核对完成, 数量与明细一致
+        :param fix: 是否修正材料数量
+        :param full: 忽略检查点, 扫描全部明细
+        :param user: 修正时库存流水的创建用户
+        :return: [{'materials': 材料对象, 'number': 材料数量, 'ledger': 按明细计算的数量, 'drift': 差异}]
+        """
+        checked_time: datetime.datetime = timezone.now() - self.settle_time
+        cutoff: datetime.datetime = self.get_cutoff()
+        with transaction.atomic():
+            materials_queryset = Materials.objects.order_by('id')
+            if fix:
+                materials_queryset = materials_queryset.select_for_update()
+            materials_map: dict = materials_queryset.in_bulk()
+            checkpoints: dict = {
+                checkpoint.materials_id: checkpoint for checkpoint in StockCheckpoint.objects.select_for_update()
+            }
+            checkpoint = next(iter(checkpoints.values()), None)
+            # 结转天数缩短时 cutoff 提前, 不能增量扫描
+            self.incremental = not full and not self.is_stale(list(checkpoints.values())) and \
+                checkpoint.cutoff <= cutoff
+            self.start = checkpoint.cutoff if self.incremental else None
+            queryset = Cashier.objects.all()
+            if self.incremental:
+                queryset = queryset.filter(create_time__gte=self.start)
+            totals: dict = self.aggregate(queryset, cutoff)
+            drifts: list = list()
+            creates: list = list()
+            for material_id, materials_obj in materials_map.items():
+                if material_id in checkpoints:
+                    checkpoint = checkpoints[material_id]
+                else:
+                    checkpoint = StockCheckpoint(materials_id=material_id)
+                    creates.append(checkpoint)
+                before, after = totals.get(material_id, (0, 0))
+                checkpoint.closed = (checkpoint.closed if self.incremental else 0) + before
+                checkpoint.cutoff, checkpoint.checked_time = cutoff, checked_time
+                ledger: int = checkpoint.opening + checkpoint.closed + after
+                if materials_obj.number != ledger:
+                    drifts.append({'materials': materials_obj, 'number': materials_obj.number, 'ledger': ledger,
+                                   'drift': materials_obj.number - ledger})
+            StockCheckpoint.objects.bulk_update(checkpoints.values(), ['closed', 'cutoff', 'checked_time'],
+                                                batch_size=500)
+            StockCheckpoint.objects.bulk_create(creates, batch_size=500)
+            if fix and drifts:
+                self.fix(drifts, user)
+        return drifts
+
+    @staticmethod
+    def fix(drifts: list, user=None) -> None:
+        """
+        一条 UPDATE 把材料数量改为按明细计算的数量, 写入库存流水并更新库存不足标记
+        需要在 transaction.atomic() 中以 select_for_update() 获取材料后调用
+        :param drifts: StockReconciler.run 的返回值
+        :param user: 库存流水的创建用户
+        :return: None
+        """
+        Materials.objects.filter(id__in=[drift['materials'].id for drift in drifts]).update(number=Case(
+            *(When(id=drift['materials'].id, then=Value(drift['ledger'])) for drift in drifts),
+            output_field=IntegerField()
+        ))
+        StockMovement.objects.bulk_create([
+            StockMovement(materials=drift['materials'], number=-drift['drift'], balance=drift['ledger'],
+                          create_by_user_id=user.id if user else None)
+            for drift in drifts
+        ], batch_size=500)
+        for drift in drifts:
+            drift['materials'].number = drift['ledger']
+            drift['materials'].update_low_stock()
+
+    @staticmethod
+    def fold_dropped(stock_totals: dict) -> None:
+        """
+        删除出纳明细的历史分区后, 把被删除明细的数量合计转入期初数量, 材料数量不变
+        :param stock_totals: 删除前 aggregate 的结果 {材料id: (cutoff 之前的合计, cutoff 之后的合计)},
+            cutoff 为检查点的结转截止时间, 之前的部分已计入结转数量
+        :return: None
+        """
+        with transaction.atomic():
+            checkpoints: dict = {
+                checkpoint.materials_id: checkpoint for checkpoint in StockCheckpoint.objects.select_for_update()
+            }
+            creates: list = list()
+            for material_id, (before, after) in stock_totals.items():
+                if material_id in checkpoints:
+                    checkpoint = checkpoints[material_id]
+                else:
+                    checkpoint = StockCheckpoint(materials_id=material_id)
+                    creates.append(checkpoint)
+                checkpoint.opening += before + after
+                if checkpoint.cutoff is not None:
+                    checkpoint.closed -= before
+            StockCheckpoint.objects.bulk_update(checkpoints.values(), ['opening', 'closed'], batch_size=500)
+            StockCheckpoint.objects.bulk_create(creates, batch_size=500)
+
+    @classmethod
+    def get_dropped_totals(cls, end: datetime.datetime) -> dict:
+        """
+        删除历史分区前调用, 计算将被删除的明细的数量合计
+        :param end: 被删除的分区的结束时间(不含)
+        :return: fold_dropped 的参数
+        """
+        checkpoint = StockCheckpoint.objects.filter(cutoff__isnull=False).first()
+        # 没有检查点时 cutoff 取 end, 全部计入期初数量
+        cutoff = checkpoint.cutoff if checkpoint else end
+        return cls.aggregate(Cashier.objects.filter(create_time__lt=end), cutoff)
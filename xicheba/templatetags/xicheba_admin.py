@@ -0,0 +1,67 @@
+import copy
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.db.models import Min, Max
+
+register = template.Library()
+
+
+class DateIndexQuerySet:
+    """
+    date_hierarchy 使用的 aggregate(first, last) 与 datetimes/dates, 由 ChangeListDateIndex 的 day 列提供
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def aggregate(self, **kwargs) -> dict:
+        date_range: dict = self.queryset.aggregate(first=Min('day'), last=Max('day'))
+        return {key: datetime.datetime.combine(value, datetime.time()) if value else value
+                for key, value in date_range.items()}
+
+    def datetimes(self, field_name, kind, **kwargs):
+        return self.queryset.dates('day', kind)
+
+    dates = datetimes
+
+
+def cached_date_hierarchy(cl):
+    """
+    CachedChangeList 提供 date_index 时从按日索引生成年/月/日列表, 否则与 date_hierarchy 相同
+    :param cl: ChangeList
+    :return: date_hierarchy.html 的上下文
+    """
+    if getattr(cl, 'date_index', None) is None:
+        return date_hierarchy(cl)
+    index_cl = copy.copy(cl)
+    index_cl.queryset = DateIndexQuerySet(cl.date_index)
+    return date_hierarchy(index_cl)
+
+
+@register.tag(name='cached_date_hierarchy')
+def cached_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(parser, token, func=cached_date_hierarchy, template_name='date_hierarchy.html',
+                              takes_context=False)
+
+
+def keyset_pagination(cl):
+    """
+    KeysetChangeList 的上一页/下一页链接
+    :param cl: ChangeList
+    :return: keyset_pagination.html 的上下文
+    """
+    page = cl.keyset_page
+    return {
+        'cl': cl,
+        'previous_url': page.has_previous() and cl.get_query_string({cl.CURSOR_VAR: page.previous_cursor}),
+        'next_url': page.has_next() and cl.get_query_string({cl.CURSOR_VAR: page.next_cursor}),
+    }
+
+
+@register.tag(name='keyset_pagination')
+def keyset_pagination_tag(parser, token):
+    return InclusionAdminNode(parser, token, func=keyset_pagination, template_name='keyset_pagination.html',
+                              takes_context=False)
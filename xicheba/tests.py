@@ -0,0 +1,945 @@
+import asyncio
+import csv
+import datetime
+import io
+import threading
+import zipfile
+from xml.etree import ElementTree
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.auth.models import User, Permission
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, DataError, IntegrityError
+from django.db.models import F, Sum
+from django.forms import modelform_factory
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import export, pos
+from .form import PosCashierForm
+from .importer import LedgerImporter
+from .admin import KeysetMixin
+from .middleware import QueryMetricsMiddleware, view_metrics
+from .paginator import KeysetPaginator
+from .models import Users, Materials, Cashier, Choices, StockMovement, CashierDailySummary, ChangeListDateIndex, \
+    LowStockNotification, PosJournal, PosSyncReceipt, StockCheckpoint, ExtraProject, ExtraProjectDailySummary
+from .stock import StockReconciler
+
+
+class ChangeListQueryCountTests(TestCase):
+    """
+    changelist 的查询次数与每页行数无关, 创建者名称一次获取
+    """
+    page_sizes: tuple = (10, 50)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('root', password='root')
+        owners: list = [User.objects.create_user(F'cashier{index}', first_name=F'收银员{index}') for index in range(5)]
+        materials_obj = Materials.objects.create(name='洗车液', original_price=10, price=20, discount_price=15)
+        count: int = max(cls.page_sizes) + 10
+        Cashier.objects.bulk_create([
+            Cashier(name=materials_obj, action=Choices.CashierChoice.incoming, price_type=Choices.MaterialsPriceType.price,
+                    number=1, create_by_user=owners[index % len(owners)]) for index in range(count)
+        ])
+        Users.objects.bulk_create([
+            Users(name=F'客户{index}', create_by_user=owners[index % len(owners)]) for index in range(count)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def get_changelist(self, model, per_page: int):
+        with mock.patch.object(admin.site._registry[model], 'list_per_page', per_page):
+            response = self.client.get(reverse(F'admin:xicheba_{model._meta.model_name}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), per_page)
+        return response
+
+    def assert_constant_queries(self, model) -> None:
+        # 第一次请求填充参考数据与总数缓存
+        self.get_changelist(model, self.page_sizes[0])
+        with CaptureQueriesContext(connection) as context:
+            self.get_changelist(model, self.page_sizes[0])
+        for per_page in self.page_sizes[1:]:
+            with self.assertNumQueries(len(context)):
+                self.get_changelist(model, per_page)
+
+    def test_cashier_changelist(self):
+        self.assert_constant_queries(Cashier)
+
+    def test_users_changelist(self):
+        self.assert_constant_queries(Users)
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    CashierAdmin 按 (create_time, id) 定位翻页: 上一页/下一页覆盖全部行, 排序列不能定位时退回页码分页,
+    动作可以不计算总数作用于过滤后的全部行
+    """
+    per_page: int = 10
+    ordering: list = ['-create_time', '-pk']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('root', password='root')
+        materials_obj = Materials.objects.create(name='洗车液', original_price=10, price=20, discount_price=15)
+        # 每 3 行的 create_time 相同, 翻页边界落在相同的 create_time 中间
+        start = timezone.now() - datetime.timedelta(days=1)
+        Cashier.objects.bulk_create([
+            Cashier(name=materials_obj, action=Choices.CashierChoice.outgoing if index % 4 else
+                    Choices.CashierChoice.incoming, price_type=Choices.MaterialsPriceType.original_price, number=1,
+                    create_by_user=cls.superuser, create_time=start + datetime.timedelta(minutes=index // 3))
+            for index in range(35)
+        ])
+        cls.url: str = reverse('admin:xicheba_cashier_changelist')
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def get_paginator(self) -> KeysetPaginator:
+        return KeysetPaginator(Cashier.all_objects.order_by(*self.ordering), self.per_page, self.ordering)
+
+    def test_next_and_previous_cursors(self):
+        paginator = self.get_paginator()
+        pages: list = [paginator.page()]
+        self.assertFalse(pages[0].has_previous())
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([obj.id for page in pages for obj in page.object_list],
+                         list(Cashier.all_objects.order_by(*self.ordering).values_list('id', flat=True)))
+        self.assertEqual([len(page) for page in pages], [10, 10, 10, 5])
+        # 从最后一页逐页返回, 每页与向后翻页时相同
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = paginator.page(page.previous_cursor)
+            self.assertEqual(page.object_list, expected.object_list)
+        self.assertFalse(page.has_previous())
+
+    def test_changelist_cursor(self):
+        first = self.client.get(self.url).context['cl']
+        self.assertIsNotNone(first.keyset_page)
+        second = self.client.get(self.url, {KeysetMixin.CURSOR_VAR: first.keyset_page.next_cursor}).context['cl']
+        self.assertEqual(second.result_list, self.get_paginator().page(first.keyset_page.next_cursor).object_list)
+
+    def test_fallback_orderings(self):
+        self.assertEqual(KeysetPaginator.get_keyset_ordering(Cashier, ['-create_time', '-create_time', '-pk', '-id']),
+                         self.ordering)
+        # 外键、可为空的列、不以主键结尾
+        self.assertIsNone(KeysetPaginator.get_keyset_ordering(Cashier, ['name', '-pk']))
+        self.assertIsNone(KeysetPaginator.get_keyset_ordering(Cashier, ['remarks', '-pk']))
+        self.assertIsNone(KeysetPaginator.get_keyset_ordering(Cashier, ['-create_time']))
+        list_display: tuple = admin.site._registry[Cashier].list_display
+        response = self.client.get(self.url, {'o': list_display.index('name') + 1})
+        self.assertIsNone(response.context['cl'].keyset_page)
+        self.assertEqual(response.context['cl'].result_count, Cashier.all_objects.count())
+
+    def test_bad_cursor(self):
+        request = RequestFactory().get(self.url, {KeysetMixin.CURSOR_VAR: 'not-a-cursor'})
+        request.user = self.superuser
+        with self.assertRaises(IncorrectLookupParameters):
+            admin.site._registry[Cashier].get_changelist_instance(request)
+        self.assertRedirects(self.client.get(self.url, {KeysetMixin.CURSOR_VAR: 'not-a-cursor'}), F'{self.url}?e=1',
+                             fetch_redirect_response=False)
+
+    def test_select_across(self):
+        filters: str = F'?action={Choices.CashierChoice.outgoing}'
+        response = self.client.get(self.url + filters)
+        self.assertContains(response, '选择全部符合条件的')
+        response = self.client.post(self.url + filters, {
+            'action': 'export_csv', 'select_across': '1', 'index': '0',
+            '_selected_action': [obj.id for obj in response.context['cl'].result_list],
+        })
+        rows: list = b''.join(response.streaming_content).decode().splitlines()[1:]
+        self.assertEqual(len(rows), Cashier.all_objects.filter(action=Choices.CashierChoice.outgoing).count())
+        self.assertGreater(len(rows), self.per_page)
+
+
+class ExportTests(TestCase):
+    """
+    导出动作的 CSV/XLSX 与过滤后的 queryset 一致, 创建者为名称, 枚举为显示文本
+    """
+    xlsx_namespace: dict = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('root', password='root')
+        cls.clerk = User.objects.create_user('clerk', first_name='三', last_name='张')
+        materials_obj = Materials.objects.create(name='洗车液', original_price=10, price=20, discount_price=15)
+        Cashier.objects.bulk_create([
+            Cashier(name=materials_obj, action=Choices.CashierChoice.incoming if index % 3 else
+                    Choices.CashierChoice.outgoing, price_type=Choices.MaterialsPriceType.price if index % 3 else
+                    Choices.MaterialsPriceType.original_price, number=index + 1,
+                    create_by_user=cls.clerk if index % 2 else cls.superuser)
+            for index in range(25)
+        ])
+        cls.url: str = reverse('admin:xicheba_cashier_changelist') + F'?action={Choices.CashierChoice.incoming}'
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def post_export(self, action: str):
+        response = self.client.get(self.url)
+        # 导出分多块读取
+        with mock.patch.object(export, 'CHUNK_SIZE', 4):
+            response = self.client.post(self.url, {
+                'action': action, 'select_across': '1', 'index': '0',
+                '_selected_action': [obj.id for obj in response.context['cl'].result_list],
+            })
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def read_xlsx(self, content: bytes) -> list[list[str]]:
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        rows: list = list()
+        for row in sheet.iterfind('x:sheetData/x:row', self.xlsx_namespace):
+            # 空值不写入单元格, 按单元格的列号 A1 B1 ... 还原位置
+            cells: dict = {ord(cell.get('r')[0]) - ord('A'): ''.join(cell.itertext())
+                           for cell in row.iterfind('x:c', self.xlsx_namespace)}
+            rows.append([cells.get(index, '') for index in range(max(cells) + 1)])
+        return rows
+
+    def assert_rows(self, rows: list[list[str]]) -> None:
+        header, rows = rows[0], rows[1:]
+        self.assertEqual(header, export.get_header(Cashier))
+        queryset = Cashier.all_objects.filter(action=Choices.CashierChoice.incoming).order_by('id')
+        self.assertGreater(queryset.count(), admin.site._registry[Cashier].list_per_page)
+        columns: dict = {name: header.index(str(Cashier._meta.get_field(name).verbose_name))
+                         for name in ('id', 'name', 'action', 'number', 'price_type', 'create_by_user')}
+        self.assertEqual([[row[index] for index in columns.values()] for row in rows], [
+            [str(obj.id), obj.name.name, '收入', str(obj.number), obj.get_price_type_display(),
+             '张三' if obj.create_by_user_id == self.clerk.id else 'root']
+            for obj in queryset.select_related('name')
+        ])
+
+    def test_csv(self):
+        content: str = self.post_export('export_csv').decode()
+        self.assertTrue(content.startswith('\ufeff'))
+        self.assert_rows(list(csv.reader(io.StringIO(content[1:]))))
+
+    def test_xlsx(self):
+        self.assert_rows(self.read_xlsx(self.post_export('export_xlsx')))
+
+
+class LedgerImporterTests(TestCase):
+    """
+    导入时校验失败的行跳过, 材料数量在写入后按材料一次调整, 日汇总与按日索引按导入的日期范围重建
+    """
+    header: str = 'name,action,price_type,number,remarks,create_time\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clerk')
+        cls.wax = Materials.objects.create(name='车蜡', original_price=10, price=20, discount_price=15, number=100)
+        cls.foam = Materials.objects.create(name='泡沫', original_price=5, price=8, discount_price=6, number=50)
+
+    def import_cashier(self, lines: list[str], batch_size: int = 2) -> LedgerImporter:
+        importer = LedgerImporter(Cashier, default_user=self.user, batch_size=batch_size)
+        importer.run(io.StringIO(self.header + '\n'.join(lines)))
+        return importer
+
+    def get_summary_rows(self) -> list:
+        return list(CashierDailySummary.objects.order_by('day', 'materials', 'action').values_list(
+            'day', 'materials', 'action', 'create_by_user', 'count', 'number', 'money', 'earnings'))
+
+    def test_skipped_rows_and_finish(self):
+        importer = self.import_cashier([
+            '车蜡,incoming,price,3,,2024-01-01 10:00',
+            '车蜡,收入,售价,2,,2024-01-02 10:00',
+            '打蜡机,incoming,price,1,,2024-01-02 11:00',
+            '泡沫,outgoing,original_price,5,,2024-01-02 12:00',
+            '泡沫,incoming,price,1,' + '备' * 101 + ',2024-01-03 10:00',
+            '泡沫,incoming,price,0,,2024-01-03 11:00',
+            '泡沫,incoming,discount_price,1,,2024-01-03 12:00',
+        ])
+        self.assertEqual(importer.rows, 4)
+        self.assertEqual([error.split(':')[0] for error in importer.errors], ['第4行', '第6行', '第7行'])
+        self.assertIn('备注', importer.errors[1])
+        self.wax.refresh_from_db()
+        self.foam.refresh_from_db()
+        self.assertEqual((self.wax.number, self.foam.number), (95, 54))
+        # 每个材料一条库存流水
+        self.assertEqual(sorted(StockMovement.objects.values_list('materials', 'number')),
+                         sorted([(self.wax.id, -5), (self.foam.id, 4)]))
+        rows: list = self.get_summary_rows()
+        self.assertEqual(sum(row[6] for row in rows), Cashier.objects.aggregate(money=Sum('money'))['money'])
+        CashierDailySummary.rebuild(datetime.date(2024, 1, 1), datetime.date(2024, 1, 3))
+        self.assertEqual(rows, self.get_summary_rows())
+        self.assertEqual(ChangeListDateIndex.objects.filter(model='xicheba.cashier').count(), 3)
+
+    def test_users_max_length(self):
+        importer = LedgerImporter(Users, batch_size=2)
+        importer.run(io.StringIO('name,phone_number\n' + '客' * 21 + ',\n张三,138000056781\n李四,13800005678'))
+        self.assertEqual(importer.rows, 1)
+        self.assertEqual([error.split(':')[0] for error in importer.errors], ['第2行', '第3行'])
+        self.assertEqual(list(Users.objects.values_list('name', flat=True)), ['李四'])
+
+    def test_failed_batch_finishes_committed(self):
+        bulk_create = Cashier.objects.bulk_create
+        calls: list = list()
+
+        def fail_second_batch(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise DataError('Data too long')
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(Cashier.objects, 'bulk_create', side_effect=fail_second_batch), \
+                self.assertRaises(DataError):
+            self.import_cashier([
+                '车蜡,incoming,price,3,,2024-01-01 10:00',
+                '车蜡,incoming,price,2,,2024-01-01 11:00',
+                '泡沫,incoming,price,4,,2024-01-02 10:00',
+            ])
+        self.assertEqual(Cashier.objects.count(), 2)
+        self.wax.refresh_from_db()
+        self.foam.refresh_from_db()
+        self.assertEqual((self.wax.number, self.foam.number), (95, 50))
+        self.assertEqual([row[:6] for row in self.get_summary_rows()],
+                         [(datetime.date(2024, 1, 1), self.wax.id, 'incoming', self.user.id, 2, 5)])
+
+
+class BulkBookTests(TestCase):
+    """
+    批量记账: 校验失败时不写入, 每个材料一次数量调整, 查询次数与行数无关
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('root', password='root')
+        cls.wax = Materials.objects.create(name='车蜡', original_price=10, price=20, discount_price=15, number=100)
+        cls.foam = Materials.objects.create(name='泡沫', original_price=5, price=8, discount_price=6, number=50)
+
+    @staticmethod
+    def get_line(materials_obj, number=1, action: str = Choices.CashierChoice.incoming,
+                 price_type: str = Choices.MaterialsPriceType.price) -> dict:
+        return {'name': materials_obj.id, 'action': action, 'price_type': price_type, 'number': number}
+
+    def assert_stock(self, wax: int, foam: int) -> None:
+        self.wax.refresh_from_db()
+        self.foam.refresh_from_db()
+        self.assertEqual((self.wax.number, self.foam.number), (wax, foam))
+
+    def test_validation(self):
+        lines: list = [
+            self.get_line(self.wax),
+            self.get_line(self.wax, number=True),
+            {**self.get_line(self.wax), 'name': True},
+            self.get_line(self.wax, number='2'),
+            self.get_line(self.wax, number=0),
+            self.get_line(self.foam, action=Choices.CashierChoice.outgoing),
+            {**self.get_line(self.foam), 'name': self.foam.id + 100},
+        ]
+        with self.assertRaises(ValidationError) as context:
+            Cashier.bulk_book(lines, user=self.user)
+        self.assertEqual(context.exception.messages, ['第3行: 物品名称有误'])
+        del lines[2]
+        with self.assertRaises(ValidationError) as context:
+            Cashier.bulk_book(lines, user=self.user)
+        self.assertEqual([message.split(':')[0] for message in context.exception.messages],
+                         ['第2行', '第3行', '第4行', '第5行', '第6行'])
+        self.assertFalse(Cashier.objects.exists())
+        self.assert_stock(100, 50)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('xicheba:cashier_bulk_book'),
+                                    {'lines': [self.get_line(self.wax, number=True)]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_stock_deltas(self):
+        objs: list = Cashier.bulk_book([
+            self.get_line(self.wax, 3),
+            self.get_line(self.wax, 2, price_type=Choices.MaterialsPriceType.discount_price),
+            self.get_line(self.foam, 4, Choices.CashierChoice.outgoing, Choices.MaterialsPriceType.original_price),
+            self.get_line(self.foam, 1, price_type=Choices.MaterialsPriceType.original_price),
+        ], user=self.user)
+        # 收入按原价不计金额, 不调整数量
+        self.assertEqual([obj.money for obj in objs], [60, 30, 20, 0])
+        self.assert_stock(95, 54)
+        self.assertEqual(sorted(StockMovement.objects.values_list('materials', 'number', 'balance')),
+                         sorted([(self.wax.id, -5, 95), (self.foam.id, 4, 54)]))
+        self.assertEqual(CashierDailySummary.objects.aggregate(money=Sum('money'))['money'], 110)
+
+    def test_constant_queries(self):
+        def book(count: int) -> int:
+            lines: list = [self.get_line(materials_obj) for materials_obj in (self.wax, self.foam)] * (count // 2)
+            with CaptureQueriesContext(connection) as context:
+                Cashier.bulk_book(lines, user=self.user)
+            return len(context)
+
+        # 第一批新增日汇总行与按日索引
+        book(4)
+        self.assertEqual(book(4), book(60))
+
+
+class StockReconcilerTests(TestCase):
+    """
+    检查点之后的增量核对与全量核对结果相同, 能发现人为造成的数量差异
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clerk')
+        cls.wax = Materials.objects.create(name='车蜡', original_price=10, price=20, discount_price=15)
+        cls.foam = Materials.objects.create(name='泡沫', original_price=5, price=8, discount_price=6)
+        now = timezone.now()
+        # 结转天数之前与之后都有明细, 一条逻辑删除
+        for materials_obj, days, action, number in ((cls.wax, 30, Choices.CashierChoice.outgoing, 20),
+                                                    (cls.wax, 20, Choices.CashierChoice.incoming, 3),
+                                                    (cls.foam, 30, Choices.CashierChoice.outgoing, 10),
+                                                    (cls.foam, 2, Choices.CashierChoice.incoming, 4),
+                                                    (cls.wax, 1, Choices.CashierChoice.incoming, 2)):
+            cls.book(materials_obj, number, action, create_time=now - datetime.timedelta(days=days))
+        Cashier.objects.filter(name=cls.wax, number=2).first().delete()
+        # 明细在上次核对之前写入, 之后的核对可以从检查点增量扫描
+        Cashier.all_objects.update(update_time=now - datetime.timedelta(days=1))
+
+    @classmethod
+    def book(cls, materials_obj, number: int, action: str = Choices.CashierChoice.incoming, **kwargs) -> None:
+        price_type: str = Choices.MaterialsPriceType.price if action == Choices.CashierChoice.incoming else \
+            Choices.MaterialsPriceType.original_price
+        Cashier(name=materials_obj, action=action, price_type=price_type, number=number, create_by_user=cls.user,
+                **kwargs).save()
+
+    @staticmethod
+    def reconcile(**kwargs) -> tuple[bool, list]:
+        reconciler = StockReconciler()
+        drifts: list = reconciler.run(**kwargs)
+        return reconciler.incremental, [(drift['materials'].id, drift['number'], drift['ledger'], drift['drift'])
+                                        for drift in drifts]
+
+    def test_incremental_matches_full(self):
+        self.assertEqual(self.reconcile(), (False, []))
+        self.assertEqual(self.reconcile(), (True, []))
+        self.assertEqual(StockCheckpoint.objects.get(materials=self.wax).closed, 17)
+        # 检查点之后新增明细, 并绕过库存流水改动材料数量
+        self.book(self.foam, 1)
+        Materials.objects.filter(id=self.foam.id).update(number=F('number') + 3)
+        incremental, drifts = self.reconcile()
+        self.assertTrue(incremental)
+        self.assertEqual(drifts, [(self.foam.id, 8, 5, 3)])
+        self.assertEqual(self.reconcile(full=True), (False, drifts))
+        self.assertEqual(self.reconcile(fix=True, user=self.user), (True, drifts))
+        self.foam.refresh_from_db()
+        self.assertEqual(self.foam.number, 5)
+        self.assertEqual(self.reconcile(), (True, []))
+
+    def test_old_row_change_forces_full_scan(self):
+        self.reconcile()
+        # 修改结转截止时间之前的明细后, 结转数量需要重新计算
+        old_obj = Cashier.objects.get(name=self.foam, number=10)
+        old_obj.number = 12
+        old_obj.save()
+        self.assertEqual(self.reconcile(), (False, []))
+        self.assertEqual(StockCheckpoint.objects.get(materials=self.foam).closed, 12)
+
+
+class DailySummaryTests(TestCase):
+    """
+    新增、修改、逻辑删除、修改创建用户时增量更新的日汇总与按日索引, 与按日期范围重建的结果相同
+    增量更新后计数为 0 的行保留(报表求和不受影响), 比较时不计
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner')
+        cls.clerk = User.objects.create_user('clerk')
+        cls.wax = Materials.objects.create(name='车蜡', original_price=10, price=20, discount_price=15, number=100)
+        cls.foam = Materials.objects.create(name='泡沫', original_price=5, price=8, discount_price=6, number=100)
+
+    @staticmethod
+    def get_rows(model) -> list:
+        fields: list = [field.attname for field in model._meta.concrete_fields if field.name != 'id']
+        return list(model.objects.exclude(count=0).order_by(*fields).values_list(*fields))
+
+    def assert_rebuild(self, summary, source) -> None:
+        days: list = [timezone.localdate(create_time) for create_time in
+                      source.all_objects.values_list('create_time', flat=True)]
+        incremental: tuple = (self.get_rows(summary), self.get_rows(ChangeListDateIndex))
+        summary.rebuild(min(days), max(days))
+        ChangeListDateIndex.rebuild(source, min(days), max(days))
+        self.assertEqual((self.get_rows(summary), self.get_rows(ChangeListDateIndex)), incremental)
+
+    def test_cashier(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        objs: list = [
+            Cashier(name=self.wax, action=Choices.CashierChoice.incoming, price_type=Choices.MaterialsPriceType.price,
+                    number=number, create_by_user=user, **kwargs)
+            for number, user, kwargs in ((1, self.owner, {}), (2, self.owner, {}), (3, self.clerk, {}), (4, None, {}),
+                                         (5, self.clerk, {'create_time': yesterday}))
+        ]
+        for obj in objs:
+            obj.save()
+        objs[0].number = 6
+        objs[0].save()
+        objs[1].name, objs[1].price_type = self.foam, Choices.MaterialsPriceType.discount_price
+        objs[1].save()
+        objs[2].create_by_user = self.owner
+        objs[2].save()
+        objs[3].create_by_user = self.clerk
+        objs[3].save()
+        objs[4].delete()
+        self.assertEqual(CashierDailySummary.objects.exclude(count=0).count(), 3)
+        self.assert_rebuild(CashierDailySummary, Cashier)
+
+    def test_extraproject(self):
+        objs: list = [ExtraProject(action=action, number=1, money=money, create_by_user=self.owner)
+                      for action, money in (('洗车', 30), ('洗车', 40), ('打蜡', 80))]
+        for obj in objs:
+            obj.save()
+        objs[0].money = 35
+        objs[0].save()
+        objs[1].action = '打蜡'
+        objs[1].create_by_user = None
+        objs[1].save()
+        objs[2].delete()
+        self.assertCountEqual(ExtraProjectDailySummary.objects.exclude(count=0).values_list('action', 'money'),
+                         [('洗车', 35), ('打蜡', 40)])
+        self.assert_rebuild(ExtraProjectDailySummary, ExtraProject)
+
+
+class CheckInTests(TestCase):
+    """
+    会员到店消费: 一条 UPDATE 同时加一并校验会员价次数, 用完后状态为消费次数已用完
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = Users.objects.create(name='张三', user_level=Choices.IsMembersChoice.member,
+                                          phone_number='13800005678', member_frequency=2)
+        cls.guest = Users.objects.create(name='李四', user_level=Choices.IsMembersChoice.not_member,
+                                         phone_number='13800001234', member_frequency=2)
+
+    def get_status(self, users_obj) -> int:
+        return Users.objects.annotate(frequency_status=Users.frequency_status_case()).get(
+            id=users_obj.id).frequency_status
+
+    def test_limit_and_exhausted(self):
+        self.assertEqual(Users.check_in(phone_number=self.member.phone_number)['remaining'], 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(Users.check_in(user_id=self.member.id)['remaining'], 0)
+        updates: list = [query['sql'] for query in context if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('member_frequency', updates[0])
+        self.assertEqual(self.get_status(self.member), Choices.FrequencyStatus.exhausted)
+        with self.assertRaisesMessage(ValidationError, '消费次数已用完'):
+            Users.check_in(user_id=self.member.id)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.using_frequency, 2)
+        self.assertEqual(self.get_status(self.member), Choices.FrequencyStatus.exhausted)
+
+    def test_rejected(self):
+        with self.assertRaisesMessage(ValidationError, '非会员客户'):
+            Users.check_in(user_id=self.guest.id)
+        with self.assertRaises(Users.DoesNotExist):
+            Users.check_in(phone_number='13900000000')
+        self.client.force_login(User.objects.create_superuser('root', password='root'))
+        url: str = reverse('xicheba:users_check_in')
+        self.assertEqual(self.client.post(url, {'id': self.guest.id}, content_type='application/json').status_code,
+                         409)
+        response = self.client.post(url, {'phone_number': self.member.phone_number}, content_type='application/json')
+        self.assertEqual(response.json()['remaining'], 1)
+
+
+class StatusFilterTests(TestCase):
+    """
+    状态过滤的每个取值与 Python 计算的状态返回相同的行, 包括次数、收益为 0 与负数的边界
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('root', password='root')
+        member, not_member = Choices.IsMembersChoice.member, Choices.IsMembersChoice.not_member
+        Users.objects.bulk_create([
+            Users(name=F'客户{index}', user_level=user_level, member_frequency=member_frequency,
+                  using_frequency=using_frequency)
+            for index, (user_level, member_frequency, using_frequency) in enumerate((
+                (member, 0, 0), (member, 5, 0), (member, 5, -1), (member, 5, 5), (member, 0, 1), (member, 5, 6),
+                (member, 5, 3), (not_member, 5, 5), (not_member, 0, 0), (not_member, 0, 3),
+            ))
+        ])
+        materials_obj = Materials.objects.create(name='洗车液', original_price=10, price=20, discount_price=15)
+        incoming, outgoing = Choices.CashierChoice.incoming, Choices.CashierChoice.outgoing
+        price_types = Choices.MaterialsPriceType
+        Cashier.objects.bulk_create([
+            Cashier(name=materials_obj, action=action, price_type=price_type, number=1, earnings=earnings)
+            for action, price_type, earnings in (
+                (incoming, price_types.price, 10), (incoming, price_types.price, 0),
+                (incoming, price_types.discount_price, 0), (incoming, price_types.original_price, 0),
+                (incoming, price_types.original_price, -5), (incoming, price_types.discount_price, -1),
+                (outgoing, price_types.original_price, 0), (outgoing, price_types.original_price, -3),
+                ('', price_types.price, 0),
+            )
+        ])
+
+    def test_status_columns_not_null(self):
+        # 默认状态的过滤条件为其他状态条件的 NOT, 状态列都不为空, 不需要额外的 IS NULL 条件
+        for model, names in ((Users, ('user_level', 'member_frequency', 'using_frequency')),
+                             (Cashier, ('action', 'price_type', 'earnings'))):
+            for name in names:
+                self.assertFalse(model._meta.get_field(name).null, F'{model.__name__}.{name}')
+
+    def assert_filter(self, model, parameter_name: str, status_choices, python_status) -> None:
+        model_admin = admin.site._registry[model]
+        url: str = reverse(F'admin:xicheba_{model._meta.model_name}_changelist')
+        objs: list = list(model.all_objects.all())
+        case_status: dict = dict(model.all_objects.annotate(
+            status=getattr(model, F'{parameter_name}_case')()).values_list('id', 'status'))
+        for status in status_choices.values:
+            request = RequestFactory().get(url, {parameter_name: status})
+            request.user = self.superuser
+            changelist = model_admin.get_changelist_instance(request)
+            expected: list = sorted(obj.id for obj in objs if python_status(obj) == status)
+            self.assertEqual(sorted(changelist.queryset.values_list('id', flat=True)), expected, status_choices(status))
+            self.assertEqual(sorted(obj_id for obj_id, value in case_status.items() if value == status), expected)
+        # 每行恰好属于一个状态
+        self.assertEqual(sorted(python_status(obj) for obj in objs), sorted(case_status.values()))
+
+    def test_frequency_status(self):
+        self.assert_filter(Users, 'frequency_status', Choices.FrequencyStatus, Users.get_frequency_status)
+        self.assertEqual(Users.objects.filter(Users.build_status_filter(
+            Users.get_frequency_status_conditions(), Choices.FrequencyStatus.exhausted)).get().name, '客户3')
+
+    def test_earnings_status(self):
+        self.assert_filter(Cashier, 'earnings_status', Choices.EarningsStatus, Cashier.get_earnings_status)
+        self.assertEqual(Cashier.objects.filter(Cashier.build_status_filter(
+            Cashier.get_earnings_status_conditions(), Choices.EarningsStatus.loss)).count(), 2)
+
+    def test_invalid_value(self):
+        url: str = reverse('admin:xicheba_users_changelist')
+        for value in ('9', 'x'):
+            request = RequestFactory().get(url, {'frequency_status': value})
+            request.user = self.superuser
+            with self.assertRaises(IncorrectLookupParameters):
+                admin.site._registry[Users].get_changelist_instance(request)
+
+
+class CounterRowUniqueTests(TestCase):
+    """
+    创建用户为空的汇总行同样唯一, 并发新增时 CounterRow.apply 捕获 IntegrityError 后累加
+    """
+
+    def assert_unique(self, model, key: dict) -> None:
+        model.objects.create(**key, count=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            model.objects.create(**key, count=1)
+
+    def test_cashier_daily_summary(self):
+        materials_obj = Materials.objects.create(name='洗车液')
+        self.assert_unique(CashierDailySummary, {'day': timezone.localdate(), 'materials': materials_obj,
+                                                 'action': Choices.CashierChoice.incoming, 'create_by_user': None})
+
+    def test_changelist_date_index(self):
+        self.assert_unique(ChangeListDateIndex, {'model': 'xicheba.cashier', 'day': timezone.localdate(),
+                                                 'create_by_user': None})
+
+
+class LowStockSaveTests(TestCase):
+    """
+    保存材料时只有数量或补货提醒数量变化才重新检查库存不足
+    """
+
+    def setUp(self):
+        materials_obj = Materials.objects.create(name='洗车液', price=20, number=10, reorder_threshold=5)
+        self.materials_obj = Materials.objects.get(id=materials_obj.id)
+
+    def test_unchanged_stock_skips_check(self):
+        self.materials_obj.price = 30
+        with CaptureQueriesContext(connection) as context:
+            self.materials_obj.save()
+        self.assertEqual([query['sql'] for query in context if query['sql'].startswith('SELECT')], [])
+
+    def test_threshold_change_rechecks(self):
+        self.materials_obj.reorder_threshold = 10
+        self.materials_obj.save(update_fields=['reorder_threshold'])
+        self.materials_obj.refresh_from_db()
+        self.assertTrue(self.materials_obj.is_low_stock)
+        self.assertEqual(LowStockNotification.objects.filter(materials=self.materials_obj).count(), 1)
+
+
+@override_settings(XICHEBA_METRICS_SAMPLE_RATE=1)
+class QueryMetricsMiddlewareTests(TestCase):
+    """
+    WSGI 与 ASGI 下都记录视图的 SQL 条数, ASGI 下中间件以协程执行
+    """
+    view_name: str = 'admin:xicheba_materials_changelist'
+
+    def setUp(self):
+        user = User.objects.create_superuser('root', password='root')
+        self.client.force_login(user)
+        self.async_client.force_login(user)
+        view_metrics._views.pop(self.view_name, None)
+
+    def assert_recorded(self, response) -> None:
+        self.assertEqual(response.status_code, 200)
+        requests, _, queries, _, _ = view_metrics._views[self.view_name]
+        self.assertEqual(requests, 1)
+        self.assertGreater(queries, 0)
+
+    def test_sync_request(self):
+        self.assertFalse(asyncio.iscoroutinefunction(QueryMetricsMiddleware(lambda request: None)))
+        self.assert_recorded(self.client.get(reverse(self.view_name)))
+
+    async def test_async_request(self):
+        async def get_response(request):
+            return None
+
+        self.assertTrue(asyncio.iscoroutinefunction(QueryMetricsMiddleware(get_response)))
+        self.assert_recorded(await self.async_client.get(reverse(self.view_name)))
+
+
+class CreateTimeFieldTests(TestCase):
+    """
+    新增时保留对象上指定的 create_time, 未指定时取当前时间
+    """
+
+    def test_bulk_create_keeps_create_time(self):
+        create_time = timezone.now() - datetime.timedelta(days=30)
+        Users.objects.bulk_create([Users(name='导入', create_time=create_time), Users(name='新增')])
+        self.assertEqual(Users.objects.get(name='导入').create_time, create_time)
+        self.assertGreater(Users.objects.get(name='新增').create_time, create_time)
+        self.assertTrue(Users._meta.get_field('create_time').auto_now_add)
+
+
+# 终端缓存使用进程内缓存, 不读写终端上的文件缓存
+override_pos_cache = override_settings(CACHES={**settings.CACHES, pos.POS_CACHE_ALIAS: {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'xicheba-pos-tests'}})
+
+
+@override_pos_cache
+class PosCacheTests(TestCase):
+    """
+    本地收银模式下终端缓存预热后, 登录用户、权限检查与出纳表单的物品名称校验不查询主库
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', is_staff=True)
+        self.user.user_permissions.add(Permission.objects.get(codename='add_cashier'))
+        self.materials_obj = Materials.objects.create(name='洗车液', original_price=10, price=20, discount_price=15)
+        pos.warm_cache()
+        self.addCleanup(caches[pos.POS_CACHE_ALIAS].clear)
+
+    def test_cached_user(self):
+        with self.assertNumQueries(0):
+            user = pos.PosCachedBackend().get_user(self.user.id)
+            self.assertTrue(user.has_perm('xicheba.add_cashier'))
+            self.assertFalse(user.has_perm('xicheba.delete_cashier'))
+
+    def test_cached_materials_form(self):
+        form_class = modelform_factory(Cashier, form=PosCashierForm,
+                                       fields=('name', 'action', 'price_type', 'number', 'remarks'))
+        data: dict = {'action': Choices.CashierChoice.incoming, 'price_type': Choices.MaterialsPriceType.price,
+                      'number': 1, 'remarks': ''}
+        with self.assertNumQueries(0):
+            form = form_class(data={**data, 'name': self.materials_obj.id})
+            self.assertTrue(form.is_valid(), form.errors)
+            self.assertEqual(form.instance.name.price, self.materials_obj.price)
+            self.assertFalse(form_class(data={**data, 'name': self.materials_obj.id + 1}).is_valid())
+
+
+@skipUnless(pos.is_enabled(), '设置 XICHEBA_POS_JOURNAL 后执行, 测试时队列使用内存中的 SQLite')
+@override_pos_cache
+class PosSyncTests(TestCase):
+    """
+    终端队列(pos_journal)同步到主库(default): 重试按回执幂等, 材料数量只调整一次, 主库已修改的明细以主库为准
+    """
+    # default 与 pos_journal, 未设置 XICHEBA_POS_JOURNAL 时跳过
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clerk')
+        cls.materials_obj = Materials.objects.create(name='洗车液', original_price=10, price=20, discount_price=15,
+                                                     number=100)
+
+    def setUp(self):
+        pos.ensure_journal()
+
+    def enqueue_create(self, number: int) -> PosJournal:
+        return pos.enqueue_cashier(Cashier(name=self.materials_obj, action=Choices.CashierChoice.incoming,
+                                           price_type=Choices.MaterialsPriceType.price, number=number), self.user, False)
+
+    def enqueue_update(self, obj: Cashier, number: int) -> PosJournal:
+        obj.number = number
+        return pos.enqueue_cashier(obj, self.user, True)
+
+    def assert_stock(self, number: int) -> None:
+        self.materials_obj.refresh_from_db()
+        self.assertEqual(self.materials_obj.number, number)
+
+    def test_retry_is_idempotent(self):
+        self.enqueue_create(2)
+        self.enqueue_create(3)
+        # 主库已提交, 更新终端队列状态前中断
+        with mock.patch.object(pos.PosSync, 'mark', side_effect=ConnectionError('终端断电')), \
+                self.assertRaises(ConnectionError):
+            pos.PosSync().run()
+        self.assertEqual(PosJournal.objects.filter(status=Choices.PosStatus.pending).count(), 2)
+        sync = pos.PosSync()
+        self.assertEqual(sync.run(), 2)
+        self.assertEqual((sync.synced, sync.conflicts), (2, 0))
+        self.assertEqual(pos.PosSync().run(), 0)
+        object_ids: list = list(PosJournal.objects.order_by('id').values_list('object_id', flat=True))
+        self.assertEqual(sorted(object_ids), sorted(PosSyncReceipt.objects.values_list('object_id', flat=True)))
+        self.assertEqual([Cashier.objects.values_list('number', 'unit_price').get(id=object_id)
+                          for object_id in object_ids], [(2, 20), (3, 20)])
+        self.assertEqual(Cashier.objects.count(), 2)
+        # 两条新增的数量变动合并为一次调整
+        self.assert_stock(95)
+        self.assertEqual(list(StockMovement.objects.values_list('number', 'balance')), [(-5, 95)])
+
+    def test_conflict_when_central_row_changed(self):
+        cashier_obj = Cashier(name=self.materials_obj, action=Choices.CashierChoice.incoming,
+                              price_type=Choices.MaterialsPriceType.price, number=1, create_by_user=self.user)
+        cashier_obj.save()
+        stale_entry = self.enqueue_update(Cashier.objects.get(id=cashier_obj.id), 4)
+        # 终端读取之后主库修改了这条明细
+        central_obj = Cashier.objects.get(id=cashier_obj.id)
+        central_obj.number = 2
+        central_obj.save()
+        pos.PosSync().run()
+        stale_entry.refresh_from_db()
+        self.assertEqual(stale_entry.status, Choices.PosStatus.conflict)
+        self.assertIn('修改', stale_entry.message)
+        self.assertEqual(Cashier.objects.get(id=cashier_obj.id).number, 2)
+        self.assert_stock(98)
+        self.assertFalse(PosSyncReceipt.objects.filter(idempotency_key=stale_entry.idempotency_key).exists())
+        # 按主库当前的明细重新修改后同步
+        entry = self.enqueue_update(Cashier.objects.get(id=cashier_obj.id), 4)
+        pos.PosSync().run()
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, Choices.PosStatus.synced)
+        self.assertEqual(Cashier.objects.get(id=cashier_obj.id).number, 4)
+        self.assert_stock(96)
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    """
+    多个线程各自使用独立的数据库连接同时执行, 需要支持 select_for_update 的数据库(MySQL)
+    """
+    thread_count: int = 8
+
+    def run_threads(self, target, args_list: list[tuple]) -> None:
+        """
+        所有线程就绪后同时执行 target, 任一线程出错时测试失败
+        :param target: 每个线程执行的函数
+        :param args_list: 每个线程的参数
+        :return: None
+        """
+        barrier = threading.Barrier(len(args_list))
+        errors: list = list()
+
+        def worker(*args) -> None:
+            try:
+                barrier.wait()
+                target(*args)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads: list = [threading.Thread(target=worker, args=args) for args in args_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class StockLedgerConcurrencyTests(ConcurrencyTestCase):
+    """
+    并发记账时材料数量与库存流水没有丢失更新, 流水的结余按提交顺序连续
+    """
+    start_number: int = 100
+
+    def setUp(self):
+        self.user = User.objects.create_user('cashier')
+        self.materials_obj = Materials.objects.create(name='洗车液', original_price=10, price=20, discount_price=15,
+                                                      number=self.start_number)
+
+    def assert_ledger(self, numbers: list[int]) -> None:
+        self.materials_obj.refresh_from_db()
+        self.assertEqual(self.materials_obj.number, self.start_number + sum(numbers))
+        movements: list = list(StockMovement.objects.filter(materials=self.materials_obj).order_by('id'))
+        self.assertEqual(len(movements), len(numbers))
+        self.assertEqual(sum(movement.number for movement in movements), sum(numbers))
+        balance: int = self.start_number
+        for movement in movements:
+            balance += movement.number
+            self.assertEqual(movement.balance, balance)
+
+    def test_concurrent_cashier_save(self):
+        numbers: list = [index + 1 for index in range(self.thread_count)]
+
+        def sell(number: int) -> None:
+            Cashier(name_id=self.materials_obj.id, action=Choices.CashierChoice.incoming,
+                    price_type=Choices.MaterialsPriceType.price, number=number, create_by_user=self.user).save()
+
+        self.run_threads(sell, [(number,) for number in numbers])
+        self.assert_ledger([-number for number in numbers])
+        self.assertEqual(Cashier.objects.aggregate(number=Sum('number'))['number'], sum(numbers))
+
+    def test_concurrent_adjust_number(self):
+        # 入库与出库交替
+        numbers: list = [(index + 1) * (1 if index % 2 else -1) for index in range(self.thread_count)]
+
+        def adjust(number: int) -> None:
+            with transaction.atomic():
+                Materials.objects.select_for_update().get(id=self.materials_obj.id).adjust_number(
+                    number, create_by_user_id=self.user.id)
+
+        self.run_threads(adjust, [(number,) for number in numbers])
+        self.assert_ledger(numbers)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class LowStockConcurrencyTests(ConcurrencyTestCase):
+    """
+    并发出库越过补货提醒数量时只写入一条补货提醒
+    """
+
+    def test_concurrent_sales_notify_once(self):
+        user = User.objects.create_user('cashier')
+        materials_obj = Materials.objects.create(name='洗车液', price=20, number=self.thread_count + 2,
+                                                 reorder_threshold=self.thread_count // 2)
+
+        def sell() -> None:
+            Cashier(name_id=materials_obj.id, action=Choices.CashierChoice.incoming,
+                    price_type=Choices.MaterialsPriceType.price, number=1, create_by_user=user).save()
+
+        self.run_threads(sell, [()] * self.thread_count)
+        materials_obj.refresh_from_db()
+        self.assertEqual(materials_obj.number, 2)
+        self.assertTrue(materials_obj.is_low_stock)
+        self.assertEqual(LowStockNotification.objects.filter(materials=materials_obj).count(), 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CheckInConcurrencyTests(ConcurrencyTestCase):
+    """
+    多个收银台同时为同一会员消费, 成功次数不超过会员价次数
+    """
+
+    def test_concurrent_check_in(self):
+        member_frequency: int = self.thread_count // 2
+        users_obj = Users.objects.create(name='张三', user_level=Choices.IsMembersChoice.member,
+                                         member_frequency=member_frequency)
+        results: list = list()
+
+        def check_in() -> None:
+            try:
+                results.append(Users.check_in(user_id=users_obj.id)['remaining'])
+            except ValidationError:
+                results.append(None)
+
+        self.run_threads(check_in, [()] * self.thread_count)
+        self.assertEqual(sorted(result for result in results if result is not None), list(range(member_frequency)))
+        users_obj.refresh_from_db()
+        self.assertEqual(users_obj.using_frequency, member_frequency)
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'xicheba'
+
+urlpatterns = [
+    path('cashier/bulk/', views.cashier_bulk_book, name='cashier_bulk_book'),
+    path('users/check-in/', views.users_check_in, name='users_check_in'),
+    path('dashboard/revenue/', views.dashboard_revenue, name='dashboard_revenue'),
+    path('dashboard/low-stock/', views.dashboard_low_stock, name='dashboard_low_stock'),
+    path('dashboard/members-near-limit/', views.dashboard_members_near_limit, name='dashboard_members_near_limit'),
+    path('metrics/', views.metrics, name='metrics'),
+]
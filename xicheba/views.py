@@ -1,3 +1,194 @@
-from django.shortcuts import render
+import functools
+import json
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import ValidationError
+from django.db.models import F, Sum
+from django.conf import settings
+from django.http import JsonResponse, HttpResponseNotAllowed, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+
+from .middleware import view_metrics
+from .models import Cashier, Users, Materials, Choices, CashierDailySummary, ExtraProjectDailySummary
+from .registry import reference_cache, count_cache
+
+
+@staff_member_required
+@require_POST
+def cashier_bulk_book(request):
+    """
+    批量记账
+    请求体: {"lines": [{"name": 材料id, "action": "incoming", "price_type": "price", "number": 1, "remarks": ""}]}
+    :param request:
+    :return: 新增数量与总金额
+    """
+    if not request.user.has_perm('xicheba.add_cashier'):
+        return JsonResponse({'errors': ['没有记账权限']}, status=403)
+    try:
+        lines: list = json.loads(request.body)['lines']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'errors': ['请求体格式有误']}, status=400)
+    if not isinstance(lines, list) or not lines:
+        return JsonResponse({'errors': ['lines 不能为空']}, status=400)
+    try:
+        objs: list = Cashier.bulk_book(lines, user=request.user)
+    except ValidationError as validationError:
+        return JsonResponse({'errors': validationError.messages}, status=400)
+    return JsonResponse({'count': len(objs), 'money': sum(obj.money for obj in objs)})
+
+
+@staff_member_required
+@require_POST
+def users_check_in(request):
+    """
+    会员到店消费一次
+    请求体: {"id": 客户id} 或 {"phone_number": "手机号码"}
+    :param request:
+    :return: 客户消费次数与剩余次数
+    """
+    if not request.user.has_perm('xicheba.change_users'):
+        return JsonResponse({'errors': ['没有修改客户权限']}, status=403)
+    try:
+        body: dict = json.loads(request.body)
+        user_id = int(body['id']) if body.get('id') is not None else None
+        phone_number = body.get('phone_number')
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'errors': ['请求体格式有误']}, status=400)
+    if user_id is None and not phone_number:
+        return JsonResponse({'errors': ['请传入客户 id 或手机号码']}, status=400)
+    try:
+        row: dict = Users.check_in(user_id=user_id, phone_number=phone_number)
+    except Users.DoesNotExist as doesNotExist:
+        return JsonResponse({'errors': [str(doesNotExist)]}, status=404)
+    except Users.MultipleObjectsReturned as multipleObjectsReturned:
+        return JsonResponse({'errors': [str(multipleObjectsReturned)]}, status=409)
+    except ValidationError as validationError:
+        return JsonResponse({'errors': validationError.messages}, status=409)
+    return JsonResponse(row)
+
+
+def async_staff_member_required(view_func):
+    """
+    异步视图的 staff_member_required, request.user 的会话查询放到线程中执行
+    """
+
+    @functools.wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        is_staff: bool = await sync_to_async(lambda: request.user.is_active and request.user.is_staff)()
+        if not is_staff:
+            return JsonResponse({'errors': ['请先登录']}, status=403)
+        return await view_func(request, *args, **kwargs)
+
+    return _wrapped_view
+
+
+def async_require_GET(view_func):
+    """
+    异步视图的 require_GET
+    """
+
+    @functools.wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        if request.method != 'GET':
+            return HttpResponseNotAllowed(['GET'])
+        return await view_func(request, *args, **kwargs)
+
+    return _wrapped_view
+
+
+def get_int_param(request, name: str, default: int) -> int:
+    try:
+        return int(request.GET.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+@async_require_GET
+@async_staff_member_required
+async def dashboard_revenue(request):
+    """
+    今日收入、支出、收益与散项金额, 只查询日汇总表
+    :param request:
+    :return:
+    """
+    today = timezone.localdate()
+    cashier: dict = dict()
+    async for row in CashierDailySummary.objects.filter(day=today).values('action').annotate(
+            total_money=Sum('money'), total_earnings=Sum('earnings'), total_count=Sum('count')).order_by():
+        cashier[row['action']] = row
+    extra: dict = await ExtraProjectDailySummary.objects.filter(day=today).aaggregate(
+        total_money=Sum('money'), total_count=Sum('count'))
+    incoming: dict = cashier.get(Choices.CashierChoice.incoming, dict())
+    outgoing: dict = cashier.get(Choices.CashierChoice.outgoing, dict())
+    return JsonResponse({
+        'day': today.isoformat(),
+        'incoming': incoming.get('total_money') or 0,
+        'outgoing': outgoing.get('total_money') or 0,
+        'earnings': incoming.get('total_earnings') or 0,
+        'cashier_count': (incoming.get('total_count') or 0) + (outgoing.get('total_count') or 0),
+        'extra_project': extra['total_money'] or 0,
+        'extra_project_count': extra['total_count'] or 0,
+    })
+
+
+@async_require_GET
+@async_staff_member_required
+async def dashboard_low_stock(request):
+    """
+    库存不足的材料, 默认按 is_low_stock 索引查询, ?number=5 时查询数量小于等于该值的材料
+    :param request:
+    :return:
+    """
+    queryset = Materials.objects.filter(is_low_stock=True)
+    if 'number' in request.GET:
+        queryset = Materials.objects.filter(number__lte=get_int_param(request, 'number', 0))
+    materials: list = [
+        row async for row in queryset.order_by('number').values(
+            'id', 'name', 'specifications', 'number', 'reorder_threshold')[:100]
+    ]
+    return JsonResponse({'materials': materials})
+
+
+@async_require_GET
+@async_staff_member_required
+async def dashboard_members_near_limit(request):
+    """
+    剩余会员价次数不多的会员, ?remaining=1 剩余次数小于等于该值
+    :param request:
+    :return:
+    """
+    remaining: int = get_int_param(request, 'remaining', 1)
+    members: list = [
+        row async for row in Users.objects.filter(
+            user_level=Choices.IsMembersChoice.member, using_frequency__gte=F('member_frequency') - remaining
+        ).annotate(remaining=F('member_frequency') - F('using_frequency')).order_by('remaining').values(
+            'id', 'name', 'phone_number', 'member_frequency', 'using_frequency', 'remaining')[:100]
+    ]
+    return JsonResponse({'members': members})
+
+
+def metrics(request):
+    """
+    Prometheus 文本格式的请求指标与缓存命中次数, 为当前进程的累计值
+    :param request:
+    :return:
+    """
+    token: str = settings.XICHEBA_METRICS_TOKEN
+    authorization: str = request.headers.get('Authorization', '')
+    if token:
+        if not constant_time_compare(authorization, F'Bearer {token}'):
+            return HttpResponse(status=403)
+    elif not (request.user.is_active and request.user.is_staff):
+        return HttpResponse(status=403)
+    lines: list = [
+        '# HELP xicheba_cache_requests_total 缓存请求次数, result: hits 进程内命中 shared_hits 共享缓存命中 misses 查询数据库',
+        '# TYPE xicheba_cache_requests_total counter',
+    ]
+    for cache_name, stats in (('reference', reference_cache.stats()), ('count', count_cache.stats())):
+        for result, value in stats.items():
+            lines.append(F'xicheba_cache_requests_total{{cache="{cache_name}",result="{result}"}} {value}')
+    return HttpResponse(view_metrics.render() + '\n'.join(lines) + '\n',
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,220 @@
+/*
+ 已有数据库升级脚本: 从初始版本的 xicheba.sql 升级到当前版本, 新建数据库直接执行 xicheba.sql 即可
+ 执行前备份数据库, 按顺序只执行一次:
+
+   mysqldump shuancheng > shuancheng_backup.sql
+   mysql shuancheng < xicheba_upgrade.sql
+
+ 执行后运行(第 8 步之后的数据回填):
+
+   python manage.py migrate                       # 新模型的 content type 与权限
+   python manage.py rebuild_search_index          # 客户、材料的拼音与手机号倒序列
+   python manage.py recompute_earnings --snapshot # 历史出纳明细按材料当前价格记录价格快照
+   python manage.py rebuild_summary               # 出纳、散项日汇总与 changelist 按日索引
+   python manage.py reconcile_stock --full        # 建立库存检查点, 查看材料数量与出纳明细的差异, 确认后加 --fix 修正
+
+ 出纳、散项明细按月分区为可选升级, 见 python manage.py partition_ledger --convert --dry-run
+*/
+
+
+-- 1. create_by_user 与 Cashier.name 改为外键, 增加 changelist 的复合索引
+--    非超级用户 changelist: filter(create_by_user=...).exclude(is_deleted=True) + date_hierarchy, 超级用户: date_hierarchy
+--    SQLite 压测(bench_seed 生成数据, 5 个创建用户, 中位数 ms, 无索引 -> 有索引):
+--                          10万行           100万行
+--    出纳 本人第一页         30.9 -> 2.5      263.4 -> 2.2
+--    出纳 本人总数           19.6 -> 2.2      183.4 -> 18.4
+--    出纳 本人按月第一页     26.0 -> 1.9      202.3 -> 1.1
+--    出纳 超级用户按月第一页 28.6 -> 1.7      264.4 -> 1.0
+--    散项 本人第一页          8.4 -> 1.3       88.8 -> 1.2
+--    客户 本人第一页          2.8 -> 1.5       29.2 -> 1.2
+
+UPDATE `xicheba_cashier` SET `name` = SUBSTRING_INDEX(`name`, '-', 1);
+ALTER TABLE `xicheba_cashier` MODIFY `name` bigint(20) NOT NULL, MODIFY `create_by_user` int(11) DEFAULT NULL;
+ALTER TABLE `xicheba_users` MODIFY `create_by_user` int(11) DEFAULT NULL;
+ALTER TABLE `xicheba_extraproject` MODIFY `create_by_user` int(11) DEFAULT NULL;
+UPDATE `xicheba_cashier` SET `create_by_user` = NULL WHERE `create_by_user` NOT IN (SELECT `id` FROM `auth_user`);
+UPDATE `xicheba_users` SET `create_by_user` = NULL WHERE `create_by_user` NOT IN (SELECT `id` FROM `auth_user`);
+UPDATE `xicheba_extraproject` SET `create_by_user` = NULL WHERE `create_by_user` NOT IN (SELECT `id` FROM `auth_user`);
+
+ALTER TABLE `xicheba_cashier`
+  ADD KEY `xicheba_cashier_name_fk_xicheba_materials_id` (`name`),
+  ADD KEY `cashier_owner_live_idx` (`create_by_user`,`is_deleted`,`create_time`),
+  ADD KEY `cashier_create_time_idx` (`create_time`),
+  ADD CONSTRAINT `xicheba_cashier_name_fk_xicheba_materials_id` FOREIGN KEY (`name`) REFERENCES `xicheba_materials` (`id`),
+  ADD CONSTRAINT `xicheba_cashier_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`);
+ALTER TABLE `xicheba_users`
+  ADD KEY `users_owner_live_idx` (`create_by_user`,`is_deleted`,`create_time`),
+  ADD KEY `users_create_time_idx` (`create_time`),
+  ADD CONSTRAINT `xicheba_users_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`);
+ALTER TABLE `xicheba_extraproject`
+  ADD KEY `extraproject_owner_live_idx` (`create_by_user`,`is_deleted`,`create_time`),
+  ADD KEY `extraproject_create_time_idx` (`create_time`),
+  ADD CONSTRAINT `xicheba_extraproject_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`);
+
+
+-- 2. 库存流水
+
+CREATE TABLE `xicheba_stockmovement` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `number` int(11) NOT NULL,
+  `balance` int(11) NOT NULL,
+  `create_time` datetime(6) NOT NULL,
+  `cashier_id` bigint(20) DEFAULT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `xicheba_stockmovement_cashier_id_fk_xicheba_cashier_id` (`cashier_id`),
+  KEY `xicheba_stockmovement_create_by_user_fk_auth_user_id` (`create_by_user`),
+  KEY `xicheba_stockmovement_materials_id_fk_xicheba_materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_stockmovement_cashier_id_fk_xicheba_cashier_id` FOREIGN KEY (`cashier_id`) REFERENCES `xicheba_cashier` (`id`),
+  CONSTRAINT `xicheba_stockmovement_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`),
+  CONSTRAINT `xicheba_stockmovement_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- 3. 出纳、散项日汇总, 数据由 rebuild_summary 回填; 唯一索引以 0 代替为空的创建用户, 函数索引需要 MySQL 8.0.13
+
+CREATE TABLE `xicheba_cashierdailysummary` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `day` date NOT NULL,
+  `count` int(11) NOT NULL,
+  `number` int(11) NOT NULL,
+  `money` int(11) NOT NULL,
+  `action` varchar(10) NOT NULL,
+  `earnings` int(11) NOT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `cashier_daily_summary_uniq` (`day`,`materials_id`,`action`,((coalesce(`create_by_user`,0)))),
+  KEY `xicheba_cashierdailysummary_create_by_user_fk_auth_user_id` (`create_by_user`),
+  KEY `xicheba_cashierdailysummary_materials_id_fk_xicheba_materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_cashierdailysummary_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`),
+  CONSTRAINT `xicheba_cashierdailysummary_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE `xicheba_extraprojectdailysummary` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `day` date NOT NULL,
+  `count` int(11) NOT NULL,
+  `number` int(11) NOT NULL,
+  `money` int(11) NOT NULL,
+  `action` varchar(30) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `extraproject_daily_summary_uniq` (`day`,`action`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- 4. 逻辑删除明细的归档
+
+CREATE TABLE `xicheba_archivedrecord` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `model` varchar(50) NOT NULL,
+  `object_id` bigint(20) NOT NULL,
+  `data` json NOT NULL,
+  `delete_time` datetime(6) NOT NULL,
+  `create_time` datetime(6) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `archivedrecord_object_idx` (`model`,`object_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- 5. 客户、材料的拼音与手机号倒序查询列, 数据由 rebuild_search_index 回填
+
+ALTER TABLE `xicheba_users`
+  ADD `name_pinyin` varchar(128) NOT NULL DEFAULT '',
+  ADD `name_initials` varchar(20) NOT NULL DEFAULT '',
+  ADD `phone_number_reversed` varchar(11) DEFAULT NULL,
+  ADD KEY `xicheba_users_name_idx` (`name`),
+  ADD KEY `xicheba_users_name_pinyin_idx` (`name_pinyin`),
+  ADD KEY `xicheba_users_name_initials_idx` (`name_initials`),
+  ADD KEY `xicheba_users_phone_number_idx` (`phone_number`),
+  ADD KEY `xicheba_users_phone_number_reversed_idx` (`phone_number_reversed`);
+ALTER TABLE `xicheba_materials`
+  ADD `name_pinyin` varchar(128) NOT NULL DEFAULT '',
+  ADD `name_initials` varchar(15) NOT NULL DEFAULT '',
+  ADD KEY `xicheba_materials_name_idx` (`name`),
+  ADD KEY `xicheba_materials_name_pinyin_idx` (`name_pinyin`),
+  ADD KEY `xicheba_materials_name_initials_idx` (`name_initials`);
+
+
+-- 6. 材料补货提醒
+
+ALTER TABLE `xicheba_materials`
+  ADD `reorder_threshold` int(11) NOT NULL DEFAULT 0,
+  ADD `is_low_stock` tinyint(1) NOT NULL DEFAULT 0,
+  ADD KEY `xicheba_materials_is_low_stock_idx` (`is_low_stock`);
+
+CREATE TABLE `xicheba_lowstocknotification` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `number` int(11) NOT NULL,
+  `reorder_threshold` int(11) NOT NULL,
+  `sent_time` datetime(6) DEFAULT NULL,
+  `create_time` datetime(6) NOT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `lowstock_outbox_idx` (`sent_time`,`id`),
+  KEY `xicheba_lowstocknotification_materials_id_fk_xicheba_materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_lowstocknotification_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- 7. changelist 按日索引, 数据由 rebuild_summary 回填; 唯一索引同第 3 步
+
+CREATE TABLE `xicheba_changelistdateindex` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `model` varchar(50) NOT NULL,
+  `day` date NOT NULL,
+  `count` int(11) NOT NULL,
+  `live_count` int(11) NOT NULL,
+  `create_by_user` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `changelist_date_index_uniq` (`model`,`day`,((coalesce(`create_by_user`,0)))),
+  KEY `xicheba_changelistdateindex_create_by_user_fk_auth_user_id` (`create_by_user`),
+  CONSTRAINT `xicheba_changelistdateindex_create_by_user_fk_auth_user_id` FOREIGN KEY (`create_by_user`) REFERENCES `auth_user` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- 8. 出纳明细价格快照, 数据由 recompute_earnings --snapshot 回填
+
+ALTER TABLE `xicheba_cashier`
+  ADD `unit_price` int(11) NOT NULL DEFAULT 0,
+  ADD `original_price` int(11) NOT NULL DEFAULT 0;
+
+
+-- 9. 客户消费次数状态、出纳收益状态的过滤索引
+
+ALTER TABLE `xicheba_users`
+  ADD KEY `users_frequency_status_idx` (`user_level`,`using_frequency`,`member_frequency`);
+ALTER TABLE `xicheba_cashier`
+  ADD KEY `cashier_earnings_status_idx` (`action`,`earnings`,`price_type`);
+
+
+-- 10. 本地收银队列的同步回执, 队列表 xicheba_posjournal 只在终端的 SQLite 中, 首次使用时自动创建
+
+CREATE TABLE `xicheba_possyncreceipt` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `idempotency_key` varchar(32) NOT NULL,
+  `terminal` varchar(50) NOT NULL,
+  `object_id` bigint(20) NOT NULL,
+  `create_time` datetime(6) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `idempotency_key` (`idempotency_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+
+-- 11. 库存核对检查点, 由 reconcile_stock --full 建立
+
+ALTER TABLE `xicheba_cashier`
+  ADD KEY `cashier_update_time_idx` (`update_time`,`create_time`);
+
+CREATE TABLE `xicheba_stockcheckpoint` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `opening` int(11) NOT NULL,
+  `closed` int(11) NOT NULL,
+  `cutoff` datetime(6) DEFAULT NULL,
+  `checked_time` datetime(6) DEFAULT NULL,
+  `materials_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `materials_id` (`materials_id`),
+  CONSTRAINT `xicheba_stockcheckpoint_materials_id_fk_xicheba_materials_id` FOREIGN KEY (`materials_id`) REFERENCES `xicheba_materials` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;